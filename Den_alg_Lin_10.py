@@ -1,12 +1,6 @@
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import ConstantKernel as C, Matern
-from xgboost import XGBRegressor
-import tkinter as tk
-from tkinter import filedialog, messagebox
-from matplotlib.widgets import CheckButtons
+
+from batch_gpr import fit_predict_batch, extrapolate_monotonic
 
 # Define pitches and initial values as empty
 pitches = ["C4", "Db4", "D4", "Eb4", "E4", "F4", "F#4", "G4", "Ab4", "A4", "Bb4", "B4",
@@ -16,80 +10,75 @@ pp_values = []
 mf_values = []
 ff_values = []
 
-# Load data from Excel
+# Load data from Excel (lido e validado por tabelas_instrumentos, com cache binária)
 def load_excel_data():
     global pp_values, mf_values, ff_values
-    file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx;*.xls")])
+    from tkinter import filedialog, messagebox
+    from tabelas_instrumentos import carregar_tabela
+    file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx;*.xls"), ("CSV/Parquet", "*.csv;*.parquet")])
     if file_path:
         try:
-            df = pd.read_excel(file_path, header=0)
-            if 'Notes' in df.columns:
-                notes = df['Notes'].tolist()
-                corrected_notes = [note.strip() for note in notes]
-                if corrected_notes != pitches:
-                    differences = [f"Arquivo: '{n}', Esperado: '{p}'" for n, p in zip(corrected_notes, pitches) if n != p]
-                    messagebox.showerror("Erro", f"As notas no arquivo não correspondem às esperadas. Diferenças: {differences}")
-                    return
-
-            pp_values = df['pp'].fillna(0).tolist()
-            mf_values = df['mf'].fillna(0).tolist()
-            ff_values = df['ff'].fillna(0).tolist()
-            pp_values, mf_values, ff_values = pp_values[:len(pitches)], mf_values[:len(pitches)], ff_values[:len(pitches)]
-
-            messagebox.showinfo("Sucesso", "Dados carregados com sucesso!")
-            start_analysis()
+            tabela = carregar_tabela(file_path, pitches)
+        except ValueError as e:
+            messagebox.showerror("Erro", str(e))
+            return
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao carregar o arquivo: {e}")
+            return
 
-# Main analysis function
-def start_analysis():
-    if not (pp_values and mf_values and ff_values):
-        messagebox.showerror("Erro", "Por favor, insira ou carregue os valores para pp, mf e ff antes de iniciar a análise.")
-        return
+        pp_values, mf_values, ff_values = (coluna.tolist() for coluna in tabela.valores.T)
+        messagebox.showinfo("Sucesso", "Dados carregados com sucesso!")
+        start_analysis()
 
+# Fitting of all nine dynamics from the measured pp, mf and ff values (no GUI)
+def fit_dynamics(pp_values, mf_values, ff_values):
+    """Returns {dynamic: values per pitch} for pppp..ffff, fitted for all pitches at once."""
     dynamic_levels = {"pppp": 1, "ppp": 2, "pp": 3, "p": 4, "mf": 5, "f": 6, "ff": 7, "fff": 8, "ffff": 9}
     existing_dynamics = ["pp", "mf", "ff"]
-    intermediate_predictions = {"ppp": [], "p": [], "f": [], "fff": []}
-    extreme_predictions = {"pppp": [], "ffff": []}
     existing_levels = np.array([dynamic_levels[d] for d in existing_dynamics]).reshape(-1, 1)
     combined_values = np.array([pp_values, mf_values, ff_values])
 
-    # GPR with Matern kernel for intermediate dynamics
-    matern_kernel = C(1.0, (1e-4, 1e4)) * Matern(length_scale=1.0, length_scale_bounds=(1e-2, 1e4), nu=1.5)
-    gpr = GaussianProcessRegressor(kernel=matern_kernel, n_restarts_optimizer=10, alpha=1e-1)
-
-    # Predictions for each pitch
-    for i in range(len(pitches)):
-        y_train = combined_values[:, i]
-        
-        # Fit GPR with Matern kernel for intermediate levels
-        gpr.fit(existing_levels, y_train)
-        intermediate_levels = np.array([dynamic_levels[d] for d in ["ppp", "p", "f", "fff"]]).reshape(-1, 1)
-        y_intermediate = gpr.predict(intermediate_levels)
-        for level, value in zip(["ppp", "p", "f", "fff"], y_intermediate):
-            intermediate_predictions[level].append(value)
-
-        # XGBoost model without monotonic constraints
-        xgb_model = XGBRegressor(objective='reg:squarederror', random_state=42, 
-                                 learning_rate=0.1, max_depth=3, n_estimators=100)
-        
-        # Fit model and predict pppp and ffff without constraints
-        xgb_model.fit(existing_levels, y_train)
-        y_extreme_pppp = xgb_model.predict([[dynamic_levels["pppp"]]])
-        y_extreme_ffff = xgb_model.predict([[dynamic_levels["ffff"]]])
-
-        # Manual adjustments for monotonic constraints
-        pppp_value = min(y_extreme_pppp[0], y_intermediate[0] - 1e-6)  # Ensure pppp < ppp
-        ffff_value = max(y_extreme_ffff[0], y_intermediate[3] + 1e-6)  # Ensure ffff > fff
-
-        extreme_predictions["pppp"].append(pppp_value)
-        extreme_predictions["ffff"].append(ffff_value)
-
-    dynamic_values = {**{"pp": pp_values, "mf": mf_values, "ff": ff_values}, **intermediate_predictions, **extreme_predictions}
-    plot_results(dynamic_values)
+    # GPR with Matern kernel for intermediate dynamics, fitted for all pitches at once
+    intermediate_levels = [dynamic_levels[d] for d in ["ppp", "p", "f", "fff"]]
+    y_intermediate_all, _ = fit_predict_batch(existing_levels.ravel(), combined_values.T, intermediate_levels,
+                                              nu=1.5, alpha=1e-1, length_scale_bounds=(1e-2, 1e4),
+                                              amplitude_bounds=(1e-4, 1e4))
+
+    intermediate_predictions = {level: column.tolist() for level, column in zip(["ppp", "p", "f", "fff"], y_intermediate_all.T)}
+
+    # pppp and ffff extrapolated for all pitches in one pass; ordering pppp < ppp and ffff > fff is built in
+    ordered_levels = [dynamic_levels[d] for d in ["ppp", "pp", "p", "mf", "f", "ff", "fff"]]
+    ordered_values = np.column_stack([y_intermediate_all[:, 0], combined_values[0], y_intermediate_all[:, 1],
+                                      combined_values[1], y_intermediate_all[:, 2], combined_values[2],
+                                      y_intermediate_all[:, 3]])
+    pppp_values, ffff_values = extrapolate_monotonic(ordered_levels, ordered_values,
+                                                     dynamic_levels["pppp"], dynamic_levels["ffff"])
+    extreme_predictions = {"pppp": pppp_values.tolist(), "ffff": ffff_values.tolist()}
+
+    return {**{"pp": pp_values, "mf": mf_values, "ff": ff_values}, **intermediate_predictions, **extreme_predictions}
+
+# Headless fitting of every table in a directory
+def fit_directory(directory, grid=pitches, workers=None):
+    """Returns ({table name: fit_dynamics(...)}, {table name: error}) for the tables in directory."""
+    from tabelas_instrumentos import carregar_diretorio
+    tables, errors = carregar_diretorio(directory, grid, workers)
+    return {name: fit_dynamics(*table.valores.T.tolist()) for name, table in tables.items()}, errors
+
+# Main analysis function
+def start_analysis():
+    from tkinter import messagebox
+
+    if not (pp_values and mf_values and ff_values):
+        messagebox.showerror("Erro", "Por favor, insira ou carregue os valores para pp, mf e ff antes de iniciar a análise.")
+        return
+
+    plot_results(fit_dynamics(pp_values, mf_values, ff_values))
 
 # Plotting function with interactive features
 def plot_results(dynamic_values):
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import CheckButtons
+
     pitch_numeric = list(range(len(pitches)))
     fig, ax = plt.subplots(figsize=(12, 6))
     colors = ['darkviolet', 'deeppink', 'royalblue', 'dodgerblue', 'darkorange', 'crimson', 'dimgray', 'black', 'maroon']
@@ -124,6 +113,8 @@ def plot_results(dynamic_values):
 
 # Main Tkinter GUI
 def main():
+    import tkinter as tk
+
     root = tk.Tk()
     root.title("Análise de Densidade Espectral")
     load_button = tk.Button(root, text="Carregar Dados do Excel", command=load_excel_data)
@@ -1,138 +1,186 @@
 #Main.py
 
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, messagebox
-import importlib
-import numpy as np
-import matplotlib.pyplot as plt
 
-from densidade_intervalar import calcular_densidade_intervalar, obter_intervalos, lista_notas
-from advanced_density_analysis import calculate_spectral_moments, apply_kernel_density_estimation
+from densidade_intervalar import lista_notas
 from plot_metr_espectrais import extract_and_plot_metrics
-from flauta import calculate_max_possible_density
+from grafo_densidades import GrafoDensidades
+from instrumentos import DINAMICAS
 
 
-def converter_para_sustenido(nota):
+# Atraso (ms) entre a última alteração das linhas ou do peso e o recálculo automático
+ATRASO_RECALCULO_MS = 300
+# Intervalo (ms) com que o ciclo de eventos do Tk recolhe os resultados do trabalhador
+INTERVALO_RESULTADOS_MS = 30
+
+
+class TrabalhadorCalculo:
     """
-    Converte uma nota com bemol para sua equivalente em sustenido.
-    Exemplo: 'Db' -> 'C#'
+    Thread de fundo que calcula as densidades, um pedido de cada vez.
+
+    Só interessa o pedido mais recente: um pedido novo substitui o que ainda
+    estiver à espera e torna obsoleto o que estiver a ser calculado. Como uma
+    thread não pode ser interrompida, cancelar um cálculo em curso é descartar
+    o seu resultado. Os resultados voltam pela fila resultados, que é lida no
+    ciclo de eventos do Tk (os widgets só podem ser usados nessa thread).
+
+    Os cálculos passam por um GrafoDensidades, usado só nesta thread: de um
+    pedido para o seguinte só se recalcula o que depende do que mudou (mover o
+    slider do weight_factor só recalcula as densidades ponderada, refinada e total).
     """
-    equivalencias = {
-        'Cb': 'B', 'Db': 'C#', 'Eb': 'D#', 'Fb': 'E', 'Gb': 'F#',
-        'Ab': 'G#', 'Bb': 'A#',
-        'C-': 'B#', 'D-': 'C#+', 'E-': 'D#+', 'F-': 'E#+', 'G-': 'F#+',
-        'A-': 'G#+', 'B-': 'A#+',
-        'C+': 'B-', 'D+': 'C#-', 'E+': 'D#-', 'F+': 'E-', 'G+': 'F#-',
-        'A+': 'G#-', 'B+': 'A#-',
-    }
-
-    import re
-    correspondencia = re.match(r'([A-Ga-g][#b]?[-+]?)([0-9x]?)', nota)
-    if correspondencia:
-        base_nota, oitava = correspondencia.groups()
-        if base_nota in equivalencias:
-            base_nota = equivalencias[base_nota]
-        return f"{base_nota}{oitava}"
+
+    def __init__(self):
+        self.geracao = 0
+        self.resultados = queue.Queue()
+        self._pedido = None
+        self._condicao = threading.Condition()
+        self.grafo = GrafoDensidades()
+        threading.Thread(target=self._executar, name="calculo-densidade", daemon=True).start()
+
+    def pedir(self, argumentos, contexto):
+        with self._condicao:
+            self.geracao += 1
+            self._pedido = (self.geracao, argumentos, contexto)
+            self._condicao.notify()
+
+    def cancelar(self):
+        with self._condicao:
+            self.geracao += 1
+            self._pedido = None
+
+    def obsoleto(self, geracao):
+        return geracao != self.geracao
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                while self._pedido is None:
+                    self._condicao.wait()
+                geracao, argumentos, contexto = self._pedido
+                self._pedido = None
+            try:
+                resultado, erro = self.grafo.analisar(*argumentos), None
+            except Exception as e:
+                resultado, erro = None, e
+            if not self.obsoleto(geracao):
+                self.resultados.put((geracao, resultado, erro, contexto))
+
+
+def ler_linhas_ativas():
+    """Notas, dinâmicas, instrumentos, números de instrumentos e durações das linhas marcadas."""
+    ativas = [i for i in range(len(estados_vars)) if estados_vars[i].get() == 1]
+    # A conversão para sustenidos é feita no GrafoDensidades
+    notas = [f"{nota_vars[i].get()}{oitava_vars[i].get()}" for i in ativas]
+    dinamicas = [dinamica_vars[i].get() for i in ativas]
+    instrumentos = [instrumento_vars[i].get() for i in ativas]
+    numeros_instrumentos = [int(numero_instrumentos_vars[i].get()) for i in ativas]
+    duracoes = [int(duracao_vars[i].get()) for i in ativas]
+    return notas, dinamicas, instrumentos, numeros_instrumentos, duracoes
+
+
+def pedir_calculo(plotar):
+    """Lê as linhas e envia o cálculo ao trabalhador; com plotar, o pedido é do botão Calcular."""
+    try:
+        notas, dinamicas, instrumentos, numeros_instrumentos, duracoes = ler_linhas_ativas()
+    except ValueError as e:
+        mostrar_erro(e, plotar)
+        return
+    if not notas:
+        if plotar:
+            messagebox.showwarning("Input Error", "Please fill in all required fields.")
+        rotulo_estado.config(text="")
+        return
+
+    rotulo_estado.config(text="A calcular...")
+    trabalhador.pedir((notas, dinamicas, instrumentos, numeros_instrumentos, weight_factor_slider.get()),
+                      {"plotar": plotar, "duracoes": duracoes, "instrumentos": instrumentos,
+                       "numeros_instrumentos": numeros_instrumentos})
+
+
+def agendar_recalculo(*_):
+    """Chamado a cada alteração: cancela o cálculo em curso e recalcula quando as alterações param."""
+    global recalculo_agendado
+    if recalculo_agendado is not None:
+        raiz.after_cancel(recalculo_agendado)
+        recalculo_agendado = None
+    trabalhador.cancelar()
+    if recalculo_automatico.get():
+        recalculo_agendado = raiz.after(ATRASO_RECALCULO_MS, ao_expirar_atraso)
     else:
-        raise ValueError(f"Nota inválida: {nota}")
+        rotulo_estado.config(text="")
 
 
+def ao_expirar_atraso():
+    global recalculo_agendado
+    recalculo_agendado = None
+    pedir_calculo(plotar=False)
 
-# Helper function to convert note names to MIDI numbers
-def note_to_midi(note):
-    note_base = {
-        'C': 0, 'C#': 1, 'Db': 1, 'C#-': 0.5, 'C#+': 1.5,
-        'D': 2, 'D#': 3, 'Eb': 3, 'D#-': 2.5, 'D#+': 3.5,
-        'E': 4, 'F': 5, 'F#': 6, 'Gb': 6, 'F#-': 5.5, 'F#+': 6.5,
-        'G': 7, 'G#': 8, 'Ab': 8, 'G#-': 7.5, 'G#+': 8.5,
-        'A': 9, 'A#': 10, 'Bb': 10, 'A#-': 9.5, 'A#+': 10.5,
-        'B': 11, 'C-': 11.5, 'B#': 12, 'B#-': 11.5
-    }
-    pitch = note[:-1]
-    octave = int(note[-1])
-    midi_number = 12 * (octave + 1) + note_base[pitch]
-    return midi_number
 
-def midi_to_hz(midi_pitch):
-    return 440 * 2**((midi_pitch - 69) / 12)
+def ao_clicar_no_botao_calcular():
+    global recalculo_agendado
+    if recalculo_agendado is not None:
+        raiz.after_cancel(recalculo_agendado)
+        recalculo_agendado = None
+    pedir_calculo(plotar=True)
 
-def load_instrument_module(instrument_name):
-    try:
-        module = importlib.import_module(instrument_name)
-        return module
-    except ModuleNotFoundError:
-        raise ImportError(f"Module for {instrument_name} not found.")
 
-def ao_clicar_no_botao_calcular():
-    try:
-        # Convertendo notas para o formato sustenido
-        notas = [
-            converter_para_sustenido(f"{nota_vars[i].get()}{oitava_vars[i].get()}")
-            for i in range(len(nota_vars)) if estados_vars[i].get() == 1
-        ]
-        dinamicas = [dinamica_vars[i].get() for i in range(len(dinamica_vars)) if estados_vars[i].get() == 1]
-        instrumentos = [instrumento_vars[i].get() for i in range(len(instrumento_vars)) if estados_vars[i].get() == 1]
-        numeros_instrumentos = [int(numero_instrumentos_vars[i].get()) for i in range(len(numero_instrumentos_vars)) if estados_vars[i].get() == 1]
-        duracoes = [int(dur.get()) for dur, est in zip(duracao_vars, estados_vars) if est.get() == 1]
-
-        if not notas or not dinamicas or not instrumentos or not numeros_instrumentos:
-            messagebox.showwarning("Input Error", "Please fill in all required fields.")
-            return
+def ao_clicar_no_botao_cancelar():
+    trabalhador.cancelar()
+    rotulo_estado.config(text="Cancelado")
 
-        densidade_intervalar_val = calcular_densidade_intervalar(notas)
-        instrument_module = load_instrument_module(instrumentos[0])
-        densidades_instrumento = []
 
-        for nota, dinamica, num in zip(notas, dinamicas, numeros_instrumentos):
-            if dinamica in ['pp', 'mf', 'ff']:
-                densidade = instrument_module.calcular_densidade(nota, dinamica)
-            else:
-                pp_value = instrument_module.calcular_densidade(nota, 'pp')
-                mf_value = instrument_module.calcular_densidade(nota, 'mf')
-                ff_value = instrument_module.calcular_densidade(nota, 'ff')
-                predicted_values = instrument_module.predict_intermediate_dynamics([nota], [pp_value], [mf_value], [ff_value])
-                densidade = predicted_values[dinamica][0]
-            scaled_density = densidade * np.sqrt(num)
-            densidades_instrumento.append(scaled_density)
-
-        densidade_instrumento_val = sum(densidades_instrumento)
-        weight_factor = weight_factor_slider.get()
-        densidade_ponderada_val = (densidade_instrumento_val * weight_factor) + (densidade_intervalar_val * (1 - weight_factor))
-
-        pitches = [note_to_midi(nota) for nota in notas]
-        amplitude = max(pitches) - min(pitches)
-        densidade_refinada_val = densidade_ponderada_val / amplitude if amplitude != 0 else densidade_ponderada_val
-
-        result = calculate_spectral_moments(pitches, densidades_instrumento)
-        spectral_centroid_freq = result["spectral_centroid"]["frequency"]
-        spectral_centroid_note = result["spectral_centroid"]["note"]
-        spectral_spread_deviation = result["spectral_spread"]["deviation"]
-        spectral_skewness = result.get("spectral_skewness", np.nan)
-
-        max_possible_density = instrument_module.calculate_max_possible_density(notas, dinamicas, numeros_instrumentos)
-        densidade_total_val = (densidade_refinada_val * spectral_spread_deviation) / max_possible_density if max_possible_density != 0 else densidade_refinada_val
-
-        texto_resultado.delete(1.0, tk.END)
-        output_string = (f"Densidade Intervalar: {densidade_intervalar_val:.4f}\n"
-                         f"Densidade do Instrumento: {densidade_instrumento_val:.4f}\n"
-                         f"Densidade Ponderada: {densidade_ponderada_val:.4f}\n"
-                         f"Densidade Refinada: {densidade_refinada_val:.4f}\n"
-                         f"Densidade Total: {densidade_total_val:.4f}\n"
-                         f"Spectral Centroid Frequency: {spectral_centroid_freq:.2f} Hz, Note: {spectral_centroid_note}\n"
-                         f"Spectral Spread: ±{spectral_spread_deviation:.2f} Hz\n"
-                         f"Spectral Skewness: {spectral_skewness:.4f}\n")
-                     
-        texto_resultado.insert(tk.END, output_string)
-
-        extract_and_plot_metrics(notas, duracoes, instrumentos, numeros_instrumentos, densidades_instrumento)
+def mostrar_erro(erro, plotar):
+    # No recálculo automático os erros (por exemplo, uma nota a meio de ser escrita) só aparecem no estado
+    if not plotar:
+        rotulo_estado.config(text=f"Erro: {erro}")
+    elif isinstance(erro, ValueError):
+        messagebox.showerror("Nota Inválida", str(erro))
+    else:
+        messagebox.showerror("Erro", f"Erro ao calcular e plotar métricas: {erro}")
 
-    except ValueError as e:
-        messagebox.showerror("Nota Inválida", str(e))
-    except Exception as e:
-        messagebox.showerror("Erro", f"Erro ao calcular e plotar métricas: {e}")
 
+def recolher_resultados():
+    """Mostra os resultados que o trabalhador terminou; corre periodicamente no ciclo do Tk."""
+    try:
+        while True:
+            geracao, resultado, erro, contexto = trabalhador.resultados.get_nowait()
+            if trabalhador.obsoleto(geracao):
+                continue
+            if erro is not None:
+                rotulo_estado.config(text="")
+                mostrar_erro(erro, contexto["plotar"])
+            else:
+                mostrar_resultado(resultado, contexto)
+    except queue.Empty:
+        pass
+    raiz.after(INTERVALO_RESULTADOS_MS, recolher_resultados)
 
 
+def mostrar_resultado(resultado, contexto):
+    rotulo_estado.config(text="Pronto")
+    texto_resultado.delete(1.0, tk.END)
+    output_string = (f"Densidade Intervalar: {resultado['densidade_intervalar']:.4f}\n"
+                     f"Densidade do Instrumento: {resultado['densidade_instrumento']:.4f}\n"
+                     f"Densidade Ponderada: {resultado['densidade_ponderada']:.4f}\n"
+                     f"Densidade Refinada: {resultado['densidade_refinada']:.4f}\n"
+                     f"Densidade Total: {resultado['densidade_total']:.4f}\n"
+                     f"Spectral Centroid Frequency: {resultado['spectral_centroid_freq']:.2f} Hz, "
+                     f"Note: {resultado['spectral_centroid_note']}\n"
+                     f"Spectral Spread: ±{resultado['spectral_spread']:.2f} Hz\n"
+                     f"Spectral Skewness: {resultado['spectral_skewness']:.4f}\n")
+    texto_resultado.insert(tk.END, output_string)
+
+    # Os gráficos só saem do botão Calcular e são desenhados nesta thread (a do Tk)
+    if contexto["plotar"]:
+        try:
+            extract_and_plot_metrics(resultado["notas"], contexto["duracoes"], contexto["instrumentos"],
+                                     contexto["numeros_instrumentos"], resultado["densidades_instrumento"])
+        except Exception as e:
+            messagebox.showerror("Erro", f"Erro ao calcular e plotar métricas: {e}")
+
 
 def ao_clicar_no_botao_limpar():
     for var in nota_vars:
@@ -150,6 +198,7 @@ def ao_clicar_no_botao_limpar():
     for var in duracao_vars:
         var.set('1')
     texto_resultado.delete(1.0, tk.END)
+    rotulo_estado.config(text="")
 
 def toggle_state(index):
     state = 'normal' if estados_vars[index].get() == 1 else 'disabled'
@@ -160,90 +209,116 @@ def toggle_state(index):
     numero_instrumentos_menus[index].config(state=state)
     duracao_menus[index].config(state=state)
 
-raiz = tk.Tk()
-raiz.title("Calculadora de Densidade Integrada")
-
-canvas = tk.Canvas(raiz)
-scroll_y = tk.Scrollbar(raiz, orient="vertical", command=canvas.yview)
-frame_entrada = tk.Frame(canvas)
-canvas.create_window((0, 0), window=frame_entrada, anchor="nw")
-canvas.configure(yscrollcommand=scroll_y.set)
-canvas.pack(side="left", fill="both", expand=True)
-scroll_y.pack(side="right", fill="y")
-
-frame_entrada.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
-
-slider_label = tk.Label(raiz, text="Adjust Weight Factor (Instrument vs Interval Density)")
-slider_label.pack(pady=(10, 0))
-weight_factor_slider = tk.Scale(raiz, from_=0, to=1, orient="horizontal", resolution=0.01)
-weight_factor_slider.set(0.5)
-weight_factor_slider.pack()
-
 nota_vars, oitava_vars, dinamica_vars = [], [], []
 instrumento_vars, numero_instrumentos_vars, estados_vars = [], [], []
 duracao_vars = []
 nota_menus, oitava_menus, dinamica_menus = [], [], []
 instrumento_menus, numero_instrumentos_menus, duracao_menus = [], [], []
 lista_oitavas = [str(i) for i in range(10)]
-niveis_dinamicos = ['pppp', 'ppp', 'pp', 'p', 'mf', 'f', 'ff', 'fff', 'ffff']
 instrumentos = ['flautim', 'flauta', 'Oboe', 'Corne_ingles', 'clarinete', 'clarinete baixo', 'fagote', 'contrafagote', 'violino']
 
-for i in range(60):
-    estado_var = tk.IntVar(value=0)
-    estados_vars.append(estado_var)
-    checkbutton = tk.Checkbutton(frame_entrada, variable=estado_var, command=lambda i=i: toggle_state(i))
-    checkbutton.grid(row=i, column=0, padx=5, pady=5)
-
-    nota_var = tk.StringVar()
-    nota_vars.append(nota_var)
-    menu_nota = ttk.Combobox(frame_entrada, textvariable=nota_var, values=lista_notas, width=5, state='disabled')
-    menu_nota.grid(row=i, column=1, padx=5, pady=5)
-    nota_menus.append(menu_nota)
-
-    oitava_var = tk.StringVar(value='4')
-    oitava_vars.append(oitava_var)
-    menu_oitava = ttk.Combobox(frame_entrada, textvariable=oitava_var, values=lista_oitavas, width=5, state='disabled')
-    menu_oitava.grid(row=i, column=2, padx=5, pady=5)
-    oitava_menus.append(menu_oitava)
-
-    dinamica_var = tk.StringVar(value='mf')
-    dinamica_vars.append(dinamica_var)
-    menu_dinamica = ttk.Combobox(frame_entrada, textvariable=dinamica_var, values=niveis_dinamicos, width=5, state='disabled')
-    menu_dinamica.grid(row=i, column=3, padx=5, pady=5)
-    dinamica_menus.append(menu_dinamica)
-
-    instrumento_var = tk.StringVar(value='flauta')
-    instrumento_vars.append(instrumento_var)
-    menu_instrumento = ttk.Combobox(frame_entrada, textvariable=instrumento_var, values=instrumentos, width=10, state='disabled')
-    menu_instrumento.grid(row=i, column=4, padx=5, pady=5)
-    instrumento_menus.append(menu_instrumento)
-
-    numero_instrumentos_var = tk.StringVar(value='1')
-    numero_instrumentos_vars.append(numero_instrumentos_var)
-    menu_numero_instrumentos = ttk.Combobox(frame_entrada, textvariable=numero_instrumentos_var, values=[str(j) for j in range(1, 21)], width=5, state='disabled')
-    menu_numero_instrumentos.grid(row=i, column=5, padx=5, pady=5)
-    numero_instrumentos_menus.append(menu_numero_instrumentos)
-
-    duracao_var = tk.StringVar(value='1')
-    duracao_vars.append(duracao_var)
-    menu_duracao = ttk.Combobox(frame_entrada, textvariable=duracao_var, values=[str(j) for j in range(1, 17)], width=5, state='disabled')
-    menu_duracao.grid(row=i, column=6, padx=5, pady=5)
-    duracao_menus.append(menu_duracao)
-
-frame_botoes = tk.Frame(raiz)
-frame_botoes.pack(pady=10)
-
-botao_calcular = tk.Button(frame_botoes, text="Calcular", command=ao_clicar_no_botao_calcular)
-botao_calcular.pack(side=tk.LEFT, padx=5, pady=5)
-
-botao_limpar = tk.Button(frame_botoes, text="Limpar", command=ao_clicar_no_botao_limpar)
-botao_limpar.pack(side=tk.LEFT, padx=5, pady=5)
-
-texto_resultado = tk.Text(raiz, height=10, width=50)
-texto_resultado.pack(pady=10)
-
-if __name__ == "__main__":
-    raiz.mainloop()
-
+# Os widgets só são criados por construir_interface, para que importar Main não abra uma janela
+raiz = weight_factor_slider = texto_resultado = rotulo_estado = recalculo_automatico = None
+trabalhador = recalculo_agendado = None
+
+
+def construir_interface():
+    global raiz, weight_factor_slider, texto_resultado, rotulo_estado, recalculo_automatico, trabalhador
+
+    raiz = tk.Tk()
+    raiz.title("Calculadora de Densidade Integrada")
+
+    canvas = tk.Canvas(raiz)
+    scroll_y = tk.Scrollbar(raiz, orient="vertical", command=canvas.yview)
+    frame_entrada = tk.Frame(canvas)
+    canvas.create_window((0, 0), window=frame_entrada, anchor="nw")
+    canvas.configure(yscrollcommand=scroll_y.set)
+    canvas.pack(side="left", fill="both", expand=True)
+    scroll_y.pack(side="right", fill="y")
+
+    frame_entrada.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+
+    slider_label = tk.Label(raiz, text="Adjust Weight Factor (Instrument vs Interval Density)")
+    slider_label.pack(pady=(10, 0))
+    weight_factor_slider = tk.Scale(raiz, from_=0, to=1, orient="horizontal", resolution=0.01,
+                                    command=agendar_recalculo)
+    weight_factor_slider.set(0.5)
+    weight_factor_slider.pack()
+
+    for i in range(60):
+        estado_var = tk.IntVar(value=0)
+        estados_vars.append(estado_var)
+        checkbutton = tk.Checkbutton(frame_entrada, variable=estado_var, command=lambda i=i: toggle_state(i))
+        checkbutton.grid(row=i, column=0, padx=5, pady=5)
+
+        nota_var = tk.StringVar()
+        nota_vars.append(nota_var)
+        menu_nota = ttk.Combobox(frame_entrada, textvariable=nota_var, values=lista_notas, width=5, state='disabled')
+        menu_nota.grid(row=i, column=1, padx=5, pady=5)
+        nota_menus.append(menu_nota)
+
+        oitava_var = tk.StringVar(value='4')
+        oitava_vars.append(oitava_var)
+        menu_oitava = ttk.Combobox(frame_entrada, textvariable=oitava_var, values=lista_oitavas, width=5, state='disabled')
+        menu_oitava.grid(row=i, column=2, padx=5, pady=5)
+        oitava_menus.append(menu_oitava)
+
+        dinamica_var = tk.StringVar(value='mf')
+        dinamica_vars.append(dinamica_var)
+        menu_dinamica = ttk.Combobox(frame_entrada, textvariable=dinamica_var, values=DINAMICAS, width=5, state='disabled')
+        menu_dinamica.grid(row=i, column=3, padx=5, pady=5)
+        dinamica_menus.append(menu_dinamica)
+
+        instrumento_var = tk.StringVar(value='flauta')
+        instrumento_vars.append(instrumento_var)
+        menu_instrumento = ttk.Combobox(frame_entrada, textvariable=instrumento_var, values=instrumentos, width=10, state='disabled')
+        menu_instrumento.grid(row=i, column=4, padx=5, pady=5)
+        instrumento_menus.append(menu_instrumento)
+
+        numero_instrumentos_var = tk.StringVar(value='1')
+        numero_instrumentos_vars.append(numero_instrumentos_var)
+        menu_numero_instrumentos = ttk.Combobox(frame_entrada, textvariable=numero_instrumentos_var, values=[str(j) for j in range(1, 21)], width=5, state='disabled')
+        menu_numero_instrumentos.grid(row=i, column=5, padx=5, pady=5)
+        numero_instrumentos_menus.append(menu_numero_instrumentos)
+
+        duracao_var = tk.StringVar(value='1')
+        duracao_vars.append(duracao_var)
+        menu_duracao = ttk.Combobox(frame_entrada, textvariable=duracao_var, values=[str(j) for j in range(1, 17)], width=5, state='disabled')
+        menu_duracao.grid(row=i, column=6, padx=5, pady=5)
+        duracao_menus.append(menu_duracao)
+
+    frame_botoes = tk.Frame(raiz)
+    frame_botoes.pack(pady=10)
+
+    botao_calcular = tk.Button(frame_botoes, text="Calcular", command=ao_clicar_no_botao_calcular)
+    botao_calcular.pack(side=tk.LEFT, padx=5, pady=5)
+
+    botao_limpar = tk.Button(frame_botoes, text="Limpar", command=ao_clicar_no_botao_limpar)
+    botao_limpar.pack(side=tk.LEFT, padx=5, pady=5)
+
+    botao_cancelar = tk.Button(frame_botoes, text="Cancelar", command=ao_clicar_no_botao_cancelar)
+    botao_cancelar.pack(side=tk.LEFT, padx=5, pady=5)
+
+    recalculo_automatico = tk.BooleanVar(value=True)
+    tk.Checkbutton(frame_botoes, text="Recalcular automaticamente", variable=recalculo_automatico,
+                   command=agendar_recalculo).pack(side=tk.LEFT, padx=5, pady=5)
+
+    rotulo_estado = tk.Label(raiz, text="")
+    rotulo_estado.pack()
+
+    texto_resultado = tk.Text(raiz, height=10, width=50)
+    texto_resultado.pack(pady=10)
+
+    # Qualquer alteração a uma linha agenda um recálculo (com atraso, ver agendar_recalculo)
+    for variaveis in (estados_vars, nota_vars, oitava_vars, dinamica_vars, instrumento_vars,
+                      numero_instrumentos_vars, duracao_vars):
+        for var in variaveis:
+            var.trace_add("write", agendar_recalculo)
+
+    trabalhador = TrabalhadorCalculo()
+    raiz.after(INTERVALO_RESULTADOS_MS, recolher_resultados)
+    return raiz
 
 
+if __name__ == "__main__":
+    construir_interface().mainloop()
@@ -1,9 +1,12 @@
 #advanced_density_analysis.py"
 
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import gaussian_kde
 import warnings
+from functools import lru_cache
+
+from instrumentacao import contar, cronometro, obter_logger
+
+logger = obter_logger(__name__)
 
 
 def midi_to_frequency(midi_note):
@@ -14,7 +17,7 @@ def midi_to_frequency(midi_note):
 def frequency_to_note_name(frequency):
     """Convert frequency to the nearest musical note name."""
     if frequency <= 0 or np.isnan(frequency) or np.isinf(frequency):
-        print(f"Invalid frequency: {frequency}")
+        logger.debug("Invalid frequency: %s", frequency)
         return "Invalid"
 
     try:
@@ -28,15 +31,16 @@ def frequency_to_note_name(frequency):
         if 0 <= n < len(note_names):
             return f"{note_names[n]}{octave}"
         else:
-            print(f"Invalid n value: {n}")
+            logger.warning("Invalid n value: %s", n)
             return "Invalid"
     except Exception as e:
-        print(f"Error converting frequency {frequency} to note name: {e}")
+        logger.warning("Error converting frequency %s to note name: %s", frequency, e)
         return "Invalid"
 
 
 def calculate_spectral_moments(pitches, spectral_densities):
     """Calculate spectral moments, including centroid, spread, and skewness."""
+    contar("momentos_espectrais")
     pitches = np.array(pitches)
     spectral_densities = np.nan_to_num(spectral_densities) # Replace NaN with 0
 
@@ -78,94 +82,329 @@ def calculate_spectral_moments(pitches, spectral_densities):
 
 
 
-def apply_kernel_density_estimation(pitches, densities, bandwidth=1.0):
-    """Apply KDE to pitches, handling invalid input data."""
-    print("Entrando em apply_kernel_density_estimation")
-    print("Pitches:", pitches)
-    print("Densities:", densities)
+NOTE_NAMES = np.array(['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B'])
+
+SPECTRAL_MOMENTS_DTYPE = np.dtype([
+    ("centroid_midi", float), ("centroid_freq", float), ("centroid_note", "U12"),
+    ("spread_midi", float), ("spread_freq", float), ("skewness", float), ("total_weight", float),
+])
 
-    if not pitches or not densities:
-        print("Erro: pitches ou densities vazios.")
+
+def frequencies_to_note_names(frequencies):
+    """Vectorised frequency_to_note_name: nearest note names, "Invalid" for non-positive/NaN/inf values."""
+    frequencies = np.asarray(frequencies, dtype=float)
+    valid = np.isfinite(frequencies) & (frequencies > 0)
+    C0 = 440 * pow(2, -4.75)
+    h = np.round(12 * np.log2(np.where(valid, frequencies, C0) / C0)).astype(np.int64)
+    octaves = (h // 12).astype(str)
+    names = np.char.add(NOTE_NAMES[h % 12], octaves)
+    return np.where(valid, names, "Invalid")
+
+
+def _segment_ids(pitches, weights, offsets, mask):
+    """Flatten ragged input to (pitches, weights, chord index per note, n_chords)."""
+    if mask is not None:
+        pitches = np.asarray(pitches, dtype=float)
+        mask = np.asarray(mask, dtype=bool)
+        chord_ids = np.broadcast_to(np.arange(pitches.shape[0])[:, None], pitches.shape)[mask]
+        return pitches[mask], np.asarray(weights, dtype=float)[mask], chord_ids, pitches.shape[0]
+    if offsets is None:
+        raise ValueError("Provide either offsets (flat input) or mask (padded 2D input).")
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_chords = offsets.size - 1
+    chord_ids = np.repeat(np.arange(n_chords), np.diff(offsets))
+    return (np.asarray(pitches, dtype=float)[offsets[0]:offsets[-1]],
+            np.asarray(weights, dtype=float)[offsets[0]:offsets[-1]], chord_ids, n_chords)
+
+
+def calculate_spectral_moments_batch(pitches, spectral_densities, offsets=None, mask=None):
+    """Spectral centroid, spread and skewness for many chords in one vectorised pass.
+
+    Ragged input can be given either as flat arrays with CSR-style offsets
+    (chord i is pitches[offsets[i]:offsets[i + 1]]) or as padded 2D arrays of
+    shape (n_chords, max_notes) with a boolean mask of the valid entries.
+    Each chord follows the same definitions as calculate_spectral_moments.
+
+    Returns:
+        np.ndarray: structured array of length n_chords with SPECTRAL_MOMENTS_DTYPE fields.
+    """
+    pitches, weights, chord_ids, n_chords = _segment_ids(pitches, spectral_densities, offsets, mask)
+    contar("momentos_espectrais", n_chords)
+    weights = np.nan_to_num(weights)
+
+    total_weight = np.bincount(chord_ids, weights=weights, minlength=n_chords)
+    valid = total_weight != 0
+    safe_total = np.where(valid, total_weight, 1.0)
+
+    centroid = np.bincount(chord_ids, weights=pitches * weights, minlength=n_chords) / safe_total
+    deviation = pitches - centroid[chord_ids]
+    spread = np.sqrt(np.bincount(chord_ids, weights=weights * deviation ** 2, minlength=n_chords) / safe_total)
+    third_moment = np.bincount(chord_ids, weights=weights * deviation ** 3, minlength=n_chords) / safe_total
+    with np.errstate(divide="ignore", invalid="ignore"):
+        skewness = np.where(spread != 0, third_moment / spread ** 3, np.nan)
+
+    centroid_freq = midi_to_frequency(centroid)
+    spread_freq = midi_to_frequency(centroid + spread) - centroid_freq
+
+    result = np.empty(n_chords, dtype=SPECTRAL_MOMENTS_DTYPE)
+    result["centroid_midi"] = np.where(valid, centroid, np.nan)
+    result["centroid_freq"] = np.where(valid, centroid_freq, np.nan)
+    result["centroid_note"] = np.where(valid, frequencies_to_note_names(centroid_freq), "Invalid")
+    result["spread_midi"] = np.where(valid, spread, np.nan)
+    result["spread_freq"] = np.where(valid, spread_freq, np.nan)
+    result["skewness"] = np.where(valid, skewness, np.nan)
+    result["total_weight"] = total_weight
+    return result
+
+
+DEFAULT_KDE_MAX_MEMORY = 256 * 1024 ** 2  # bytes of FFT work space per block in kde_batch
+
+
+@lru_cache(maxsize=32)
+def _cached_pitch_grid(low, high, step):
+    grid = np.arange(low, high + step / 2, step)
+    grid.setflags(write=False)
+    return grid
+
+
+def pitch_grid(low=21.0, high=108.0, step=0.5):
+    """Reusable, read-only uniform pitch grid in MIDI units (default: quarter tones over the piano range).
+
+    Use step=0.01 for cent resolution.
+    """
+    return _cached_pitch_grid(float(low), float(high), float(step))
+
+
+def _kde_bandwidths(pitches, weights, chord_ids, n_chords, bandwidth):
+    """Per-chord Gaussian kernel width, as gaussian_kde(bw_method=bandwidth) with normalised weights."""
+    total = np.bincount(chord_ids, weights=weights, minlength=n_chords)
+    safe_total = np.where(total > 0, total, 1.0)
+    w = weights / safe_total[chord_ids]
+    mean = np.bincount(chord_ids, weights=w * pitches, minlength=n_chords)
+    variance = np.bincount(chord_ids, weights=w * (pitches - mean[chord_ids]) ** 2, minlength=n_chords)
+    sum_sq = np.bincount(chord_ids, weights=w ** 2, minlength=n_chords)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = variance / (1.0 - sum_sq)
+    sigma = bandwidth * np.sqrt(covariance)
+    return np.where((total > 0) & np.isfinite(sigma) & (sigma > 0), sigma, np.nan), w
+
+
+def _kde_block(pitches, weights, chord_ids, n_chords, grid, bandwidth):
+    """KDE curves for one block of chords: linear binning onto the grid, then a Gaussian
+    convolution done in the frequency domain with one kernel width per row."""
+    sigma, w = _kde_bandwidths(pitches, weights, chord_ids, n_chords, bandwidth)
+    if not np.any(np.isfinite(sigma)):
+        return np.full((n_chords, grid.size), np.nan)
+    step = grid[1] - grid[0]
+
+    # Positions within rounding error of the grid ends (e.g. the pitch that defines the grid's max) stay inside
+    position = (pitches - grid[0]) / step
+    tolerance = 1e-9 * grid.size
+    inside = (position >= -tolerance) & (position <= grid.size - 1 + tolerance)
+    position = np.clip(position[inside], 0, grid.size - 1)
+    left = np.minimum(np.floor(position).astype(np.int64), grid.size - 2)
+    frac = position - left
+    rows = chord_ids[inside] * grid.size
+    binned = np.bincount(rows + left, weights=w[inside] * (1 - frac), minlength=n_chords * grid.size)
+    binned += np.bincount(rows + left + 1, weights=w[inside] * frac, minlength=n_chords * grid.size)
+    binned = binned.reshape(n_chords, grid.size)
+
+    padding = int(np.ceil(5 * np.nanmax(sigma) / step))
+    size = 1 << int(grid.size + padding - 1).bit_length()
+    frequencies = np.fft.rfftfreq(size, d=step)
+    kernel_ft = np.exp(-2 * (np.pi * frequencies[None, :] * np.nan_to_num(sigma)[:, None]) ** 2)
+    values = np.fft.irfft(np.fft.rfft(binned, size, axis=1) * kernel_ft, size, axis=1)[:, :grid.size] / step
+    values[np.isnan(sigma)] = np.nan
+    return values
+
+
+def iter_kde_batch(pitches, densities, offsets=None, mask=None, grid=None, bandwidth=1.0,
+                   max_memory=DEFAULT_KDE_MAX_MEMORY):
+    """Yield (first_chord, curves) blocks of kde_batch, so very long batches never hold all curves at once."""
+    grid = pitch_grid() if grid is None else np.asarray(grid, dtype=float)
+    pitches, weights, chord_ids, n_chords = _segment_ids(pitches, densities, offsets, mask)
+    weights = np.nan_to_num(weights)
+    # Complex FFT work space per chord, with room for the kernel padding
+    bytes_per_chord = 16 * 4 * grid.size
+    block = max(1, int(max_memory // bytes_per_chord))
+    starts = np.searchsorted(chord_ids, np.arange(0, n_chords + block, block))
+    for first in range(0, n_chords, block):
+        count = min(block, n_chords - first)
+        lo, hi = starts[first // block], starts[first // block + 1]
+        with cronometro("kde"):
+            curves = _kde_block(pitches[lo:hi], weights[lo:hi], chord_ids[lo:hi] - first, count, grid, bandwidth)
+        contar("avaliacoes_kde", count)
+        yield first, curves
+
+
+def kde_batch(pitches, densities, offsets=None, mask=None, grid=None, bandwidth=1.0,
+              max_memory=DEFAULT_KDE_MAX_MEMORY, out=None):
+    """Weighted KDE curves of many chords on one shared pitch grid.
+
+    Ragged input is given as in calculate_spectral_moments_batch (flat arrays with
+    offsets, or padded 2D arrays with a mask). Each curve matches
+    gaussian_kde(pitches, weights=densities, bw_method=bandwidth) evaluated on the
+    grid, up to the binning error; pitches outside the grid are dropped, and chords
+    whose kernel width is undefined (a single distinct pitch, zero total weight)
+    give a row of NaN. Work is split into blocks of at most max_memory bytes; pass
+    out (e.g. an np.memmap) to avoid holding the result in RAM.
+
+    Returns:
+        np.ndarray: (n_chords, len(grid)) array of densities.
+    """
+    grid = pitch_grid() if grid is None else np.asarray(grid, dtype=float)
+    n_chords = np.asarray(mask).shape[0] if mask is not None else len(offsets) - 1
+    if out is None:
+        out = np.empty((n_chords, grid.size))
+    for first, curves in iter_kde_batch(pitches, densities, offsets, mask, grid, bandwidth, max_memory):
+        out[first:first + curves.shape[0]] = curves
+    return out
+
+
+def apply_kernel_density_estimation(pitches, densities, bandwidth=1.0, grid=None):
+    """Apply KDE to pitches, handling invalid input data.
+
+    The curve is evaluated on grid (default: 1000 points between the lowest and
+    highest pitch) with the binned estimator of kde_batch.
+    """
+    if not len(pitches) or not len(densities):
+        logger.warning("Erro: pitches ou densities vazios.")
         return None, None
     if len(pitches) != len(densities):
-        print("Erro: pitches e densities devem ter o mesmo tamanho.")
+        logger.warning("Erro: pitches e densities devem ter o mesmo tamanho.")
         return None, None
 
     try:
-        print("Calculando o KDE...")
-        kde = gaussian_kde(pitches, weights=densities, bw_method=bandwidth)
-        pitch_range = np.linspace(min(pitches), max(pitches), 1000)
-        kde_values = kde(pitch_range)
-        print("KDE calculado com sucesso.")
-        return pitch_range, kde_values
+        if grid is None:
+            if min(pitches) == max(pitches):
+                raise ValueError("todas as alturas são iguais")
+            grid = np.linspace(min(pitches), max(pitches), 1000)
+        kde_values = kde_batch(pitches, densities, offsets=[0, len(pitches)], grid=grid, bandwidth=bandwidth)[0]
+        if np.isnan(kde_values).any():
+            raise ValueError("largura de banda indefinida (uma só altura ou pesos nulos)")
+        return grid, kde_values
     except Exception as e:
-        print(f"Erro ao aplicar KDE: {e}")
+        logger.error("Erro ao aplicar KDE: %s", e)
         return None, None
 
 
 
 
+def _note_names(pitches):
+    return [frequency_to_note_name(midi_to_frequency(p)) for p in pitches]
+
+
+def draw_note_densities(ax, pitches, densities, title="Densidade por Nota", font_size=10, show_grid=True,
+                        artists=None):
+    """Draw one bar per note on ax.
+
+    Returns the artists dict; pass it back (same ax) to redraw with new data without rebuilding the axes.
+    """
+    if artists is None:
+        ax.set_xlabel("Notas", fontsize=font_size)
+        ax.set_ylabel("Densidade", fontsize=font_size)
+        ax.tick_params(labelsize=font_size)
+        ax.grid(show_grid, axis='y')
+        artists = {}
+    else:
+        artists["bars"].remove()
+    positions = np.arange(len(densities))
+    artists["bars"] = ax.bar(positions, densities, color='skyblue')
+    ax.set_xticks(positions, _note_names(pitches), rotation=45, fontsize=font_size)
+    ax.set_xlim(-0.6, max(len(densities), 1) - 0.4)
+    ax.set_ylim(0, max(max(densities, default=0), 0) * 1.05 or 1)
+    ax.set_title(title, fontsize=font_size + 2)
+    return artists
+
+
+def draw_kde_with_note_names(ax, pitch_range, kde_values, title="Distribuição Espectral", plot_type="Linear",
+                             font_size=10, show_grid=True, limits=None, artists=None):
+    """Draw a KDE curve on ax, with note names on the x-axis (at most 12 whole-semitone ticks).
+
+    limits=(low, high) shows only that pitch range (default: the whole grid). Returns the artists dict, as in
+    draw_note_densities.
+    """
+    pitch_range = np.asarray(pitch_range, dtype=float)
+    kde_values = np.asarray(kde_values, dtype=float)
+    if artists is None:
+        if plot_type == "Logarithmic":
+            ax.set_yscale("log")
+        line, = ax.plot([], [], label="Densidade Espectral", linewidth=2)
+        ax.set_xlabel("Notas", fontsize=font_size)
+        ax.set_ylabel("Densidade", fontsize=font_size)
+        ax.tick_params(labelsize=font_size)
+        ax.grid(show_grid)
+        ax.legend(fontsize=font_size)
+        artists = {"line": line}
+    low, high = limits if limits is not None else (pitch_range.min(), pitch_range.max())
+    artists["line"].set_data(pitch_range, kde_values)
+    ticks = np.arange(np.ceil(low), high, max(1, int(np.ceil((high - low) / 12))))
+    ax.set_xticks(ticks, _note_names(ticks), rotation=45, fontsize=font_size)
+    ax.set_xlim(low, high)
+    if ax.get_yscale() == "log":
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+    else:
+        visible = kde_values[(pitch_range >= low) & (pitch_range <= high)]
+        ax.set_ylim(0, np.nanmax(visible) * 1.05 if np.isfinite(visible).any() else 1)
+    ax.set_title(title, fontsize=font_size + 2)
+    return artists
+
+
+def draw_stable_values(ax, pitches, densities, title="Valores Estáveis de Densidade", font_size=10, show_grid=True,
+                       artists=None):
+    """Draw each note's density joined by a line on ax. Returns the artists dict, as in draw_note_densities."""
+    if artists is None:
+        line, = ax.plot([], [], marker='o', linestyle='-', color='b')
+        ax.set_xlabel("Notas", fontsize=font_size)
+        ax.set_ylabel("Densidade", fontsize=font_size)
+        ax.tick_params(labelsize=font_size)
+        ax.grid(show_grid)
+        artists = {"line": line}
+    positions = np.arange(len(densities))
+    artists["line"].set_data(positions, densities)
+    ax.set_xticks(positions, _note_names(pitches), rotation=45, fontsize=font_size)
+    ax.set_xlim(-0.5, max(len(densities), 1) - 0.5)
+    ax.relim()
+    ax.autoscale_view(scalex=False)
+    ax.set_title(title, fontsize=font_size + 2)
+    return artists
+
+
 def plot_note_densities(pitches, densities, title="Densidade por Nota", font_size=10, show_grid=True):
     """Plot note densities."""
+    import matplotlib.pyplot as plt
     try:
-        note_names = [frequency_to_note_name(midi_to_frequency(p)) for p in pitches]
-
-        plt.figure(figsize=(12, 6))
-        plt.bar(note_names, densities, color='skyblue')
-
-        plt.title(title, fontsize=font_size + 2)
-        plt.xlabel("Notas", fontsize=font_size)
-        plt.ylabel("Densidade", fontsize=font_size)
-        plt.xticks(rotation=45, fontsize=font_size)
-        plt.yticks(fontsize=font_size)
-        plt.grid(show_grid, axis='y')
-        plt.tight_layout()
+        fig, ax = plt.subplots(figsize=(12, 6))
+        draw_note_densities(ax, pitches, densities, title, font_size, show_grid)
+        fig.tight_layout()
         plt.show()
     except Exception as e:
-        print(f"Erro ao plotar densidades: {e}")
+        logger.error("Erro ao plotar densidades: %s", e)
 
 
 def plot_kde_with_note_names(pitch_range, kde_values, title="Distribuição Espectral", plot_type="Linear", font_size=10, show_grid=True):
     """Plot KDE with note names on x-axis."""
+    import matplotlib.pyplot as plt
 
     try:
-        plt.figure(figsize=(12, 6))
-
-        if plot_type == "Logarithmic":
-            plt.yscale("log")
-
-        plt.plot(pitch_range, kde_values, label="Densidade Espectral", linewidth=2)
-
-        tick_positions = np.linspace(0, len(pitch_range) - 1, num=12, dtype=int)
-        tick_labels = [frequency_to_note_name(midi_to_frequency(pitch_range[pos])) for pos in tick_positions]
-
-        plt.xticks(tick_positions, tick_labels, rotation=45, fontsize=font_size)
-        plt.title(title, fontsize=font_size + 2)
-        plt.xlabel("Notas", fontsize=font_size)
-        plt.ylabel("Densidade", fontsize=font_size)
-        plt.grid(show_grid)
-        plt.legend(fontsize=font_size)
-        plt.tight_layout()
+        fig, ax = plt.subplots(figsize=(12, 6))
+        draw_kde_with_note_names(ax, pitch_range, kde_values, title, plot_type, font_size, show_grid)
+        fig.tight_layout()
         plt.show()
     except Exception as e:
-        print(f"Erro ao plotar KDE: {e}")
+        logger.error("Erro ao plotar KDE: %s", e)
 
 
 def plot_stable_values(pitches, densities, title="Valores Estáveis de Densidade", font_size=10, show_grid=True):
     """Plot stable density values."""
+    import matplotlib.pyplot as plt
     try:
-        note_names = [frequency_to_note_name(midi_to_frequency(p)) for p in pitches]
-        plt.figure(figsize=(12, 6))
-        plt.plot(note_names, densities, marker='o', linestyle='-', color='b')
-        plt.title(title, fontsize=font_size + 2)
-        plt.xlabel("Notas", fontsize=font_size)
-        plt.ylabel("Densidade", fontsize=font_size)
-        plt.xticks(rotation=45, fontsize=font_size)
-        plt.yticks(fontsize=font_size)
-        plt.grid(show_grid)
-        plt.tight_layout()
+        fig, ax = plt.subplots(figsize=(12, 6))
+        draw_stable_values(ax, pitches, densities, title, font_size, show_grid)
+        fig.tight_layout()
         plt.show()
     except Exception as e:
-        print(f"Erro ao plotar valores estáveis: {e}")
+        logger.error("Erro ao plotar valores estáveis: %s", e)
 
 
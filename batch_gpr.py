@@ -0,0 +1,192 @@
+# batch_gpr.py
+
+"""
+Batched Gaussian Process interpolation of dynamic levels.
+
+Every pitch of an instrument table is fitted with only three training points
+(pp, mf, ff), so instead of running sklearn's optimiser once per pitch all
+pitches are solved together: the log marginal likelihood of a
+ConstantKernel * Matern model is evaluated for a whole grid of amplitude and
+length-scale values using batched 3x3 linear algebra, the best grid point is
+chosen per pitch (or shared by all pitches), and the posterior mean and
+standard deviation follow in closed form.
+"""
+
+import numpy as np
+
+from instrumentacao import contar, cronometrado
+
+
+DEFAULT_GRID_SIZE = 48
+
+
+def matern_correlation(distances, length_scale, nu=1.5):
+    """Matern correlation (unit amplitude) for nu in {0.5, 1.5, 2.5}."""
+    d = np.asarray(distances, dtype=float) / length_scale
+    if nu == 0.5:
+        return np.exp(-d)
+    if nu == 1.5:
+        d = np.sqrt(3.0) * d
+        return (1.0 + d) * np.exp(-d)
+    if nu == 2.5:
+        d = np.sqrt(5.0) * d
+        return (1.0 + d + d ** 2 / 3.0) * np.exp(-d)
+    raise ValueError(f"nu={nu} não suportado; use 0.5, 1.5 ou 2.5")
+
+
+def _grid(bounds, fixed, size):
+    if fixed is not None:
+        return np.atleast_1d(np.asarray(fixed, dtype=float))
+    low, high = bounds
+    return np.logspace(np.log10(low), np.log10(high), size)
+
+
+def _inv_logdet(matrices):
+    """Inverse and log-determinant of a stack of SPD matrices; explicit cofactors for 3x3."""
+    if matrices.shape[-1] != 3:
+        _, logdet = np.linalg.slogdet(matrices)
+        return np.linalg.inv(matrices), logdet
+    a, b, c = matrices[..., 0, 0], matrices[..., 0, 1], matrices[..., 0, 2]
+    d, e, f = matrices[..., 1, 0], matrices[..., 1, 1], matrices[..., 1, 2]
+    g, h, i = matrices[..., 2, 0], matrices[..., 2, 1], matrices[..., 2, 2]
+    cofactors = np.stack([
+        np.stack([e * i - f * h, c * h - b * i, b * f - c * e], axis=-1),
+        np.stack([f * g - d * i, a * i - c * g, c * d - a * f], axis=-1),
+        np.stack([d * h - e * g, b * g - a * h, a * e - b * d], axis=-1),
+    ], axis=-2)
+    det = a * cofactors[..., 0, 0] + b * cofactors[..., 1, 0] + c * cofactors[..., 2, 0]
+    return cofactors / det[..., None, None], np.log(det)
+
+
+def _log_marginal_likelihood(x_train, y, length_scales, amplitudes, nu, alpha):
+    """LML for hyperparameter grids of shape (g, a) and (g, b), where g is 1 (one grid
+    shared by every pitch, inverted only once) or n_pitches.
+
+    Returns lml (n, a, b) and K^-1 (g, a, b, m, m).
+    """
+    m = x_train.size
+    distances = np.abs(x_train[:, None] - x_train[None, :])
+    corr = matern_correlation(distances, length_scales[:, :, None, None], nu)           # (g, a, m, m)
+    kernel = amplitudes[:, None, :, None, None] * corr[:, :, None] + alpha * np.eye(m)  # (g, a, b, m, m)
+    kernel_inv, logdet = _inv_logdet(kernel)
+    if kernel.shape[0] == 1:
+        quad = np.einsum('ni,abij,nj->nab', y, kernel_inv[0], y)
+    else:
+        quad = np.einsum('ni,nabij,nj->nab', y, kernel_inv, y)
+    return -0.5 * quad - 0.5 * logdet - 0.5 * m * np.log(2 * np.pi), kernel_inv
+
+
+def _refined_grid(grid, best, size):
+    """Log-spaced grid spanning one coarse step on each side of the best value, per pitch."""
+    if grid.shape[1] == 1:
+        return grid
+    log_grid = np.log(grid)
+    step = np.abs(log_grid[:, 1] - log_grid[:, 0])[:, None]
+    centre = np.take_along_axis(log_grid, best[:, None], axis=1)
+    return np.exp(centre + step * np.linspace(-1.0, 1.0, size)[None, :])
+
+
+@cronometrado("gpr")
+def fit_predict_batch(x_train, y_train, x_pred, nu=1.5, alpha=1e-1,
+                      length_scale=None, amplitude=None,
+                      length_scale_bounds=(1e-5, 1e5), amplitude_bounds=(1e-5, 1e5),
+                      grid_size=DEFAULT_GRID_SIZE, refinements=3, shared=False,
+                      return_hyperparameters=False):
+    """Fit one GP per row of y_train and predict at x_pred, all in one vectorised pass.
+
+    Args:
+        x_train: (m,) training inputs shared by every pitch (e.g. dynamic levels of pp, mf, ff).
+        y_train: (n_pitches, m) training targets.
+        x_pred: (k,) inputs to predict (e.g. all nine dynamic levels).
+        nu: Matern smoothness (0.5, 1.5 or 2.5).
+        alpha: noise variance added to the training kernel diagonal, as in sklearn.
+        length_scale, amplitude: fix the hyperparameter instead of searching its grid.
+        length_scale_bounds, amplitude_bounds: log-spaced search ranges (sklearn's defaults).
+        grid_size: number of points per searched hyperparameter in the coarse grid.
+        refinements: number of local zoom-in passes around each pitch's best grid point.
+        shared: use the hyperparameters that maximise the summed likelihood of all pitches.
+        return_hyperparameters: also return the chosen (length_scale, amplitude) per pitch.
+
+    Returns:
+        tuple: (mean, std), both of shape (n_pitches, k); with return_hyperparameters,
+        a third element {"length_scale": (n_pitches,), "amplitude": (n_pitches,)}.
+    """
+    x_train = np.asarray(x_train, dtype=float).ravel()
+    x_pred = np.asarray(x_pred, dtype=float).ravel()
+    y = np.atleast_2d(np.asarray(y_train, dtype=float))
+    n = y.shape[0]
+    contar("ajustes_gpr", n)
+
+    # The coarse grid is the same for every pitch; refinements zoom in per pitch (or once, if shared)
+    length_scales = _grid(length_scale_bounds, length_scale, grid_size)[None, :]
+    amplitudes = _grid(amplitude_bounds, amplitude, grid_size)[None, :]
+
+    for i in range(refinements + 1):
+        lml, _ = _log_marginal_likelihood(x_train, y, length_scales, amplitudes, nu, alpha)
+        if shared:
+            lml = lml.sum(axis=0, keepdims=True)
+        best = np.argmax(lml.reshape(lml.shape[0], -1), axis=1)
+        ia, ib = np.unravel_index(best, lml.shape[1:])
+        if i < refinements:
+            if not shared and length_scales.shape[0] == 1:
+                length_scales = np.repeat(length_scales, n, axis=0)
+                amplitudes = np.repeat(amplitudes, n, axis=0)
+            length_scales = _refined_grid(length_scales, ia, 9)
+            amplitudes = _refined_grid(amplitudes, ib, 9)
+
+    rows = np.zeros(n, dtype=int) if lml.shape[0] == 1 else np.arange(n)
+    best_length_scale = length_scales[rows, ia[rows]]
+    best_amplitude = amplitudes[rows, ib[rows]]
+
+    _, k_inv = _log_marginal_likelihood(x_train, y, best_length_scale[:, None], best_amplitude[:, None], nu, alpha)
+    k_inv = k_inv[:, 0, 0]                                            # (n, m, m)
+    weights = np.einsum('nij,nj->ni', k_inv, y)                       # (n, m)
+    corr_pred = matern_correlation(np.abs(x_pred[:, None] - x_train[None, :]),
+                                   best_length_scale[:, None, None], nu)
+    k_star = best_amplitude[:, None, None] * corr_pred                # (n, k, m)
+
+    mean = np.einsum('nkm,nm->nk', k_star, weights)
+    variance = best_amplitude[:, None] - np.einsum('nkm,nmj,nkj->nk', k_star, k_inv, k_star)
+    std = np.sqrt(np.clip(variance, 0.0, None))
+
+    if return_hyperparameters:
+        return mean, std, {"length_scale": best_length_scale, "amplitude": best_amplitude}
+    return mean, std
+
+
+def extrapolate_monotonic(levels, values, low_level, high_level, edge_points=3, min_step=1e-6):
+    """Extrapolate every pitch to one level below and one above its known range.
+
+    A straight line is fitted by least squares to the lowest and to the highest
+    edge_points levels of each row (closed form, all rows at once) and followed
+    out to low_level / high_level. Rows whose edge values are all positive are
+    fitted in log space, so the extrapolated densities stay positive. Only the
+    size of the slope is used, so the result is always strictly below the
+    lowest and above the highest known value (by at least min_step), which is
+    the ordering pppp < ppp and ffff > fff expects.
+
+    Args:
+        levels: (k,) increasing levels of the columns of values.
+        values: (n_pitches, k) known or interpolated values.
+        low_level, high_level: levels to extrapolate to.
+
+    Returns:
+        tuple: (low, high), each of shape (n_pitches,).
+    """
+    levels = np.asarray(levels, dtype=float).ravel()
+    values = np.atleast_2d(np.asarray(values, dtype=float))
+
+    def extrapolate(x, y, edge, distance, direction):
+        positive = np.all(y > 0, axis=1)
+        y_fit = np.where(positive[:, None], np.log(np.where(y > 0, y, 1.0)), y)
+        dx = x - x.mean()
+        slope = np.abs((y_fit - y_fit.mean(axis=1, keepdims=True)) @ dx / (dx @ dx))
+        step = slope * distance
+        additive = edge + direction * np.maximum(step, min_step)
+        multiplicative = edge * np.exp(direction * step)
+        multiplicative = np.where(direction * (multiplicative - edge) >= min_step, multiplicative, additive)
+        return np.where(positive, multiplicative, additive)
+
+    low = extrapolate(levels[:edge_points], values[:, :edge_points], values[:, 0], levels[0] - low_level, -1.0)
+    high = extrapolate(levels[-edge_points:], values[:, -edge_points:], values[:, -1], high_level - levels[-1], 1.0)
+    return low, high
@@ -0,0 +1,259 @@
+# benchmarks.py
+
+"""
+Benchmarks dos caminhos de cálculo mais usados, a várias escalas.
+
+Cada carga prepara dados sintéticos determinísticos (semente fixa) para vários
+tamanhos, de 3 a 10 000 notas e de 1 a 100 000 acordes, e mede o melhor tempo
+de várias repetições e o pico de memória (tracemalloc, numa execução à parte
+para não afetar os tempos). Os resultados podem ser gravados como referência
+em JSON e comparados com uma referência anterior, assinalando as regressões.
+
+Exemplos:
+    python benchmarks.py --guardar referencia.json
+    python benchmarks.py --comparar referencia.json --max-tamanho 10000
+"""
+
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+import numpy as np
+
+from parser_notas import NOMES_SUSTENIDO
+
+
+Carga = namedtuple("Carga", ["tamanhos", "unidade", "preparar"])
+
+SEMENTE = 12345
+NOTAS_POR_ACORDE = 8
+
+# Uma execução mais longa do que isto não é repetida
+LIMITE_REPETICAO_S = 1.0
+
+# Diferenças abaixo destes valores são ruído e nunca contam como regressão
+RUIDO_SEGUNDOS = 1e-3
+RUIDO_MEMORIA = 64 * 1024
+
+
+def _notas(rng, n, oitavas=range(1, 8)):
+    """n nomes de notas em sustenidos (com quartos de tom) nas oitavas dadas."""
+    passos = rng.integers(0, len(NOMES_SUSTENIDO), n)
+    oitavas = rng.choice(list(oitavas), n)
+    return [f"{NOMES_SUSTENIDO[p]}{o}" for p, o in zip(passos, oitavas)]
+
+
+def _carga_intervalar(n, rng):
+    from densidade_intervalar import calcular_densidade_intervalar
+    notas = _notas(rng, n)
+    return lambda: calcular_densidade_intervalar(notas)
+
+
+def _carga_predict_dynamics(n, rng):
+    from flauta import predict_intermediate_dynamics
+    mf = rng.uniform(2.0, 15.0, n)
+    pp, ff = mf * rng.uniform(0.3, 0.8, n), mf * rng.uniform(1.2, 2.0, n)
+    pitches = _notas(rng, n)
+    return lambda: predict_intermediate_dynamics(pitches, pp, mf, ff)
+
+
+def _carga_fit_dynamics(n, rng):
+    from Den_alg_Lin_10 import fit_dynamics
+    mf = rng.uniform(2.0, 15.0, n)
+    pp, ff = (mf * rng.uniform(0.3, 0.8, n)).tolist(), (mf * rng.uniform(1.2, 2.0, n)).tolist()
+    return lambda: fit_dynamics(pp, mf.tolist(), ff)
+
+
+def _carga_momentos(n, rng):
+    from advanced_density_analysis import calculate_spectral_moments
+    pitches = rng.uniform(36, 96, n).round(1).tolist()
+    densidades = rng.uniform(0.5, 20.0, n).tolist()
+    return lambda: calculate_spectral_moments(pitches, densidades)
+
+
+def _acordes_planos(n, rng):
+    """n acordes de 3 a NOTAS_POR_ACORDE notas, em arrays planos com offsets."""
+    offsets = np.concatenate([[0], np.cumsum(rng.integers(3, NOTAS_POR_ACORDE + 1, n))])
+    pitches = rng.uniform(36, 96, offsets[-1]).round(1)
+    densidades = rng.uniform(0.5, 20.0, offsets[-1])
+    return pitches, densidades, offsets
+
+
+def _carga_momentos_lote(n, rng):
+    from advanced_density_analysis import calculate_spectral_moments_batch
+    pitches, densidades, offsets = _acordes_planos(n, rng)
+    return lambda: calculate_spectral_moments_batch(pitches, densidades, offsets)
+
+
+def _carga_kde(n, rng):
+    from advanced_density_analysis import apply_kernel_density_estimation
+    pitches = rng.uniform(36, 96, n).round(1)
+    densidades = rng.uniform(0.5, 20.0, n)
+    return lambda: apply_kernel_density_estimation(pitches, densidades)
+
+
+def _carga_kde_lote(n, rng):
+    from advanced_density_analysis import kde_batch
+    pitches, densidades, offsets = _acordes_planos(n, rng)
+    return lambda: kde_batch(pitches, densidades, offsets)
+
+
+def _carga_pipeline(n, rng):
+    import flauta
+    from density_pipeline import analisar_lote
+    notas_tabela = list(flauta.spectral_data)
+    acordes = []
+    for i in range(n):
+        k = int(rng.integers(3, NOTAS_POR_ACORDE + 1))
+        acordes.append({
+            'id': i,
+            'notas': [notas_tabela[j] for j in rng.integers(0, len(notas_tabela), k)],
+            'dinamicas': [flauta.DINAMICAS[j] for j in rng.integers(0, len(flauta.DINAMICAS), k)],
+            'instrumentos': ['flauta'] * k,
+            'numeros_instrumentos': rng.integers(1, 4, k).tolist(),
+        })
+    return lambda: list(analisar_lote(acordes, workers=1))
+
+
+CARGAS = {
+    'calcular_densidade_intervalar': Carga([3, 100, 1000, 10000], 'notas', _carga_intervalar),
+    'predict_intermediate_dynamics': Carga([1, 100, 1000, 10000], 'alturas', _carga_predict_dynamics),
+    'fit_dynamics': Carga([38, 1000, 10000], 'alturas', _carga_fit_dynamics),
+    'calculate_spectral_moments': Carga([3, 100, 1000, 10000], 'notas', _carga_momentos),
+    'calculate_spectral_moments_batch': Carga([1, 100, 10000, 100000], 'acordes', _carga_momentos_lote),
+    'apply_kernel_density_estimation': Carga([3, 100, 1000, 10000], 'notas', _carga_kde),
+    'kde_batch': Carga([1, 100, 10000, 100000], 'acordes', _carga_kde_lote),
+    'analisar_lote': Carga([1, 100, 1000, 10000, 100000], 'acordes', _carga_pipeline),
+}
+
+
+def medir(funcao, repeticoes=5):
+    """
+    Melhor tempo e mediana de várias execuções, e pico de memória de uma execução extra.
+
+    A primeira execução serve de aquecimento (caches, tabelas); se demorar mais
+    de LIMITE_REPETICAO_S, é a única medição de tempo.
+    """
+    inicio = time.perf_counter()
+    funcao()
+    tempos = [time.perf_counter() - inicio]
+    if tempos[0] < LIMITE_REPETICAO_S:
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            funcao()
+            tempos.append(time.perf_counter() - inicio)
+
+    tracemalloc.start()
+    try:
+        funcao()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'segundos': min(tempos), 'mediana': statistics.median(tempos), 'pico_memoria': pico}
+
+
+def executar(cargas=None, max_tamanho=None, repeticoes=5):
+    """
+    Corre as cargas escolhidas (todas por omissão) até max_tamanho.
+
+    Yields:
+        dict: carga, tamanho, unidade, segundos, mediana e pico_memoria (bytes).
+    """
+    for nome in cargas or CARGAS:
+        carga = CARGAS[nome]
+        for tamanho in carga.tamanhos:
+            if max_tamanho is not None and tamanho > max_tamanho:
+                continue
+            funcao = carga.preparar(tamanho, np.random.default_rng(SEMENTE))
+            yield {'carga': nome, 'tamanho': tamanho, 'unidade': carga.unidade, **medir(funcao, repeticoes)}
+
+
+def ambiente():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'processador': platform.processor() or platform.machine(),
+    }
+
+
+def comparar(resultados, referencia, tolerancia=0.25, tolerancia_memoria=0.25):
+    """
+    Compara resultados com uma referência (lista de resultados de executar).
+
+    Uma medição é uma regressão se passar a referência em mais do que a
+    tolerância relativa e também em mais do que o ruído absoluto.
+
+    Returns:
+        list: (resultado, resultado_referencia, motivos) das regressões.
+    """
+    indice = {(r['carga'], r['tamanho']): r for r in referencia}
+    regressoes = []
+    for resultado in resultados:
+        anterior = indice.get((resultado['carga'], resultado['tamanho']))
+        if anterior is None:
+            continue
+        motivos = []
+        if (resultado['segundos'] > anterior['segundos'] * (1 + tolerancia)
+                and resultado['segundos'] - anterior['segundos'] > RUIDO_SEGUNDOS):
+            motivos.append('tempo')
+        if (resultado['pico_memoria'] > anterior['pico_memoria'] * (1 + tolerancia_memoria)
+                and resultado['pico_memoria'] - anterior['pico_memoria'] > RUIDO_MEMORIA):
+            motivos.append('memoria')
+        if motivos:
+            regressoes.append((resultado, anterior, motivos))
+    return regressoes
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmarks dos caminhos de cálculo.")
+    parser.add_argument("--cargas", nargs="+", choices=list(CARGAS), help="Cargas a correr (por omissão, todas)")
+    parser.add_argument("--max-tamanho", type=int, default=None, help="Ignora os tamanhos acima deste")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--guardar", help="Grava os resultados como referência JSON")
+    parser.add_argument("--comparar", help="Referência JSON com que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Aumento relativo tolerado (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    referencia = None
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            referencia = json.load(f)['resultados']
+    indice = {(r['carga'], r['tamanho']): r for r in referencia or []}
+
+    resultados = []
+    print(f"{'carga':<34}{'tamanho':>9} {'unidade':<8}{'melhor ms':>11}{'mediana ms':>12}{'pico MiB':>10}{'vs ref':>9}")
+    for resultado in executar(args.cargas, args.max_tamanho, args.repeticoes):
+        resultados.append(resultado)
+        anterior = indice.get((resultado['carga'], resultado['tamanho']))
+        relacao = f"{resultado['segundos'] / anterior['segundos']:>8.2f}x" if anterior else ""
+        print(f"{resultado['carga']:<34}{resultado['tamanho']:>9} {resultado['unidade']:<8}"
+              f"{resultado['segundos'] * 1e3:>11.3f}{resultado['mediana'] * 1e3:>12.3f}"
+              f"{resultado['pico_memoria'] / 2**20:>10.2f}{relacao}", flush=True)
+
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as f:
+            json.dump({'ambiente': ambiente(), 'resultados': resultados}, f, indent=2)
+        print(f"Referência gravada em {args.guardar}", file=sys.stderr)
+
+    if referencia is not None:
+        regressoes = comparar(resultados, referencia, args.tolerancia, args.tolerancia)
+        for resultado, anterior, motivos in regressoes:
+            print(f"REGRESSÃO {resultado['carga']} ({resultado['tamanho']} {resultado['unidade']}): "
+                  f"{anterior['segundos'] * 1e3:.3f} -> {resultado['segundos'] * 1e3:.3f} ms, "
+                  f"{anterior['pico_memoria'] / 2**20:.2f} -> {resultado['pico_memoria'] / 2**20:.2f} MiB "
+                  f"[{', '.join(motivos)}]", file=sys.stderr)
+        if regressoes:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,460 @@
+# busca_voicings.py
+
+"""
+Procura das disposições (voicings) de um conjunto de classes de alturas que
+minimizam a densidade, dentro da extensão de cada instrumento.
+
+Cada voz (instrumento, dinâmica, número de instrumentistas e, opcionalmente,
+extensão) recebe uma nota cuja classe pertence ao conjunto. As vozes são dadas
+do grave para o agudo e, por omissão, as notas ficam estritamente ascendentes
+e todas as classes são usadas. Só entram notas com densidade positiva. As
+densidades de cada nota candidata e as gaussianas entre candidatas de vozes
+diferentes são calculadas uma única vez.
+
+A procura é em profundidade, com ramificação e poda (branch and bound). Ao
+acrescentar uma nota, as somas do acorde parcial são atualizadas em O(1):
+densidade do instrumento, densidade máxima, momentos espectrais e pares
+intervalares. A interação de cada voz ainda por colocar com as notas já
+colocadas é mantida num vetor por candidata. Todos os filhos de um nó são
+avaliados de uma vez, com um limite inferior da grandeza pedida:
+
+    densidade do instrumento  >= parcial + mínimo de cada voz restante
+    densidade intervalar      >= parcial + melhor interação de cada voz restante
+                                 + mínimo dos pares entre vozes restantes
+    amplitude, densidade máxima, peso total <= máximos possíveis
+    spread (variância)        >= variância parcial x peso parcial / peso máximo
+
+Os filhos são visitados do menor limite para o maior e podados quando o limite
+passa a k-ésima melhor pontuação já encontrada. Com workers > 1, a árvore é
+dividida nos prefixos de profundidade_divisao vozes. A subárvore mais
+promissora é explorada primeiro no processo atual, e a sua k-ésima pontuação
+serve de limite inicial às restantes, exploradas num conjunto de processos.
+As k melhores disposições são por fim reavaliadas com analisar_acorde, pelo
+que as pontuações devolvidas são as do pipeline.
+
+Exemplo:
+    python busca_voicings.py C E G Bb --voz flauta:mf --voz flauta:mf --voz flauta:p:2:C5:C7 -k 5
+"""
+
+import heapq
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+import densidade_intervalar
+from advanced_density_analysis import midi_to_frequency
+from density_pipeline import analisar_acorde
+from instrumentacao import (adicionar_argumentos, aplicar_argumentos, concluir_argumentos, contar,
+                            cronometrado, obter_logger)
+from instrumentos import avaliar_notas, obter_instrumento
+from parser_notas import NOMES_SUSTENIDO, PASSOS_POR_OITAVA, passo_nota, passos_notas
+
+
+# extensao: (nota mais grave, nota mais aguda), ou None para todas as notas da tabela do instrumento
+Voz = namedtuple("Voz", ["instrumento", "dinamica", "numero_instrumentos", "extensao"], defaults=(1, None))
+
+# pontuacao: a grandeza pedida, tirada de resultado (o dicionário de analisar_acorde)
+Voicing = namedtuple("Voicing", ["pontuacao", "notas", "resultado"])
+
+GRANDEZAS = ("densidade_ponderada", "densidade_refinada", "densidade_total")
+
+# Folga relativa da poda, para que os arredondamentos não eliminem empates
+TOLERANCIA_PODA = 1e-9
+
+logger = obter_logger(__name__)
+
+
+def nota_do_passo(passo):
+    """Nota em sustenidos de um passo absoluto de quarto de tom (ex.: 98 -> 'C#4')."""
+    oitava, passo_na_oitava = divmod(int(passo), PASSOS_POR_OITAVA)
+    return f"{NOMES_SUSTENIDO[passo_na_oitava]}{oitava}"
+
+
+def passos_classes(classes):
+    """Passos de quarto de tom dentro da oitava (0..23) das classes de alturas (ex.: 'C', 'Eb', 'F#+')."""
+    return sorted({passo_nota(f"{classe.strip()}4") % PASSOS_POR_OITAVA for classe in classes})
+
+
+def passos_extensao(voz):
+    """Passos das notas que o instrumento da voz tem na tabela, dentro da extensão pedida."""
+    dados = getattr(obter_instrumento(voz.instrumento), 'spectral_data', None)
+    if voz.extensao is not None:
+        inicio, fim = map(passo_nota, voz.extensao)
+        passos = np.arange(inicio, fim + 1)
+        return passos if dados is None else np.intersect1d(passos, passos_notas(list(dados)))
+    if dados is None:
+        raise ValueError(f"O instrumento {voz.instrumento} não tem tabela; indique a extensão da voz.")
+    return np.unique(passos_notas(list(dados)))
+
+
+def _contar_bits(valores, numero_bits):
+    return sum((valores >> i) & 1 for i in range(numero_bits))
+
+
+class ProblemaVoicing:
+    """
+    Candidatas de cada voz e tabelas da procura, calculadas uma única vez.
+
+    Por voz v: passos[v], midis[v], densidades[v] e maximos[v] por candidata,
+    e classes[v] (bit da classe de cada candidata). Por par de vozes v < u:
+    gaussianas[v, u] (candidatas de v x candidatas de u) e permitidos[v, u],
+    as combinações que respeitam a ordem e o espaçamento máximo (em meios-tons,
+    entre vozes vizinhas).
+    """
+
+    def __init__(self, classes, vozes, weight_factor=0.5, grandeza="densidade_total",
+                 ordenadas=True, espacamento_maximo=None, cobrir=True):
+        if grandeza not in GRANDEZAS:
+            raise ValueError(f"Grandeza desconhecida: {grandeza}")
+        if not 0 <= weight_factor <= 1:
+            raise ValueError("O weight_factor tem de estar entre 0 e 1.")
+        if not vozes:
+            raise ValueError("Indique pelo menos uma voz.")
+        self.vozes = [Voz(*voz) for voz in vozes]
+        passos_classe = passos_classes(classes)
+        if not passos_classe:
+            raise ValueError("Indique pelo menos uma classe de alturas.")
+        if cobrir and len(passos_classe) > len(self.vozes):
+            raise ValueError(f"{len(passos_classe)} classes não cabem em {len(self.vozes)} vozes.")
+
+        self.weight_factor = weight_factor
+        self.grandeza = grandeza
+        self.numero_classes = len(passos_classe) if cobrir else 0
+        self.todas_classes = (1 << self.numero_classes) - 1
+        bits = np.zeros(PASSOS_POR_OITAVA, dtype=np.int64)
+        bits[passos_classe] = 1 << np.arange(len(passos_classe))
+
+        self.passos, self.midis, self.densidades, self.maximos, self.classes = [], [], [], [], []
+        for voz in self.vozes:
+            passos = passos_extensao(voz)
+            passos = passos[np.isin(passos % PASSOS_POR_OITAVA, passos_classe)]
+            densidades, maximos = avaliar_notas(
+                obter_instrumento(voz.instrumento), [nota_do_passo(passo) for passo in passos],
+                [voz.dinamica] * passos.size, [int(voz.numero_instrumentos)] * passos.size)
+            # Sem densidade máxima, densidade_total deixaria de ser normalizada; com densidades
+            # negativas (algumas notas em pppp) o spread do pipeline é NaN e os limites da poda falham
+            validas = (maximos > 0) & (densidades > 0)
+            if not validas.any():
+                raise ValueError(f"Nenhuma nota do conjunto na extensão da voz {voz.instrumento}.")
+            self.passos.append(passos[validas])
+            self.midis.append(12 + passos[validas] / 2)
+            self.densidades.append(densidades[validas])
+            self.maximos.append(maximos[validas])
+            self.classes.append(bits[passos[validas] % PASSOS_POR_OITAVA])
+
+        n = len(self.vozes)
+        tabela = densidade_intervalar.tabela_decrescimo_gaussiano(
+            int(max(p.max() for p in self.passos) - min(p.min() for p in self.passos)) + 1)
+        self.gaussianas, self.permitidos = {}, {}
+        for v in range(n):
+            for u in range(v + 1, n):
+                distancias = self.passos[u][None, :] - self.passos[v][:, None]
+                self.gaussianas[v, u] = tabela[np.abs(distancias)]
+                permitidos = distancias > 0 if ordenadas else np.ones(distancias.shape, dtype=bool)
+                if ordenadas and espacamento_maximo is not None and u == v + 1:
+                    permitidos &= distancias <= 2 * espacamento_maximo
+                self.permitidos[v, u] = permitidos
+
+        # Limites das vozes que faltam colocar depois da voz d (vozes d+1..n-1)
+        def restantes(valores, reduzir, neutro):
+            return [reduzir(valores[d + 1:]) if d + 1 < n else neutro for d in range(n)]
+
+        self.densidade_min_restante = restantes([d.min() for d in self.densidades], sum, 0.0)
+        self.densidade_max_restante = restantes([d.max() for d in self.densidades], sum, 0.0)
+        self.maximo_max_restante = restantes([m.max() for m in self.maximos], sum, 0.0)
+        self.midi_min_restante = restantes([m.min() for m in self.midis], min, np.inf)
+        self.midi_max_restante = restantes([m.max() for m in self.midis], max, -np.inf)
+        minimos_pares = {par: self.gaussianas[par][permitidos].min() if permitidos.any() else np.inf
+                         for par, permitidos in self.permitidos.items()}
+        self.pares_restantes = [sum(minimo for (v, _), minimo in minimos_pares.items() if v > d) for d in range(n)]
+
+    def __len__(self):
+        return len(self.vozes)
+
+    def notas(self, indices):
+        """Notas de uma disposição dada pelo índice da candidata de cada voz."""
+        return [nota_do_passo(self.passos[v][c]) for v, c in enumerate(indices)]
+
+
+# Somas do acorde parcial com as vozes 0..d-1 colocadas. interacoes[v] (v >= d)
+# tem, por candidata de v, a soma das gaussianas com as notas já colocadas;
+# permitidos são as candidatas da voz d compatíveis com a voz d-1 (None: todas).
+_Parcial = namedtuple("_Parcial", [
+    "indices", "densidade", "maximo", "intervalar", "momento1", "momento2", "grave", "agudo",
+    "cobertas", "interacoes", "permitidos",
+])
+
+
+class Procura:
+    """Ramificação e poda sobre um ProblemaVoicing, guardando as k melhores disposições."""
+
+    def __init__(self, problema, k=10, limiar=np.inf):
+        self.problema = problema
+        self.k = k
+        self.limiar_inicial = limiar
+        self.melhores = []  # heap de (-pontuacao, indices), com a pior no topo
+        self.nos = 0
+        self.podados = 0
+
+    @property
+    def limiar(self):
+        """Pontuação acima da qual um ramo já não pode entrar nas k melhores."""
+        if len(self.melhores) == self.k:
+            return min(-self.melhores[0][0], self.limiar_inicial)
+        return self.limiar_inicial
+
+    def raiz(self):
+        interacoes = {v: np.zeros(passos.size) for v, passos in enumerate(self.problema.passos)}
+        return _Parcial((), 0.0, 0.0, 0.0, 0.0, 0.0, np.inf, -np.inf, 0, interacoes, None)
+
+    def filhos(self, parcial):
+        """
+        Candidatas da voz seguinte, com a pontuação de cada uma (na última voz)
+        ou um limite inferior das pontuações das disposições que a usam.
+
+        Returns:
+            tuple: (candidatas, pontuacoes, somas), com somas as somas parciais de cada filho.
+        """
+        p = self.problema
+        d, n = len(parcial.indices), len(p)
+        if parcial.permitidos is None:
+            candidatas = np.arange(p.passos[d].size)
+        else:
+            candidatas = np.flatnonzero(parcial.permitidos)
+        densidades, midis = p.densidades[d][candidatas], p.midis[d][candidatas]
+        densidade = parcial.densidade + densidades
+        maximo = parcial.maximo + p.maximos[d][candidatas]
+        intervalar = parcial.intervalar + parcial.interacoes[d][candidatas]
+        momento1 = parcial.momento1 + densidades * midis
+        momento2 = parcial.momento2 + densidades * midis ** 2
+        grave = np.minimum(parcial.grave, midis)
+        agudo = np.maximum(parcial.agudo, midis)
+        cobertas = parcial.cobertas | p.classes[d][candidatas]
+        somas = (densidade, maximo, intervalar, momento1, momento2, grave, agudo, cobertas)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if d == n - 1:
+                pontuacoes = self._pontuar(densidade, intervalar, agudo - grave, grave, densidade,
+                                           momento1, momento2, densidade, maximo, exata=True)
+            else:
+                intervalar_minima = intervalar + p.pares_restantes[d]
+                for v in range(d + 1, n):
+                    interacao = parcial.interacoes[v][None, :] + p.gaussianas[d, v][candidatas]
+                    interacao = np.where(p.permitidos[d, v][candidatas], interacao, np.inf)
+                    intervalar_minima = intervalar_minima + interacao.min(axis=1)
+                grave_minimo = np.minimum(grave, p.midi_min_restante[d])
+                amplitude_maxima = np.maximum(agudo, p.midi_max_restante[d]) - grave_minimo
+                pontuacoes = self._pontuar(densidade + p.densidade_min_restante[d], intervalar_minima,
+                                           amplitude_maxima, grave_minimo, densidade, momento1, momento2,
+                                           densidade + p.densidade_max_restante[d],
+                                           maximo + p.maximo_max_restante[d], exata=False)
+
+        # Classes por cobrir que já não cabem nas vozes que faltam
+        faltam = _contar_bits(p.todas_classes & ~cobertas, p.numero_classes)
+        possiveis = (faltam <= n - 1 - d) & ~np.isnan(pontuacoes)
+        return candidatas, np.where(possiveis, pontuacoes, np.inf), somas
+
+    def _pontuar(self, densidade, intervalar, amplitude, grave, densidade_parcial, momento1, momento2,
+                 peso, maximo, exata):
+        """
+        A grandeza pedida, pelas fórmulas de density_pipeline.combinar_componentes.
+
+        Com exata=False os argumentos são limites (densidades e grave mínimos;
+        amplitude, peso total e maximo máximos) e o resultado é um limite
+        inferior: a soma dos desvios quadrados do acorde parcial só pode
+        crescer, mas é dividida pelo peso máximo, e o centroide não fica abaixo
+        da nota mais grave possível.
+        """
+        p = self.problema
+        pontuacoes = p.weight_factor * densidade + (1 - p.weight_factor) * intervalar
+        if p.grandeza == "densidade_ponderada":
+            return pontuacoes
+        if exata:
+            pontuacoes = np.where(amplitude != 0, pontuacoes / amplitude, pontuacoes)
+        else:
+            # densidade_refinada não divide por amplitude 0, pelo que o divisor do limite é pelo menos 1
+            pontuacoes = pontuacoes / np.maximum(amplitude, 1)
+        if p.grandeza == "densidade_refinada":
+            return pontuacoes
+
+        desvios = np.maximum(momento2 - momento1 ** 2 / densidade_parcial, 0)
+        centroide = momento1 / densidade_parcial if exata else grave
+        spread = midi_to_frequency(centroide + np.sqrt(desvios / peso)) - midi_to_frequency(centroide)
+        return pontuacoes * spread / maximo
+
+    def colocar(self, parcial, candidata, somas, posicao):
+        """Acorde parcial com a candidata na voz seguinte (somas e posicao vêm de filhos)."""
+        p = self.problema
+        d = len(parcial.indices)
+        interacoes = {v: parcial.interacoes[v] + p.gaussianas[d, v][candidata] for v in range(d + 1, len(p))}
+        permitidos = p.permitidos[d, d + 1][candidata] if d + 1 < len(p) else None
+        densidade, maximo, intervalar, momento1, momento2, grave, agudo, cobertas = (soma[posicao] for soma in somas)
+        return _Parcial(parcial.indices + (int(candidata),), float(densidade), float(maximo), float(intervalar),
+                        float(momento1), float(momento2), float(grave), float(agudo), int(cobertas),
+                        interacoes, permitidos)
+
+    def explorar(self, parcial=None):
+        """Procura em profundidade a partir de um acorde parcial (por omissão, vazio)."""
+        parcial = self.raiz() if parcial is None else parcial
+        candidatas, pontuacoes, somas = self.filhos(parcial)
+        self.nos += candidatas.size
+        ultima = len(parcial.indices) == len(self.problema) - 1
+        ordem = np.argsort(pontuacoes, kind='stable')
+        for visitados, posicao in enumerate(ordem):
+            pontuacao = pontuacoes[posicao]
+            if pontuacao == np.inf or pontuacao > self.limiar * (1 + TOLERANCIA_PODA):
+                # Os filhos seguintes têm limites ainda maiores
+                self.podados += ordem.size - visitados
+                break
+            if ultima:
+                self._guardar(float(pontuacao), parcial.indices + (int(candidatas[posicao]),))
+            else:
+                self.explorar(self.colocar(parcial, candidatas[posicao], somas, posicao))
+
+    def _guardar(self, pontuacao, indices):
+        if len(self.melhores) < self.k:
+            heapq.heappush(self.melhores, (-pontuacao, indices))
+        elif pontuacao < -self.melhores[0][0]:
+            heapq.heapreplace(self.melhores, (-pontuacao, indices))
+
+    def resultados(self):
+        """(pontuacao, indices) das melhores disposições, da menor pontuação para a maior."""
+        return sorted((-pontuacao, indices) for pontuacao, indices in self.melhores)
+
+
+def subarvores(procura, profundidade):
+    """
+    Acordes parciais com as primeiras vozes colocadas, ordenados pelo limite
+    inferior da sua subárvore (o mais promissor primeiro).
+
+    Returns:
+        list: (limite, parcial) das subárvores possíveis.
+    """
+    nivel = [(0.0, procura.raiz())]
+    for _ in range(profundidade):
+        seguinte = []
+        for _, parcial in nivel:
+            candidatas, pontuacoes, somas = procura.filhos(parcial)
+            procura.nos += candidatas.size
+            for posicao in np.flatnonzero(np.isfinite(pontuacoes)):
+                seguinte.append((float(pontuacoes[posicao]), procura.colocar(parcial, candidatas[posicao], somas, posicao)))
+        nivel = seguinte
+    return sorted(nivel, key=lambda subarvore: subarvore[0])
+
+
+# Problema de cada processo do conjunto (ver _iniciar_processo)
+_problema = None
+
+
+def _iniciar_processo(problema):
+    global _problema
+    _problema = problema
+
+
+def _explorar_subarvore(args):
+    parcial, limiar, k = args
+    procura = Procura(_problema, k, limiar)
+    procura.explorar(parcial)
+    return procura.resultados(), procura.nos, procura.podados
+
+
+@cronometrado("procurar_voicings")
+def procurar_voicings(classes, vozes, k=10, weight_factor=0.5, grandeza="densidade_total", ordenadas=True,
+                      espacamento_maximo=None, cobrir=True, workers=None, profundidade_divisao=2):
+    """
+    As k disposições das classes pelas vozes com menor grandeza.
+
+    Args:
+        classes: classes de alturas, sem oitava (ex.: ['C', 'E', 'G', 'Bb']).
+        vozes: Voz, ou tuplos (instrumento, dinamica[, numero_instrumentos[, extensao]]), do grave para o agudo.
+        ordenadas: notas estritamente ascendentes, pela ordem das vozes.
+        espacamento_maximo: maior intervalo, em meios-tons, entre vozes vizinhas (só com ordenadas).
+        cobrir: todas as classes têm de ser usadas.
+        workers: número de processos (1 = sem paralelismo; por omissão, todos os núcleos).
+        profundidade_divisao: número de vozes fixadas em cada subárvore distribuída pelos processos.
+
+    Returns:
+        list: Voicing(pontuacao, notas, resultado), da menor pontuação para a maior.
+    """
+    problema = ProblemaVoicing(classes, vozes, weight_factor, grandeza, ordenadas, espacamento_maximo, cobrir)
+    procura = Procura(problema, k)
+    if workers == 1 or len(problema) == 1:
+        procura.explorar()
+    else:
+        limites = subarvores(procura, min(profundidade_divisao, len(problema) - 1))
+        if limites:
+            procura.explorar(limites[0][1])
+            limiar = procura.limiar
+            tarefas = [(parcial, limiar, k) for limite, parcial in limites[1:] if limite <= limiar * (1 + TOLERANCIA_PODA)]
+            procura.podados += len(limites) - 1 - len(tarefas)
+
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_processo, initargs=(problema,)) as executor:
+                for resultados, nos, podados in executor.map(_explorar_subarvore, tarefas):
+                    for pontuacao, indices in resultados:
+                        procura._guardar(pontuacao, indices)
+                    procura.nos += nos
+                    procura.podados += podados
+    contar("busca_voicings.nos", procura.nos)
+    contar("busca_voicings.podados", procura.podados)
+    logger.info("%d nós avaliados, %d podados", procura.nos, procura.podados)
+
+    dinamicas = [voz.dinamica for voz in problema.vozes]
+    instrumentos = [voz.instrumento for voz in problema.vozes]
+    numeros_instrumentos = [voz.numero_instrumentos for voz in problema.vozes]
+    voicings = []
+    for _, indices in procura.resultados():
+        notas = problema.notas(indices)
+        resultado = analisar_acorde(notas, dinamicas, instrumentos, numeros_instrumentos, weight_factor)
+        voicings.append(Voicing(resultado[grandeza], notas, resultado))
+    return sorted(voicings, key=lambda voicing: voicing.pontuacao)
+
+
+def _voz(texto):
+    """'instrumento:dinamica[:numero[:grave:agudo]]' (ex.: 'flauta:mf:2:C5:C7')."""
+    partes = texto.split(':')
+    if len(partes) not in (2, 3, 5):
+        raise ValueError(f"Voz inválida: {texto}")
+    numero = int(partes[2]) if len(partes) > 2 else 1
+    extensao = (partes[3], partes[4]) if len(partes) == 5 else None
+    return Voz(partes[0], partes[1], numero, extensao)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Procura das disposições de um conjunto de classes de alturas com menor densidade.")
+    parser.add_argument("classes", nargs="+", help="Classes de alturas, sem oitava (ex.: C E G Bb)")
+    parser.add_argument("--voz", type=_voz, action="append", required=True, dest="vozes",
+                        help="Voz 'instrumento:dinamica[:numero[:grave:agudo]]', do grave para o agudo (repetir)")
+    parser.add_argument("-k", type=int, default=10, help="Número de disposições devolvidas")
+    parser.add_argument("--weight-factor", type=float, default=0.5,
+                        help="Peso da densidade do instrumento face à densidade intervalar (0 a 1)")
+    parser.add_argument("--grandeza", choices=GRANDEZAS, default="densidade_total")
+    parser.add_argument("--cruzadas", action="store_true", help="Permite vozes cruzadas e uníssonos")
+    parser.add_argument("--espacamento-maximo", type=float, default=None,
+                        help="Maior intervalo entre vozes vizinhas, em meios-tons")
+    parser.add_argument("--sem-cobrir", action="store_true", help="Não obriga a usar todas as classes")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Número de processos (1 = sem paralelismo; por omissão, todos os núcleos)")
+    parser.add_argument("--profundidade-divisao", type=int, default=2,
+                        help="Vozes fixadas em cada subárvore distribuída pelos processos")
+    adicionar_argumentos(parser)
+    args = parser.parse_args(argv)
+    aplicar_argumentos(args)
+
+    voicings = procurar_voicings(args.classes, args.vozes, args.k, args.weight_factor, args.grandeza,
+                                 not args.cruzadas, args.espacamento_maximo, not args.sem_cobrir,
+                                 args.workers, args.profundidade_divisao)
+    if not voicings:
+        print("Nenhuma disposição cumpre as restrições.", file=sys.stderr)
+    for posicao, voicing in enumerate(voicings, 1):
+        print(f"{posicao:>3}. {voicing.pontuacao:.6g}  {' '.join(voicing.notas)}")
+    concluir_argumentos(args)
+    return 0 if voicings else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# cache_acordes.py
+
+"""
+Cache dos resultados de density_pipeline pela forma canónica do acorde.
+
+Dois acordes têm a mesma forma canónica quando têm as mesmas linhas (altura,
+dinâmica, instrumento, número de instrumentos), por qualquer ordem e com
+qualquer grafia enarmónica. Guardam-se só as grandezas que não dependem de
+weight_factor (componentes_acorde), pelo que mudar o peso também aproveita a
+cache. A densidade intervalar tem uma subcache própria, indexada pela
+estrutura intervalar (posições relativas à nota mais grave), que é comum a
+todas as transposições do acorde. Como as notas são somadas pela ordem
+canónica, os resultados podem diferir dos de analisar_acorde no último
+algarismo significativo.
+
+As duas caches em memória são LRU com capacidade limitada. Opcionalmente, os
+acordes são também guardados num ficheiro SQLite partilhado entre execuções
+(e entre processos). As chaves incluem SIGMA e a VERSAO_DADOS de cada
+instrumento, para que dados novos não reutilizem resultados antigos.
+
+Exemplo:
+    with CacheAcordes(caminho_sqlite="acordes.sqlite") as cache:
+        resultado = cache.analisar(['C4', 'E4', 'G4'], ['mf'] * 3, ['flauta'], [1, 1, 1])
+        print(cache.estatisticas)
+"""
+
+import json
+import sqlite3
+from collections import OrderedDict
+
+import densidade_intervalar
+from density_pipeline import combinar_componentes, componentes_acorde, preparar_acorde
+from instrumentacao import contar
+from instrumentos import nome_modulo, obter_instrumento
+from parser_notas import SEM_OITAVA, passo_nota
+
+
+VERSAO_CACHE = 1
+CAPACIDADE_POR_OMISSAO = 100_000
+
+# Componentes que seguem a ordem das notas e têm de ser reordenadas para a entrada
+CAMPOS_POR_NOTA = ("pitches", "densidades_instrumento")
+
+
+class LRU:
+    """Dicionário com capacidade limitada que descarta a entrada usada há mais tempo."""
+
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self.dados = OrderedDict()
+
+    def __len__(self):
+        return len(self.dados)
+
+    def obter(self, chave):
+        valor = self.dados.get(chave)
+        if valor is not None:
+            self.dados.move_to_end(chave)
+        return valor
+
+    def guardar(self, chave, valor):
+        self.dados[chave] = valor
+        self.dados.move_to_end(chave)
+        if len(self.dados) > self.capacidade:
+            self.dados.popitem(last=False)
+
+
+class CacheAcordes:
+    """Memoização de componentes_acorde pela forma canónica, com LRU e SQLite opcional."""
+
+    def __init__(self, capacidade=CAPACIDADE_POR_OMISSAO, caminho_sqlite=None, capacidade_intervalar=None):
+        self.acordes = LRU(capacidade)
+        self.intervalos = LRU(capacidade_intervalar or capacidade)
+        self.estatisticas = {"memoria": 0, "disco": 0, "falhas": 0, "intervalar_acertos": 0, "intervalar_falhas": 0}
+        self._versoes = {}
+        self._bd = None
+        if caminho_sqlite:
+            # Em autocommit e WAL, cada resultado fica gravado logo e vários processos podem partilhar o ficheiro
+            self._bd = sqlite3.connect(caminho_sqlite, timeout=30, isolation_level=None, check_same_thread=False)
+            self._bd.execute("PRAGMA journal_mode=WAL")
+            self._bd.execute("PRAGMA synchronous=NORMAL")
+            self._bd.execute("CREATE TABLE IF NOT EXISTS acordes (chave TEXT PRIMARY KEY, componentes TEXT NOT NULL)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excecao):
+        self.fechar()
+
+    def fechar(self):
+        if self._bd is not None:
+            self._bd.close()
+            self._bd = None
+
+    def _contar(self, evento):
+        self.estatisticas[evento] += 1
+        contar(f"cache_acordes.{evento}")
+
+    def _versao(self, modulo):
+        versao = self._versoes.get(modulo)
+        if versao is None:
+            versao = self._versoes[modulo] = str(getattr(obter_instrumento(modulo), 'VERSAO_DADOS', ''))
+        return versao
+
+    def chave(self, notas, dinamicas, instrumentos, numeros_instrumentos):
+        """
+        Forma canónica de um acorde preparado (preparar_acorde).
+
+        Returns:
+            tuple: (chave, ordem), em que ordem[k] é o índice, na entrada, da
+            k-ésima nota da forma canónica.
+        """
+        linhas = [(passo_nota(nota), dinamica, nome_modulo(instrumento), num)
+                  for nota, dinamica, instrumento, num in zip(notas, dinamicas, instrumentos, numeros_instrumentos)]
+        ordem = sorted(range(len(linhas)), key=linhas.__getitem__)
+        versoes = tuple((modulo, self._versao(modulo)) for modulo in sorted({linha[2] for linha in linhas}))
+        return (VERSAO_CACHE, densidade_intervalar.SIGMA, versoes, tuple(linhas[k] for k in ordem)), ordem
+
+    def densidade_intervalar(self, notas):
+        """Densidade intervalar pela estrutura intervalar (invariante por transposição)."""
+        passos = sorted(passo for passo in map(passo_nota, notas) if passo != SEM_OITAVA)
+        chave = (densidade_intervalar.SIGMA, tuple(passo - passos[0] for passo in passos) if passos else ())
+        valor = self.intervalos.obter(chave)
+        if valor is None:
+            self._contar("intervalar_falhas")
+            valor = densidade_intervalar.calcular_densidade_intervalar(notas)
+            self.intervalos.guardar(chave, valor)
+        else:
+            self._contar("intervalar_acertos")
+        return valor
+
+    def _procurar(self, chave):
+        componentes = self.acordes.obter(chave)
+        if componentes is not None:
+            self._contar("memoria")
+            return componentes
+        if self._bd is not None:
+            linha = self._bd.execute("SELECT componentes FROM acordes WHERE chave = ?", (json.dumps(chave),)).fetchone()
+            if linha is not None:
+                self._contar("disco")
+                componentes = json.loads(linha[0])
+                self.acordes.guardar(chave, componentes)
+                return componentes
+        self._contar("falhas")
+        return None
+
+    def _guardar(self, chave, componentes):
+        self.acordes.guardar(chave, componentes)
+        if self._bd is not None:
+            self._bd.execute("INSERT OR REPLACE INTO acordes (chave, componentes) VALUES (?, ?)",
+                             (json.dumps(chave), json.dumps(componentes)))
+
+    def componentes(self, notas, dinamicas, instrumentos, numeros_instrumentos):
+        """componentes_acorde de um acorde preparado, vindas da cache sempre que possível."""
+        if not len(notas) == len(dinamicas) == len(instrumentos) == len(numeros_instrumentos):
+            raise ValueError("As notas, dinâmicas, instrumentos e números de instrumentos têm de ter o mesmo tamanho.")
+        chave, ordem = self.chave(notas, dinamicas, instrumentos, numeros_instrumentos)
+        canonicas = self._procurar(chave)
+        if canonicas is None:
+            notas_canonicas = [notas[k] for k in ordem]
+            canonicas = componentes_acorde(
+                notas_canonicas, [dinamicas[k] for k in ordem], [instrumentos[k] for k in ordem],
+                [numeros_instrumentos[k] for k in ordem], self.densidade_intervalar(notas_canonicas),
+            )
+            # A grafia das notas não faz parte da forma canónica
+            canonicas = {campo: valor for campo, valor in canonicas.items() if campo != "notas"}
+            self._guardar(chave, canonicas)
+
+        componentes = dict(canonicas, notas=list(notas))
+        for campo in CAMPOS_POR_NOTA:
+            valores = [None] * len(ordem)
+            for k, indice in enumerate(ordem):
+                valores[indice] = canonicas[campo][k]
+            componentes[campo] = valores
+        return componentes
+
+    def analisar(self, notas, dinamicas, instrumentos, numeros_instrumentos, weight_factor=0.5):
+        """Mesmo resultado que density_pipeline.analisar_acorde, passando pela cache."""
+        componentes = self.componentes(*preparar_acorde(notas, dinamicas, instrumentos, numeros_instrumentos))
+        return combinar_componentes(componentes, weight_factor)
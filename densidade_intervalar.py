@@ -3,29 +3,18 @@
 import re
 import math
 import numpy as np
-import matplotlib.pyplot as plt
+
+from instrumentacao import contar, cronometro, obter_logger
+from parser_notas import escala_microtonal, nota_para_posicao, posicoes_notas
+
+logger = obter_logger(__name__)
 
 # Define o tamanho da oitava microtonal
 TAMANHO_OITAVA_MICROTONAL = 24
 SIGMA = 50.0
 
-# Unified microtonal scale definition
-escala_microtonal = {
-    'C': 1, 'C#-': 2, 'C#': 3, 'C#+': 4, 
-    'D': 5, 'D#-': 6, 'D#': 7, 'D#+': 8,
-    'E': 9, 'E#-': 10, 
-    'F': 11, 'F#-': 12, 'F#': 13, 'F#+': 14,
-    'G': 15, 'G#-': 16, 'G#': 17, 'G#+': 18, 
-    'A': 19, 'A#-': 20, 'A#': 21, 'A#+': 22,
-    'B': 23, 'B#-': 24, 
-    'Cb+': 24, 
-    'Db+': 2, 'Db': 3, 'Db-': 4, 
-    'Eb+': 6, 'Eb': 7, 'Eb-': 8, 
-    'Fb+': 10, 
-    'Gb+': 12, 'Gb': 13, 'Gb-': 14, 
-    'Ab+': 16, 'Ab': 17, 'Ab-': 18, 
-    'Bb+': 20, 'Bb': 21, 'Bb-': 22,
-}
+# Acima desta extensão (em passos) a autocorrelação do histograma é feita por FFT
+LIMITE_CORRELACAO_DIRETA = 512
 
 # Create a list of all possible notes
 lista_notas = list(escala_microtonal.keys())
@@ -66,22 +55,9 @@ def traduzir_para_intervalo_tradicional(passos_microtonais):
         nome_tradicional += f" + {oitavas} oitava(s)"
     return nome_tradicional
 
-def nota_para_posicao(nota):
-    correspondencia = re.match(r'([A-G][#b]?[-+]?)([0-9x])', nota)
-    if not correspondencia:
-        raise ValueError(f"Nota {nota} não corresponde ao padrão esperado.")
-    nota_sem_oitava, oitava = correspondencia.groups()
-    if oitava == 'x':
-        return None
-    oitava = int(oitava)
-    if nota_sem_oitava not in escala_microtonal:
-        raise ValueError(f"Nota {nota_sem_oitava} não está definida na escala_microtonal.")
-    posicao = escala_microtonal[nota_sem_oitava] + (24 * oitava)
-    return posicao
-
 def obter_intervalos(notas):
-    posicoes = [nota_para_posicao(nota) for nota in notas if nota_para_posicao(nota) is not None]
-    print(f"Posições das notas: {posicoes}")
+    posicoes = posicoes_notas(notas).tolist()
+    logger.debug("Posições das notas: %s", posicoes)
     intervalos = []
     for i in range(len(posicoes)):
         for j in range(i + 1, len(posicoes)):
@@ -89,27 +65,151 @@ def obter_intervalos(notas):
             intervalos.append(f"{traduzir_para_intervalo_tradicional(intervalo)} (intervalo {intervalo})")
     return intervalos
 
-def calcular_densidade_intervalar(notas):
-    """Calcula a densidade intervalar total com base no decaimento gaussiano."""
-    intervalos_str = obter_intervalos(notas)
-    densidade_total = 0
-    for intervalo_str in intervalos_str:
-        passos_microtonais = intervalo_para_numero(intervalo_str)
-        if passos_microtonais is not None:
-            # Não multiplique por 2 novamente, pois já está em passos microtonais
-            densidade_intervalo = decrescimo_gaussiano(passos_microtonais)
-            densidade_total += densidade_intervalo
-            print(f"Microtons: {passos_microtonais}, Densidade(Gauss): {densidade_intervalo}")
-    return densidade_total
+_tabelas_gaussianas = {}
+
+
+def tabela_decrescimo_gaussiano(tamanho):
+    """Tabela de decrescimo_gaussiano para 0..tamanho-1 passos, guardada para o SIGMA atual."""
+    tabela = _tabelas_gaussianas.get(SIGMA)
+    if tabela is not None and tabela.size >= tamanho:
+        contar("cache_tabela_gaussiana.acertos")
+    else:
+        contar("cache_tabela_gaussiana.falhas")
+        passos = np.arange(max(tamanho, TAMANHO_OITAVA_MICROTONAL * 10), dtype=float)
+        tabela = np.exp(-(passos ** 2) / (2 * (SIGMA ** 2)))
+        _tabelas_gaussianas[SIGMA] = tabela
+    return tabela[:tamanho]
+
+
+def contar_intervalos(posicoes, max_passos=None):
+    """Número de pares de notas a cada distância, em passos microtonais.
+
+    As posições são convertidas num histograma de ocupação e as contagens de
+    todos os intervalos obtêm-se pela sua autocorrelação (direta ou por FFT,
+    conforme a extensão), em vez de percorrer todos os pares.
+
+    Returns:
+        np.ndarray: contagens[d] = número de pares à distância d (d = 0..extensão),
+        truncado em max_passos se indicado.
+    """
+    posicoes = np.asarray(posicoes, dtype=np.int64)
+    if posicoes.size < 2:
+        return np.zeros(1, dtype=np.int64)
+    histograma = np.bincount(posicoes - posicoes.min())
+    extensao = histograma.size
+    if extensao <= LIMITE_CORRELACAO_DIRETA:
+        autocorrelacao = np.correlate(histograma, histograma, mode='full')[extensao - 1:]
+    else:
+        tamanho_fft = 1 << int(2 * extensao - 1).bit_length()
+        espectro = np.fft.rfft(histograma, tamanho_fft)
+        autocorrelacao = np.rint(np.fft.irfft(espectro * np.conj(espectro), tamanho_fft)[:extensao]).astype(np.int64)
+    # Na distância 0 a autocorrelação inclui cada nota consigo própria e conta cada par duas vezes
+    autocorrelacao[0] = (autocorrelacao[0] - posicoes.size) // 2
+    if max_passos is not None:
+        autocorrelacao = autocorrelacao[:max_passos + 1]
+    return autocorrelacao
+
+
+def limite_erro_truncagem(numero_notas, max_passos):
+    """Erro máximo de calcular_densidade_intervalar(..., max_passos): todos os pares a mais de
+    max_passos contribuem, cada um, no máximo decrescimo_gaussiano(max_passos + 1)."""
+    numero_pares = numero_notas * (numero_notas - 1) // 2
+    return numero_pares * decrescimo_gaussiano(max_passos + 1)
+
+
+def calcular_densidade_intervalar(notas, max_passos=None):
+    """Calcula a densidade intervalar total com base no decaimento gaussiano.
+
+    Soma decrescimo_gaussiano(intervalo) sobre todos os pares de notas, usando
+    as contagens de contar_intervalos. Com max_passos, os intervalos maiores são
+    ignorados e o erro fica limitado por limite_erro_truncagem.
+    """
+    with cronometro("densidade_intervalar"):
+        contagens = contar_intervalos(posicoes_notas(notas), max_passos)
+        contar("pares_intervalares", int(contagens.sum()))
+        return float(contagens @ tabela_decrescimo_gaussiano(contagens.size))
+
+class AcumuladorDensidadeIntervalar:
+    """Densidade intervalar mantida de forma incremental enquanto se acrescentam ou retiram notas.
+
+    Guarda o histograma de ocupação das posições microtonais e o total atual.
+    Cada atualização custa uma soma vetorizada sobre o histograma (tamanho fixo,
+    independente do número de notas), em vez de refazer todos os pares. Várias
+    notas na mesma altura (vários instrumentistas) entram como quantidade.
+
+    Exemplo:
+        acumulador = AcumuladorDensidadeIntervalar(['C4', 'E4'])
+        acumulador.adicionar('G4', quantidade=2)
+        acumulador.remover('E4')
+        acumulador.consultar()
+    """
+
+    def __init__(self, notas=()):
+        self.histograma = np.zeros(TAMANHO_OITAVA_MICROTONAL * 11, dtype=np.int64)
+        self.numero_notas = 0
+        self.total = 0.0
+        for nota in notas:
+            self.adicionar(nota)
+
+    def __len__(self):
+        return self.numero_notas
+
+    def _contribuicao(self, posicao):
+        """Soma de decrescimo_gaussiano entre a posição e todas as notas atuais."""
+        indices = np.arange(self.histograma.size)
+        tabela = tabela_decrescimo_gaussiano(self.histograma.size)
+        return float(self.histograma @ tabela[np.abs(indices - posicao)])
+
+    def adicionar_posicao(self, posicao, quantidade=1):
+        if posicao < 0 or quantidade < 1:
+            raise ValueError(f"Posição {posicao} ou quantidade {quantidade} inválida.")
+        if posicao >= self.histograma.size:
+            self.histograma = np.concatenate([self.histograma, np.zeros(posicao + 1 - self.histograma.size, dtype=np.int64)])
+        self.total += quantidade * self._contribuicao(posicao) + quantidade * (quantidade - 1) / 2 * decrescimo_gaussiano(0)
+        self.histograma[posicao] += quantidade
+        self.numero_notas += quantidade
+
+    def remover_posicao(self, posicao, quantidade=1):
+        if posicao < 0 or posicao >= self.histograma.size or self.histograma[posicao] < quantidade:
+            raise ValueError(f"Não há {quantidade} nota(s) na posição {posicao} para remover.")
+        self.histograma[posicao] -= quantidade
+        self.numero_notas -= quantidade
+        self.total -= quantidade * self._contribuicao(posicao) + quantidade * (quantidade - 1) / 2 * decrescimo_gaussiano(0)
+        if self.numero_notas < 2:
+            self.total = 0.0
+
+    def adicionar(self, nota, quantidade=1):
+        """Acrescenta quantidade notas iguais (ex.: 'C#4'); notas com oitava 'x' são ignoradas."""
+        posicao = nota_para_posicao(nota)
+        if posicao is not None:
+            self.adicionar_posicao(posicao, quantidade)
+
+    def remover(self, nota, quantidade=1):
+        """Retira quantidade notas iguais; ValueError se não estiverem presentes."""
+        posicao = nota_para_posicao(nota)
+        if posicao is not None:
+            self.remover_posicao(posicao, quantidade)
+
+    def consultar(self):
+        """Densidade intervalar atual (igual a calcular_densidade_intervalar das notas presentes)."""
+        return self.total
+
+    def recalcular(self):
+        """Recalcula o total a partir do histograma, eliminando erros de arredondamento acumulados."""
+        posicoes = np.repeat(np.arange(self.histograma.size), self.histograma)
+        contagens = contar_intervalos(posicoes)
+        self.total = float(contagens @ tabela_decrescimo_gaussiano(contagens.size))
+        return self.total
+
 
 def calcular_amplitude_agregado(notas):
-    posicoes = [nota_para_posicao(nota) for nota in notas if nota_para_posicao(nota) is not None]
-    if not posicoes:
+    posicoes = posicoes_notas(notas)
+    if not posicoes.size:
         return 0
-    return max(posicoes) - min(posicoes)
+    return int(posicoes.max() - posicoes.min())
 
 def calcular_densidade_agregado(notas, dinamicas, quantidade_notas, dinamica_para_alpha):
-    posicoes = [nota_para_valor(nota) for nota in notas if nota_para_valor(nota) is not None]
+    posicoes = posicoes_notas(notas).tolist()
     if not posicoes:
         return 0
     densidade_total = 0
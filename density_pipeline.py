@@ -0,0 +1,462 @@
+# density_pipeline.py
+
+"""
+Pipeline de densidade sem interface gráfica.
+
+Reúne os cálculos que antes só existiam em Main.ao_clicar_no_botao_calcular
+(densidade intervalar, densidade do instrumento, densidades ponderada,
+refinada e total, momentos espectrais e densidade máxima possível), para que
+possam ser usados em lote a partir de CSV/JSONL e distribuídos por vários
+processos.
+
+Exemplo:
+    python density_pipeline.py acordes.csv resultados.csv --workers 4
+"""
+
+import csv
+import json
+import sys
+
+import numpy as np
+
+from densidade_intervalar import calcular_densidade_intervalar
+from advanced_density_analysis import calculate_spectral_moments, calculate_spectral_moments_batch
+from instrumentacao import (adicionar_argumentos, aplicar_argumentos, concluir_argumentos, contar,
+                            cronometrado, cronometro, metricas, obter_logger)
+from instrumentos import avaliar_instrumentos, avaliar_notas, obter_instrumento
+from parser_notas import converter_para_sustenido, midis_notas
+
+
+logger = obter_logger(__name__)
+
+CAMPOS_ENTRADA = ['notas', 'dinamicas', 'instrumentos', 'numeros_instrumentos', 'duracoes']
+
+CAMPOS_RESULTADO = [
+    'id', 'densidade_intervalar', 'densidade_instrumento', 'densidade_ponderada',
+    'densidade_refinada', 'densidade_total', 'spectral_centroid_freq',
+    'spectral_centroid_note', 'spectral_spread', 'spectral_skewness', 'erro',
+]
+
+
+def midi_to_hz(midi_pitch):
+    return 440 * 2**((midi_pitch - 69) / 12)
+
+
+def load_instrument_module(instrument_name):
+    """Módulo do instrumento, a partir do registo em cache de instrumentos.py."""
+    return obter_instrumento(instrument_name)
+
+
+def calcular_densidades_instrumento(instrument_module, notas, dinamicas, numeros_instrumentos):
+    """Densidade de cada nota no instrumento, escalada pelo número de instrumentistas."""
+    densidades, _ = avaliar_notas(instrument_module, notas, dinamicas, numeros_instrumentos)
+    return densidades.tolist()
+
+
+def preparar_acorde(notas, dinamicas, instrumentos, numeros_instrumentos):
+    """Valida o acorde e normaliza-o: notas em sustenidos, números inteiros, um instrumento por nota."""
+    if not notas or not dinamicas or not instrumentos or not numeros_instrumentos:
+        raise ValueError("Please fill in all required fields.")
+    notas = [converter_para_sustenido(nota) for nota in notas]
+    numeros_instrumentos = [int(num) for num in numeros_instrumentos]
+    if len(instrumentos) == 1:
+        instrumentos = list(instrumentos) * len(notas)
+    return notas, list(dinamicas), list(instrumentos), numeros_instrumentos
+
+
+def componentes_acorde(notas, dinamicas, instrumentos, numeros_instrumentos, densidade_intervalar=None):
+    """
+    Grandezas de um acorde já preparado (preparar_acorde) que não dependem de weight_factor.
+
+    densidade_intervalar pode vir já calculada (ex.: de uma cache por estrutura intervalar).
+    """
+    if densidade_intervalar is None:
+        densidade_intervalar = calcular_densidade_intervalar(notas)
+    # Cada nota é avaliada no seu próprio instrumento
+    with cronometro("densidades_instrumento"):
+        densidades, maximos = avaliar_instrumentos(notas, dinamicas, instrumentos, numeros_instrumentos)
+    densidades_instrumento = densidades.tolist()
+
+    pitches = midis_notas(notas).tolist()
+    with cronometro("momentos_espectrais"):
+        result = calculate_spectral_moments(pitches, densidades_instrumento)
+
+    return {
+        "notas": notas,
+        "pitches": pitches,
+        "densidades_instrumento": densidades_instrumento,
+        "densidade_intervalar": densidade_intervalar,
+        "densidade_instrumento": sum(densidades_instrumento),
+        "amplitude": max(pitches) - min(pitches),
+        "max_possible_density": float(maximos.sum()),
+        "spectral_centroid_freq": result["spectral_centroid"]["frequency"],
+        "spectral_centroid_note": result["spectral_centroid"]["note"],
+        "spectral_spread": result["spectral_spread"]["deviation"],
+        "spectral_skewness": result.get("spectral_skewness", np.nan),
+    }
+
+
+def densidade_ponderada(densidade_instrumento, densidade_intervalar, weight_factor):
+    """Média das densidades do instrumento e intervalar, com peso weight_factor na do instrumento."""
+    return (densidade_instrumento * weight_factor) + (densidade_intervalar * (1 - weight_factor))
+
+
+def densidade_refinada(densidade_ponderada, amplitude):
+    """Densidade ponderada por unidade de amplitude (em semitons)."""
+    return densidade_ponderada / amplitude if amplitude != 0 else densidade_ponderada
+
+
+def densidade_total(densidade_refinada, spectral_spread, max_possible_density):
+    """Densidade refinada escalada pelo spread espectral e normalizada pela densidade máxima."""
+    return (densidade_refinada * spectral_spread) / max_possible_density if max_possible_density != 0 else densidade_refinada
+
+
+def combinar_componentes(componentes, weight_factor=0.5):
+    """Junta às componentes as densidades ponderada, refinada e total para um weight_factor."""
+    densidade_ponderada_val = densidade_ponderada(componentes["densidade_instrumento"],
+                                                  componentes["densidade_intervalar"], weight_factor)
+    densidade_refinada_val = densidade_refinada(densidade_ponderada_val, componentes["amplitude"])
+    densidade_total_val = densidade_total(densidade_refinada_val, componentes["spectral_spread"],
+                                          componentes["max_possible_density"])
+
+    resultado = {campo: valor for campo, valor in componentes.items() if campo != "amplitude"}
+    resultado.update({
+        "densidade_ponderada": densidade_ponderada_val,
+        "densidade_refinada": densidade_refinada_val,
+        "densidade_total": densidade_total_val,
+    })
+    return resultado
+
+
+@cronometrado("analisar_acorde")
+def analisar_acorde(notas, dinamicas, instrumentos, numeros_instrumentos, weight_factor=0.5):
+    """
+    Calcula todas as densidades e métricas espectrais de um acorde.
+
+    As notas podem vir com bemóis; são convertidas para sustenidos antes do
+    cálculo, tal como na interface gráfica. Devolve um dicionário com as
+    mesmas grandezas apresentadas por Main, mais as densidades por nota.
+    """
+    componentes = componentes_acorde(*preparar_acorde(notas, dinamicas, instrumentos, numeros_instrumentos))
+    return combinar_componentes(componentes, weight_factor)
+
+
+# Cache de acordes deste processo (cache_acordes.CacheAcordes), ligada por ativar_cache
+_cache = None
+
+
+def ativar_cache(capacidade=None, caminho_sqlite=None):
+    """
+    Liga a cache de acordes usada por analisar_registo neste processo, com uma
+    LRU de capacidade entradas e, opcionalmente, um ficheiro SQLite. Sem
+    argumentos, desliga-a. Serve também de initializer dos processos do lote.
+    """
+    global _cache
+    if _cache is not None:
+        _cache.fechar()
+        _cache = None
+    if capacidade or caminho_sqlite:
+        from cache_acordes import CAPACIDADE_POR_OMISSAO, CacheAcordes
+        _cache = CacheAcordes(capacidade or CAPACIDADE_POR_OMISSAO, caminho_sqlite)
+    return _cache
+
+
+def componentes_bloco(preparados, densidade_intervalar=None):
+    """
+    componentes_acorde de vários acordes preparados, com uma só avaliação dos
+    instrumentos e dos momentos espectrais para todas as notas do bloco.
+
+    Um acorde sem notas, ou com listas de tamanhos diferentes, levanta
+    ValueError em vez de desalinhar as notas dos acordes seguintes.
+    """
+    for preparado in preparados:
+        if not preparado[0] or len(set(map(len, preparado))) != 1:
+            raise ValueError("As notas, dinâmicas, instrumentos e números de instrumentos "
+                             "têm de ter o mesmo tamanho.")
+    notas, dinamicas, instrumentos, numeros_instrumentos = (
+        [valor for preparado in preparados for valor in preparado[k]] for k in range(4))
+    offsets = np.zeros(len(preparados) + 1, dtype=np.int64)
+    np.cumsum([len(preparado[0]) for preparado in preparados], out=offsets[1:])
+    with cronometro("densidades_instrumento"):
+        densidades, maximos = avaliar_instrumentos(notas, dinamicas, instrumentos, numeros_instrumentos)
+    pitches = midis_notas(notas)
+    with cronometro("momentos_espectrais"):
+        momentos = calculate_spectral_moments_batch(pitches, densidades, offsets)
+
+    blocos = []
+    for i, (inicio, fim) in enumerate(zip(offsets[:-1], offsets[1:])):
+        densidades_instrumento = densidades[inicio:fim].tolist()
+        pitches_acorde = pitches[inicio:fim].tolist()
+        blocos.append({
+            "notas": notas[inicio:fim],
+            "pitches": pitches_acorde,
+            "densidades_instrumento": densidades_instrumento,
+            "densidade_intervalar": (calcular_densidade_intervalar(notas[inicio:fim])
+                                     if densidade_intervalar is None else densidade_intervalar),
+            "densidade_instrumento": sum(densidades_instrumento),
+            "amplitude": max(pitches_acorde) - min(pitches_acorde),
+            "max_possible_density": float(maximos[inicio:fim].sum()),
+            "spectral_centroid_freq": momentos["centroid_freq"][i],
+            "spectral_centroid_note": str(momentos["centroid_note"][i]),
+            "spectral_spread": momentos["spread_freq"][i],
+            "spectral_skewness": momentos["skewness"][i],
+        })
+    return blocos
+
+
+def _componentes_isolados(preparados, densidade_intervalar):
+    """componentes_bloco, partindo o bloco ao meio quando falha; None nos acordes que falham sozinhos."""
+    try:
+        return componentes_bloco(preparados, densidade_intervalar)
+    except Exception:
+        if len(preparados) == 1:
+            return [None]
+        meio = len(preparados) // 2
+        return (_componentes_isolados(preparados[:meio], densidade_intervalar)
+                + _componentes_isolados(preparados[meio:], densidade_intervalar))
+
+
+def componentes_acordes(acordes, densidade_intervalar=None):
+    """
+    componentes_bloco de acordes lidos de ficheiro (dicionários com as chaves
+    de CAMPOS_ENTRADA), pela mesma ordem. Um acorde que não pode ser
+    preparado, com listas de tamanhos diferentes ou com uma nota que falha
+    (isolada partindo o bloco) fica a None, para quem chama o analisar à parte
+    e registar o erro.
+    """
+    componentes, preparados, validos = [None] * len(acordes), [], []
+    for i, acorde in enumerate(acordes):
+        try:
+            preparados.append(preparar_acorde(acorde['notas'], acorde['dinamicas'], acorde['instrumentos'],
+                                              acorde['numeros_instrumentos']))
+        except Exception:
+            continue
+        validos.append(i)
+    if preparados:
+        for i, valor in zip(validos, _componentes_isolados(preparados, densidade_intervalar)):
+            componentes[i] = valor
+    return componentes
+
+
+def analisar_registo(args):
+    """Analisa um acorde lido de ficheiro; os erros ficam registados em vez de interromper o lote."""
+    acorde, weight_factor = args
+    linha = {campo: None for campo in CAMPOS_RESULTADO}
+    linha['id'] = acorde.get('id')
+    analisar = _cache.analisar if _cache is not None else analisar_acorde
+    try:
+        resultado = analisar(
+            acorde['notas'], acorde['dinamicas'], acorde['instrumentos'],
+            acorde['numeros_instrumentos'], weight_factor,
+        )
+    except Exception as e:
+        linha['erro'] = f"{type(e).__name__}: {e}"
+        contar("acordes_com_erro")
+        logger.debug("Acorde %s: %s", linha['id'], linha['erro'])
+        return linha
+    for campo in CAMPOS_RESULTADO:
+        if campo in resultado:
+            linha[campo] = resultado[campo]
+    return linha
+
+
+def analisar_bloco(tarefas):
+    """
+    Versão em bloco de analisar_registo: as linhas de resultado de uma lista de
+    (acorde, weight_factor), pela mesma ordem, com as notas de todos os acordes
+    avaliadas de uma só vez (componentes_acordes). Um acorde com erro (ex.: uma
+    nota fora da tabela) é analisado por analisar_registo, que regista o erro
+    na linha. Os momentos espectrais são calculados em vetor, pelo que podem
+    diferir dos de analisar_acorde no último algarismo.
+    """
+    linhas = []
+    for (acorde, weight_factor), componentes in zip(tarefas, componentes_acordes([acorde for acorde, _ in tarefas])):
+        if componentes is None:
+            linhas.append(analisar_registo((acorde, weight_factor)))
+            continue
+        resultado = combinar_componentes(componentes, weight_factor)
+        linha = {campo: resultado.get(campo) for campo in CAMPOS_RESULTADO}
+        linha['id'] = acorde.get('id')
+        linhas.append(linha)
+    return linhas
+
+
+def _analisar_registos(tarefas):
+    return [analisar_registo(tarefa) for tarefa in tarefas]
+
+
+def analisar_lote(acordes, weight_factor=0.5, workers=None, chunksize=64, cache_capacidade=None, cache_sqlite=None,
+                  max_pendentes=None):
+    """
+    Analisa uma sequência de acordes, opcionalmente num conjunto de processos.
+
+    Cada acorde é um dicionário com as chaves de CAMPOS_ENTRADA (e um 'id'
+    opcional). Devolve um gerador de linhas de resultado pela mesma ordem.
+    Com workers=1 tudo corre no processo atual. Com vários processos, os
+    acordes são lidos à medida que há lugar: só max_pendentes blocos de
+    chunksize acordes (por omissão, 2 blocos por processo) estão submetidos
+    ou à espera de ser devolvidos. Com cache_capacidade e/ou cache_sqlite, os
+    acordes repetidos (na forma canónica de cache_acordes) são lidos da
+    cache; cada processo tem a sua LRU e todos partilham o SQLite.
+    """
+    tarefas = ((acorde, weight_factor) for acorde in acordes)
+    usar_cache = bool(cache_capacidade or cache_sqlite)
+    if workers == 1:
+        if usar_cache:
+            ativar_cache(cache_capacidade, cache_sqlite)
+        try:
+            yield from map(analisar_registo, tarefas)
+        finally:
+            if usar_cache:
+                ativar_cache()
+        return
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import islice
+
+    workers = workers or os.cpu_count() or 1
+    blocos = iter(lambda: list(islice(tarefas, chunksize)), [])
+    inicializacao = {'initializer': ativar_cache, 'initargs': (cache_capacidade, cache_sqlite)} if usar_cache else {}
+    with ProcessPoolExecutor(max_workers=workers, **inicializacao) as executor:
+        for linhas in mapa_limitado(executor, _analisar_registos, blocos, max_pendentes or 2 * workers):
+            yield from linhas
+
+
+def mapa_limitado(executor, funcao, argumentos, max_pendentes):
+    """
+    Como executor.map(funcao, argumentos), mas só lê um argumento quando há
+    lugar: no máximo max_pendentes tarefas estão submetidas ou à espera de ser
+    devolvidas. Os resultados saem pela ordem dos argumentos.
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    pendentes, prontos, proximo = {}, {}, 0   # futuro -> índice; índice -> resultado
+
+    def devolver(limite):
+        # Devolve os resultados prontos pela ordem, esperando até haver menos de limite por devolver
+        nonlocal proximo
+        while len(pendentes) + len(prontos) >= limite:
+            if proximo in prontos:
+                yield prontos.pop(proximo)
+                proximo += 1
+                continue
+            feitos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+            for futuro in feitos:
+                prontos[pendentes.pop(futuro)] = futuro.result()
+
+    for indice, argumento in enumerate(argumentos):
+        yield from devolver(max_pendentes)
+        pendentes[executor.submit(funcao, argumento)] = indice
+    yield from devolver(1)
+
+
+def ler_acordes_csv(caminho):
+    """
+    Lê acordes de um CSV em formato longo: uma linha por nota, com as colunas
+    id, nota, dinamica, instrumento, numero_instrumentos e duracao.
+    Linhas consecutivas com o mesmo id formam um acorde.
+    """
+    with open(caminho, newline='', encoding='utf-8') as f:
+        acorde = None
+        for linha in csv.DictReader(f):
+            if acorde is None or linha['id'] != acorde['id']:
+                if acorde is not None:
+                    yield acorde
+                acorde = {'id': linha['id'], **{campo: [] for campo in CAMPOS_ENTRADA}}
+            acorde['notas'].append(linha['nota'].strip())
+            acorde['dinamicas'].append(linha.get('dinamica') or 'mf')
+            acorde['instrumentos'].append(linha.get('instrumento') or 'flauta')
+            acorde['numeros_instrumentos'].append(int(linha.get('numero_instrumentos') or 1))
+            acorde['duracoes'].append(float(linha.get('duracao') or 1))
+        if acorde is not None:
+            yield acorde
+
+
+def ler_acordes_jsonl(caminho):
+    """Lê acordes de um ficheiro JSONL, um objeto por linha com as chaves de CAMPOS_ENTRADA."""
+    with open(caminho, encoding='utf-8') as f:
+        for numero_linha, linha in enumerate(f, 1):
+            if not linha.strip():
+                continue
+            acorde = json.loads(linha)
+            acorde.setdefault('id', str(numero_linha))
+            n = len(acorde['notas'])
+            acorde.setdefault('dinamicas', ['mf'] * n)
+            acorde.setdefault('instrumentos', ['flauta'] * n)
+            acorde.setdefault('numeros_instrumentos', [1] * n)
+            acorde.setdefault('duracoes', [1] * n)
+            yield acorde
+
+
+def _formato(caminho, formato):
+    if formato:
+        return formato
+    return 'jsonl' if caminho.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+
+def _valor_serializavel(valor):
+    if isinstance(valor, np.generic):
+        valor = valor.item()
+    if isinstance(valor, float) and not np.isfinite(valor):
+        return None
+    return valor
+
+
+def escrever_resultados(linhas, caminho, formato=None, campos=CAMPOS_RESULTADO):
+    """Escreve as linhas de resultado em CSV ou JSONL, à medida que vão chegando."""
+    formato = _formato(caminho, formato)
+    total = 0
+    with open(caminho, 'w', newline='', encoding='utf-8') as f:
+        if formato == 'csv':
+            writer = csv.DictWriter(f, fieldnames=campos)
+            writer.writeheader()
+        for linha in linhas:
+            linha = {campo: _valor_serializavel(linha.get(campo)) for campo in campos}
+            if formato == 'csv':
+                writer.writerow(linha)
+            else:
+                f.write(json.dumps(linha, ensure_ascii=False) + '\n')
+            total += 1
+    return total
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Análise de densidade em lote (sem interface gráfica).")
+    parser.add_argument("entrada", help="Ficheiro de acordes (.csv ou .jsonl)")
+    parser.add_argument("saida", help="Ficheiro de resultados (.csv ou .jsonl)")
+    parser.add_argument("--formato-entrada", choices=['csv', 'jsonl'])
+    parser.add_argument("--formato-saida", choices=['csv', 'jsonl'])
+    parser.add_argument("--weight-factor", type=float, default=0.5,
+                        help="Peso da densidade do instrumento face à densidade intervalar (0 a 1)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Número de processos (1 = sem paralelismo; por omissão, todos os núcleos)")
+    parser.add_argument("--chunksize", type=int, default=64)
+    parser.add_argument("--cache-memoria", type=int, default=None,
+                        help="Capacidade da cache LRU de acordes de cada processo")
+    parser.add_argument("--cache-sqlite", default=None,
+                        help="Ficheiro SQLite com os acordes já analisados, partilhado entre execuções")
+    adicionar_argumentos(parser)
+    args = parser.parse_args(argv)
+    aplicar_argumentos(args)
+
+    if _formato(args.entrada, args.formato_entrada) == 'csv':
+        acordes = ler_acordes_csv(args.entrada)
+    else:
+        acordes = ler_acordes_jsonl(args.entrada)
+
+    linhas = analisar_lote(acordes, args.weight_factor, args.workers, args.chunksize,
+                           args.cache_memoria, args.cache_sqlite)
+    total = escrever_resultados(linhas, args.saida, args.formato_saida)
+    print(f"{total} acordes analisados -> {args.saida}", file=sys.stderr)
+    if args.workers == 1 and (args.cache_memoria or args.cache_sqlite):
+        contadores = metricas.resumo()["contadores"]
+        print("Cache: " + ", ".join(f"{evento} {contadores.get(f'cache_acordes.{evento}', 0)}"
+                                    for evento in ("memoria", "disco", "falhas")), file=sys.stderr)
+    concluir_argumentos(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
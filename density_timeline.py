@@ -0,0 +1,278 @@
+# density_timeline.py
+
+"""
+Curvas de densidade ao longo do tempo.
+
+Recebe eventos de nota com tempo (início, duração, nota, dinâmica, instrumento,
+número de instrumentos) ordenados pelo início e produz, a cada passo (hop), as
+mesmas grandezas de density_pipeline.analisar_acorde para as notas que soam
+nessa janela. O estado é atualizado de forma incremental: cada janela só
+processa os eventos que entram e os que saem, em vez de reanalisar todas as
+notas que soam.
+
+Exemplo:
+    python density_timeline.py eventos.csv curvas.csv --hop 0.5
+"""
+
+import csv
+import heapq
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from advanced_density_analysis import midi_to_frequency, frequency_to_note_name
+from densidade_intervalar import AcumuladorDensidadeIntervalar
+from instrumentacao import adicionar_argumentos, aplicar_argumentos, concluir_argumentos, contar
+from instrumentos import avaliar_notas, obter_instrumento
+from parser_notas import converter_para_sustenido, nota_para_midi, nota_para_posicao
+
+
+EventoNota = namedtuple("EventoNota", ["inicio", "duracao", "nota", "dinamica", "instrumento", "quantidade"])
+EventoNota.__new__.__defaults__ = ("mf", "flauta", 1)
+
+# Atualizações incrementais entre dois recálculos completos das somas a partir das notas que soam
+RECALCULO_A_CADA = 4096
+
+CAMPOS_CURVA = [
+    "tempo", "numero_notas", "densidade_intervalar", "densidade_instrumento", "densidade_ponderada",
+    "densidade_refinada", "densidade_total", "spectral_centroid_freq", "spectral_centroid_note",
+    "spectral_spread", "spectral_skewness",
+]
+
+
+def eventos_de_acorde(notas, dinamicas, instrumentos, numeros_instrumentos, duracoes):
+    """Converte as linhas de Main (todas a começar em 0) em eventos com a respetiva duração."""
+    return [EventoNota(0, duracao, nota, dinamica, instrumento, num)
+            for nota, dinamica, instrumento, num, duracao
+            in zip(notas, dinamicas, instrumentos, numeros_instrumentos, duracoes)]
+
+
+class _EstadoJanela:
+    """
+    Somas correntes das notas que soam, atualizadas a cada entrada/saída de evento.
+
+    Os momentos dos pitches MIDI, ponderados pela densidade, são guardados já
+    centrados (peso total, média, M2 e M3, com as atualizações de Welford e
+    Pébay), em vez de somas de w*p^k, que perdem precisão ao subtrair valores
+    grandes. Mesmo assim, de RECALCULO_A_CADA em RECALCULO_A_CADA atualizações
+    (e quando o peso total se anula) tudo é recalculado a partir das notas que
+    soam (recalcular).
+    """
+
+    def __init__(self):
+        self.intervalos = AcumuladorDensidadeIntervalar()
+        self.numero_notas = 0
+        self._zerar_somas()
+
+    def _zerar_somas(self):
+        self.densidade_instrumento = 0.0
+        self.max_possible_density = 0.0
+        self.peso, self.media, self.m2, self.m3 = 0.0, 0.0, 0.0, 0.0
+        self.atualizacoes = 0
+        self.sujo = False
+
+    def contribuicao(self, evento):
+        """Grandezas de um evento, calculadas uma só vez quando ele entra (None para oitava 'x')."""
+        nota = converter_para_sustenido(evento.nota)
+        posicao = nota_para_posicao(nota)
+        if posicao is None:
+            return None
+        modulo = obter_instrumento(evento.instrumento)
+        quantidade = int(evento.quantidade)
+        densidades, maximos = avaliar_notas(modulo, [nota], [evento.dinamica], [quantidade])
+        return posicao, float(densidades[0]), float(maximos[0]), float(nota_para_midi(nota))
+
+    def _acrescentar_momentos(self, w, x):
+        peso = self.peso + w
+        if self.peso == 0 or peso == 0:
+            self.sujo = True
+            return
+        delta = x - self.media
+        self.m3 += self.peso * w * delta ** 3 * (self.peso - w) / peso ** 2 - 3 * w * delta * self.m2 / peso
+        self.m2 += self.peso * w * delta ** 2 / peso
+        self.media += w * delta / peso
+        self.peso = peso
+
+    def _retirar_momentos(self, w, x):
+        peso = self.peso - w
+        if self.peso == 0 or peso == 0:
+            self.sujo = True
+            return
+        media = (self.peso * self.media - w * x) / peso
+        delta = x - media
+        self.m2 -= peso * w * delta ** 2 / self.peso
+        self.m3 -= peso * w * delta ** 3 * (peso - w) / self.peso ** 2 - 3 * w * delta * self.m2 / self.peso
+        self.media, self.peso = media, peso
+
+    def aplicar(self, contribuicao, sinal):
+        posicao, densidade, maxima, midi = contribuicao
+        if sinal > 0:
+            self.intervalos.adicionar_posicao(posicao)
+        else:
+            self.intervalos.remover_posicao(posicao)
+        self.numero_notas += sinal
+        if self.numero_notas == 0:
+            self._zerar_somas()
+            return
+        self.densidade_instrumento += sinal * densidade
+        self.max_possible_density += sinal * maxima
+        if self.numero_notas == 1 and sinal > 0:
+            self.peso, self.media, self.m2, self.m3 = densidade, midi, 0.0, 0.0
+        elif self.sujo:
+            return  # as somas vão ser refeitas por recalcular
+        elif sinal > 0:
+            self._acrescentar_momentos(densidade, midi)
+        else:
+            self._retirar_momentos(densidade, midi)
+        self.atualizacoes += 1
+        self.sujo = self.sujo or self.atualizacoes >= RECALCULO_A_CADA
+
+    def recalcular(self, contribuicoes):
+        """Refaz todas as somas a partir das contribuições das notas que soam."""
+        self._zerar_somas()
+        self.intervalos.recalcular()
+        if not contribuicoes:
+            return
+        _, densidades, maximos, midis = (np.array(valores, dtype=float) for valores in zip(*contribuicoes))
+        self.densidade_instrumento = float(densidades.sum())
+        self.max_possible_density = float(maximos.sum())
+        self.peso = float(densidades.sum())
+        if self.peso != 0:
+            self.media = float(densidades @ midis / self.peso)
+            desvios = midis - self.media
+            self.m2 = float(densidades @ desvios ** 2)
+            self.m3 = float(densidades @ desvios ** 3)
+        contar("timeline_recalculos")
+
+    def resultados(self, weight_factor):
+        densidade_intervalar_val = self.intervalos.consultar()
+        densidade_ponderada_val = (self.densidade_instrumento * weight_factor) + (densidade_intervalar_val * (1 - weight_factor))
+
+        ocupadas = np.flatnonzero(self.intervalos.histograma)
+        amplitude = (ocupadas[-1] - ocupadas[0]) / 2 if ocupadas.size else 0
+        densidade_refinada_val = densidade_ponderada_val / amplitude if amplitude != 0 else densidade_ponderada_val
+
+        if self.numero_notas == 0 or self.peso == 0:
+            centroid_freq, spread_freq, skewness, nota_centroid = np.nan, np.nan, np.nan, "Invalid"
+        else:
+            centroid = self.media
+            variancia = self.m2 / self.peso
+            # Abaixo deste limite a variância é só erro de arredondamento
+            spread = np.sqrt(variancia) if variancia > 1e-12 * centroid ** 2 else 0.0
+            terceiro = self.m3 / self.peso
+            skewness = terceiro / spread ** 3 if spread != 0 else np.nan
+            centroid_freq = midi_to_frequency(centroid)
+            spread_freq = midi_to_frequency(centroid + spread) - centroid_freq
+            nota_centroid = frequency_to_note_name(centroid_freq)
+
+        if self.max_possible_density != 0 and self.numero_notas:
+            densidade_total_val = (densidade_refinada_val * spread_freq) / self.max_possible_density
+        else:
+            densidade_total_val = densidade_refinada_val
+
+        return {
+            "numero_notas": self.numero_notas,
+            "densidade_intervalar": densidade_intervalar_val,
+            "densidade_instrumento": self.densidade_instrumento,
+            "densidade_ponderada": densidade_ponderada_val,
+            "densidade_refinada": densidade_refinada_val,
+            "densidade_total": densidade_total_val,
+            "spectral_centroid_freq": centroid_freq,
+            "spectral_centroid_note": nota_centroid,
+            "spectral_spread": spread_freq,
+            "spectral_skewness": skewness,
+        }
+
+
+def curvas_densidade(eventos, hop, janela=None, weight_factor=0.5, inicio=0.0):
+    """
+    Gera, para cada instante inicio + k * hop, as densidades das notas que soam na janela
+    [t, t + janela) (por omissão janela = hop).
+
+    Os eventos (EventoNota ou tuplos na mesma ordem) têm de vir ordenados pelo início e
+    podem ser um gerador: só ficam em memória os que estão a soar. Notas de oitava 'x'
+    e eventos de duração nula são ignorados.
+
+    Yields:
+        dict: uma linha com as chaves de CAMPOS_CURVA por janela.
+    """
+    if hop <= 0:
+        raise ValueError("O hop tem de ser positivo.")
+    janela = hop if janela is None else janela
+    estado = _EstadoJanela()
+    a_soar = []  # heap de (fim, ordem, contribuição)
+    eventos = iter(eventos)
+    proximo = next(eventos, None)
+    ultimo_inicio = -np.inf
+    ordem = 0
+    k = 0
+
+    while proximo is not None or a_soar:
+        tempo = inicio + k * hop
+        while proximo is not None and proximo[0] < tempo + janela:
+            evento = EventoNota(*proximo)
+            if evento.inicio < ultimo_inicio:
+                raise ValueError("Os eventos têm de estar ordenados pelo início.")
+            ultimo_inicio = evento.inicio
+            fim = evento.inicio + evento.duracao
+            contribuicao = estado.contribuicao(evento) if fim > tempo and evento.duracao > 0 else None
+            if contribuicao is not None:
+                estado.aplicar(contribuicao, 1)
+                heapq.heappush(a_soar, (fim, ordem, contribuicao))
+                ordem += 1
+            proximo = next(eventos, None)
+        while a_soar and a_soar[0][0] <= tempo:
+            estado.aplicar(heapq.heappop(a_soar)[2], -1)
+        if estado.sujo:
+            estado.recalcular([contribuicao for _, _, contribuicao in a_soar])
+        contar("janelas_timeline")
+        yield {"tempo": tempo, **estado.resultados(weight_factor)}
+        k += 1
+
+
+def curvas_para_arrays(linhas):
+    """Junta as linhas de curvas_densidade num dicionário de arrays (um por grandeza)."""
+    colunas = {campo: [] for campo in CAMPOS_CURVA}
+    for linha in linhas:
+        for campo in CAMPOS_CURVA:
+            colunas[campo].append(linha[campo])
+    return {campo: np.array(valores) for campo, valores in colunas.items()}
+
+
+def ler_eventos_csv(caminho):
+    """Lê eventos de um CSV com as colunas inicio, duracao, nota, dinamica, instrumento e numero_instrumentos."""
+    with open(caminho, newline='', encoding='utf-8') as f:
+        for linha in csv.DictReader(f):
+            yield EventoNota(float(linha['inicio']), float(linha['duracao']), linha['nota'].strip(),
+                             linha.get('dinamica') or 'mf', linha.get('instrumento') or 'flauta',
+                             int(linha.get('numero_instrumentos') or 1))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Curvas de densidade ao longo do tempo.")
+    parser.add_argument("entrada", help="CSV de eventos ordenados pelo início")
+    parser.add_argument("saida", help="CSV com uma linha por janela")
+    parser.add_argument("--hop", type=float, default=1.0)
+    parser.add_argument("--janela", type=float, default=None, help="Largura da janela (por omissão igual ao hop)")
+    parser.add_argument("--weight-factor", type=float, default=0.5)
+    adicionar_argumentos(parser)
+    args = parser.parse_args(argv)
+    aplicar_argumentos(args)
+
+    total = 0
+    with open(args.saida, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=CAMPOS_CURVA)
+        writer.writeheader()
+        for linha in curvas_densidade(ler_eventos_csv(args.entrada), args.hop, args.janela, args.weight_factor):
+            writer.writerow(linha)
+            total += 1
+    print(f"{total} janelas -> {args.saida}", file=sys.stderr)
+    concluir_argumentos(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,398 @@
+# execucao_corpus.py
+
+"""
+Execução retomável de density_pipeline sobre um diretório de partituras.
+
+Os ficheiros do corpus (.mid/.midi, fatiados por midi_slices, e ficheiros de
+acordes .csv/.jsonl, como em density_pipeline.py) são agrupados em blocos de
+cerca de tamanho_bloco bytes. Cada bloco é processado por um processo e
+escrito no seu próprio ficheiro blocos/<chave>.jsonl, gravado de uma só vez
+(ficheiro temporário + os.replace). No fim de cada bloco é acrescentada uma
+linha ao manifesto.jsonl do diretório de saída. Uma execução interrompida
+(morta, sem energia...) é retomada com o mesmo comando: os blocos já no
+manifesto são saltados.
+
+A chave de um bloco é um hash dos caminhos, tamanhos e datas de modificação
+dos seus ficheiros e dos parâmetros da execução (weight_factor, SIGMA e a
+VERSAO_DADOS dos instrumentos). Um ficheiro alterado, ou dados novos, voltam
+assim a ser processados. As fronteiras dos blocos dependem do conteúdo: um
+bloco fecha depois de um ficheiro escolhido pelo hash do seu caminho (com
+probabilidade proporcional ao seu tamanho), e não por somas acumuladas desde
+o início da lista. Acrescentar ou retirar um ficheiro só muda o seu bloco,
+e não todos os seguintes. No fim de uma execução completa, o manifesto é
+reescrito só com os blocos do plano e os blocos/*.jsonl antigos são apagados.
+Um
+ficheiro que não possa ser lido fica registado como erro no manifesto, com
+as linhas que já tinha escrito retiradas, e o resto do bloco continua. Os
+erros de um acorde ficam na coluna 'erro', como em density_pipeline. Só há
+max_pendentes blocos em curso ao mesmo tempo. O progresso (blocos, linhas,
+linhas/s e tempo em falta) é mostrado no stderr.
+
+Exemplo:
+    python execucao_corpus.py partituras/ saida/ --workers 8 --juntar resultados.csv
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+
+import densidade_intervalar
+from density_pipeline import (_formato, _valor_serializavel, analisar_registo, ativar_cache,
+                              escrever_resultados, ler_acordes_csv, ler_acordes_jsonl)
+from instrumentacao import (adicionar_argumentos, aplicar_argumentos, concluir_argumentos, contar,
+                            cronometrado, obter_logger)
+from instrumentos import obter_instrumento
+from midi_slices import CAMPOS_FATIA, analisar_midi
+
+
+EXTENSOES_MIDI = (".mid", ".midi")
+EXTENSOES_ACORDES = (".csv", ".jsonl", ".json")
+
+CAMPOS_CORPUS = ['ficheiro'] + CAMPOS_FATIA
+
+# Tamanho médio (bytes de entrada) de um bloco, e máximos de ficheiros e de bytes por bloco
+TAMANHO_BLOCO = 4 * 1024 * 1024
+MAX_FICHEIROS_BLOCO = 64
+MAX_TAMANHOS_BLOCO = 4
+
+# Instrumentos cuja VERSAO_DADOS entra nas chaves dos blocos
+INSTRUMENTOS = ("flauta",)
+
+# Muda sempre que o formato do manifesto ou dos blocos muda
+VERSAO_MANIFESTO = 2
+MANIFESTO = "manifesto.jsonl"
+DIRETORIO_BLOCOS = "blocos"
+
+# Bloco do plano: chave, ficheiros (relativos à raiz do corpus) e bytes de entrada
+Bloco = namedtuple("Bloco", ["chave", "ficheiros", "tamanho"])
+
+logger = obter_logger(__name__)
+
+
+def descobrir_ficheiros(raiz):
+    """Ficheiros do corpus em raiz (recursivamente), relativos a raiz e por ordem alfabética."""
+    if os.path.isfile(raiz):
+        return [os.path.basename(raiz)]
+    ficheiros = []
+    for diretorio, subdiretorios, nomes in os.walk(raiz):
+        subdiretorios[:] = [nome for nome in subdiretorios if not nome.startswith(".")]
+        for nome in nomes:
+            if nome.lower().endswith(EXTENSOES_MIDI + EXTENSOES_ACORDES) and not nome.startswith((".", "~$")):
+                ficheiros.append(os.path.relpath(os.path.join(diretorio, nome), raiz))
+    return sorted(ficheiros)
+
+
+def parametros_execucao(weight_factor=0.5, instrumentos=INSTRUMENTOS):
+    """Parâmetros de que os resultados dependem; entram no cabeçalho do manifesto e nas chaves dos blocos."""
+    return {
+        "versao": VERSAO_MANIFESTO,
+        "weight_factor": weight_factor,
+        "sigma": densidade_intervalar.SIGMA,
+        "versoes_dados": {instrumento: str(getattr(obter_instrumento(instrumento), 'VERSAO_DADOS', ''))
+                          for instrumento in instrumentos},
+    }
+
+
+def _fronteira(ficheiro, tamanho, tamanho_bloco):
+    """Fecha-se um bloco depois deste ficheiro? Depende só do seu caminho e tamanho (blocos de tamanho_bloco em média)."""
+    sorteio = int.from_bytes(hashlib.sha1(ficheiro.encode("utf-8")).digest()[:8], "big") / 2 ** 64
+    return sorteio * tamanho_bloco < tamanho
+
+
+def planear_blocos(raiz, ficheiros, tamanho_bloco=TAMANHO_BLOCO, max_ficheiros=MAX_FICHEIROS_BLOCO, parametros=None):
+    """
+    Agrupa os ficheiros, pela ordem dada, em blocos de cerca de tamanho_bloco
+    bytes, com fronteiras escolhidas por _fronteira. Um bloco também fecha ao
+    chegar a max_ficheiros ficheiros ou a MAX_TAMANHOS_BLOCO * tamanho_bloco
+    bytes; essas fronteiras só se propagam até à próxima fronteira de conteúdo.
+    """
+    raiz = raiz if os.path.isdir(raiz) else os.path.dirname(raiz)
+    blocos, atual, identidades, tamanho = [], [], [], 0
+
+    def fechar():
+        chave = hashlib.sha1(json.dumps([parametros, identidades], sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        blocos.append(Bloco(chave, list(atual), tamanho))
+
+    for ficheiro in ficheiros:
+        estado = os.stat(os.path.join(raiz, ficheiro))
+        atual.append(ficheiro)
+        identidades.append([ficheiro, estado.st_size, estado.st_mtime_ns])
+        tamanho += estado.st_size
+        if (_fronteira(ficheiro, estado.st_size, tamanho_bloco) or len(atual) >= max_ficheiros
+                or tamanho >= MAX_TAMANHOS_BLOCO * tamanho_bloco):
+            fechar()
+            atual, identidades, tamanho = [], [], 0
+    if atual:
+        fechar()
+    return blocos
+
+
+def linhas_ficheiro(caminho, weight_factor=0.5):
+    """Linhas de resultado de um ficheiro do corpus (fatias de um MIDI ou acordes de um CSV/JSONL)."""
+    if caminho.lower().endswith(EXTENSOES_MIDI):
+        yield from analisar_midi(caminho, weight_factor)
+        return
+    acordes = ler_acordes_csv(caminho) if _formato(caminho, None) == 'csv' else ler_acordes_jsonl(caminho)
+    for acorde in acordes:
+        yield analisar_registo((acorde, weight_factor))
+
+
+def processar_bloco(args):
+    """
+    Processa os ficheiros de um bloco e grava as linhas em blocos/<chave>.jsonl.
+
+    Returns:
+        dict: a entrada do manifesto (chave, ficheiros, linhas, erros por ficheiro, segundos).
+    """
+    raiz, diretorio_saida, bloco, weight_factor = args
+    inicio = time.perf_counter()
+    destino = os.path.join(diretorio_saida, DIRETORIO_BLOCOS, f"{bloco.chave}.jsonl")
+    temporario = f"{destino}.{os.getpid()}.tmp"
+    linhas, erros = 0, {}
+    with open(temporario, "w", encoding="utf-8") as f:
+        for ficheiro in bloco.ficheiros:
+            posicao, linhas_antes = f.tell(), linhas
+            try:
+                for linha in linhas_ficheiro(os.path.join(raiz, ficheiro), weight_factor):
+                    linha = {campo: _valor_serializavel(linha.get(campo)) for campo in CAMPOS_FATIA}
+                    f.write(json.dumps({'ficheiro': ficheiro, **linha}, ensure_ascii=False) + "\n")
+                    linhas += 1
+            except Exception as e:
+                # Um ficheiro ilegível não deixa linhas soltas nem interrompe o bloco
+                f.seek(posicao)
+                f.truncate()
+                linhas = linhas_antes
+                erros[ficheiro] = f"{type(e).__name__}: {e}"
+                contar("corpus.ficheiros_com_erro")
+                logger.warning("%s: %s", ficheiro, erros[ficheiro])
+    os.replace(temporario, destino)
+    contar("corpus.blocos")
+    contar("corpus.linhas", linhas)
+    return {"bloco": bloco.chave, "ficheiros": bloco.ficheiros, "linhas": linhas, "erros": erros,
+            "segundos": round(time.perf_counter() - inicio, 3)}
+
+
+def ler_manifesto(caminho):
+    """
+    Cabeçalho (o último) e blocos concluídos de um manifesto; uma última linha
+    incompleta (escrita interrompida) é ignorada.
+
+    Returns:
+        tuple: (cabeçalho ou None, dicionário chave -> entrada).
+    """
+    cabecalho, concluidos = None, {}
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            for linha in f:
+                try:
+                    entrada = json.loads(linha)
+                except json.JSONDecodeError:
+                    logger.warning("Linha incompleta no manifesto %s ignorada", caminho)
+                    continue
+                if "bloco" in entrada:
+                    concluidos[entrada["bloco"]] = entrada
+                else:
+                    cabecalho = entrada
+    except FileNotFoundError:
+        pass
+    return cabecalho, concluidos
+
+
+def _terminar_ultima_linha(caminho):
+    """Termina uma linha deixada a meio, para que a próxima entrada não se cole a ela."""
+    try:
+        with open(caminho, "rb+") as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+    except FileNotFoundError:
+        pass
+
+
+def _compactar(diretorio_saida, parametros, plano, concluidos):
+    """Reescreve o manifesto só com os blocos do plano e apaga os ficheiros dos outros blocos."""
+    caminho = os.path.join(diretorio_saida, MANIFESTO)
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "w", encoding="utf-8") as f:
+        f.write(json.dumps(parametros, ensure_ascii=False) + "\n")
+        for bloco in plano:
+            f.write(json.dumps(concluidos[bloco.chave], ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporario, caminho)
+    chaves = {f"{bloco.chave}.jsonl" for bloco in plano}
+    diretorio_blocos = os.path.join(diretorio_saida, DIRETORIO_BLOCOS)
+    antigos = [nome for nome in os.listdir(diretorio_blocos) if nome.endswith(".jsonl") and nome not in chaves]
+    for nome in antigos:
+        os.remove(os.path.join(diretorio_blocos, nome))
+    if antigos:
+        logger.info("%d blocos antigos apagados", len(antigos))
+
+
+def _acrescentar(f, entrada):
+    f.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class Progresso:
+    """Blocos e linhas feitos, débito e tempo em falta, mostrados no stderr de intervalo em intervalo."""
+
+    def __init__(self, blocos, tamanho, intervalo=5.0, saida=sys.stderr):
+        self.blocos, self.tamanho = blocos, tamanho
+        self.blocos_feitos, self.tamanho_feito, self.linhas = 0, 0, 0
+        self.intervalo, self.saida = intervalo, saida
+        self.inicio = self.ultimo = time.monotonic()
+
+    def avancar(self, bloco, linhas):
+        self.blocos_feitos += 1
+        self.tamanho_feito += bloco.tamanho
+        self.linhas += linhas
+        agora = time.monotonic()
+        if agora - self.ultimo >= self.intervalo or self.blocos_feitos == self.blocos:
+            self.ultimo = agora
+            self.mostrar(agora)
+
+    def mostrar(self, agora=None):
+        decorrido = max((agora or time.monotonic()) - self.inicio, 1e-9)
+        falta = (self.tamanho - self.tamanho_feito) * decorrido / self.tamanho_feito if self.tamanho_feito else float("nan")
+        print(f"[{self.blocos_feitos}/{self.blocos} blocos] {self.linhas} linhas, "
+              f"{self.linhas / decorrido:.0f} linhas/s, {self.tamanho_feito / decorrido / 1e6:.2f} MB/s, "
+              f"falta ~{falta:.0f} s", file=self.saida, flush=True)
+
+
+@cronometrado("executar_corpus")
+def executar_corpus(raiz, diretorio_saida, weight_factor=0.5, workers=None, tamanho_bloco=TAMANHO_BLOCO,
+                    max_pendentes=None, cache_capacidade=None, cache_sqlite=None, intervalo_progresso=5.0,
+                    instrumentos=INSTRUMENTOS):
+    """
+    Processa (ou retoma) o corpus em raiz, bloco a bloco, para diretorio_saida.
+
+    Com workers=1 tudo corre no processo atual. Caso contrário, no máximo
+    max_pendentes blocos (por omissão, 2 por processo) estão submetidos ao
+    conjunto de processos de cada vez. As opções de cache são as de
+    density_pipeline.analisar_lote. Com outros parâmetros (parametros_execucao)
+    as chaves mudam e os blocos são todos refeitos.
+
+    Returns:
+        tuple: (plano, concluidos), a lista de Bloco e o dicionário chave -> entrada do manifesto.
+    """
+    diretorio_blocos = os.path.join(diretorio_saida, DIRETORIO_BLOCOS)
+    os.makedirs(diretorio_blocos, exist_ok=True)
+    # Blocos deixados a meio por uma execução interrompida
+    for nome in os.listdir(diretorio_blocos):
+        if nome.endswith(".tmp"):
+            os.remove(os.path.join(diretorio_blocos, nome))
+    caminho_manifesto = os.path.join(diretorio_saida, MANIFESTO)
+    parametros = parametros_execucao(weight_factor, instrumentos)
+    cabecalho, concluidos = ler_manifesto(caminho_manifesto)
+    if cabecalho is not None and cabecalho != parametros:
+        logger.info("Parâmetros diferentes dos do manifesto (%s); os blocos serão refeitos", cabecalho)
+
+    plano = planear_blocos(raiz, descobrir_ficheiros(raiz), tamanho_bloco, parametros=parametros)
+    por_fazer = [bloco for bloco in plano if bloco.chave not in concluidos
+                 or not os.path.exists(os.path.join(diretorio_blocos, f"{bloco.chave}.jsonl"))]
+    logger.info("%d blocos, %d já concluídos", len(plano), len(plano) - len(por_fazer))
+    raiz = raiz if os.path.isdir(raiz) else os.path.dirname(raiz)
+    progresso = Progresso(len(por_fazer), sum(bloco.tamanho for bloco in por_fazer), intervalo_progresso)
+    tarefas = ((raiz, diretorio_saida, bloco, weight_factor) for bloco in por_fazer)
+
+    _terminar_ultima_linha(caminho_manifesto)
+    with open(caminho_manifesto, "a", encoding="utf-8") as manifesto:
+        if cabecalho != parametros:
+            _acrescentar(manifesto, parametros)
+
+        def concluir(bloco, entrada):
+            _acrescentar(manifesto, entrada)
+            concluidos[bloco.chave] = entrada
+            progresso.avancar(bloco, entrada["linhas"])
+
+        if workers == 1:
+            usar_cache = bool(cache_capacidade or cache_sqlite)
+            if usar_cache:
+                ativar_cache(cache_capacidade, cache_sqlite)
+            try:
+                for tarefa in tarefas:
+                    concluir(tarefa[2], processar_bloco(tarefa))
+            finally:
+                if usar_cache:
+                    ativar_cache()
+        else:
+            from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+            workers = workers or os.cpu_count() or 1
+            max_pendentes = max_pendentes or 2 * workers
+            with ProcessPoolExecutor(max_workers=workers, initializer=ativar_cache,
+                                     initargs=(cache_capacidade, cache_sqlite)) as executor:
+                pendentes = {}
+                for tarefa in tarefas:
+                    if len(pendentes) >= max_pendentes:
+                        feitos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+                        for futuro in feitos:
+                            concluir(pendentes.pop(futuro), futuro.result())
+                    pendentes[executor.submit(processar_bloco, tarefa)] = tarefa[2]
+                for futuro in list(pendentes):
+                    concluir(pendentes.pop(futuro), futuro.result())
+    _compactar(diretorio_saida, parametros, plano, concluidos)
+    return plano, concluidos
+
+
+def juntar_resultados(diretorio_saida, plano, caminho, formato=None):
+    """Junta os blocos do plano, pela ordem do plano, num só ficheiro CSV ou JSONL."""
+    def linhas():
+        for bloco in plano:
+            with open(os.path.join(diretorio_saida, DIRETORIO_BLOCOS, f"{bloco.chave}.jsonl"), encoding="utf-8") as f:
+                for linha in f:
+                    yield json.loads(linha)
+    return escrever_resultados(linhas(), caminho, formato, campos=CAMPOS_CORPUS)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Análise de densidade retomável de um diretório de partituras.")
+    parser.add_argument("corpus", help="Diretório (ou ficheiro) com .mid/.midi, .csv e .jsonl")
+    parser.add_argument("saida", help="Diretório de saída (manifesto e blocos); reutilizá-lo retoma a execução")
+    parser.add_argument("--weight-factor", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Número de processos (1 = sem paralelismo; por omissão, todos os núcleos)")
+    parser.add_argument("--tamanho-bloco", type=float, default=TAMANHO_BLOCO / 1e6,
+                        help="Tamanho médio dos blocos, em MB")
+    parser.add_argument("--max-pendentes", type=int, default=None,
+                        help="Blocos submetidos ao mesmo tempo (por omissão, 2 por processo)")
+    parser.add_argument("--cache-memoria", type=int, default=None,
+                        help="Capacidade da cache LRU de acordes de cada processo")
+    parser.add_argument("--cache-sqlite", default=None,
+                        help="Ficheiro SQLite com os acordes já analisados, partilhado entre execuções")
+    parser.add_argument("--juntar", default=None, help="No fim, junta todos os blocos neste ficheiro (.csv ou .jsonl)")
+    parser.add_argument("--instrumentos", default=",".join(INSTRUMENTOS),
+                        help="Instrumentos cujos dados (VERSAO_DADOS) entram nas chaves, separados por vírgulas")
+    parser.add_argument("--intervalo-progresso", type=float, default=5.0, help="Segundos entre linhas de progresso")
+    adicionar_argumentos(parser)
+    args = parser.parse_args(argv)
+    aplicar_argumentos(args)
+
+    plano, concluidos = executar_corpus(args.corpus, args.saida, args.weight_factor, args.workers,
+                                        int(args.tamanho_bloco * 1e6), args.max_pendentes,
+                                        args.cache_memoria, args.cache_sqlite, args.intervalo_progresso,
+                                        [instrumento.strip() for instrumento in args.instrumentos.split(",")
+                                         if instrumento.strip()])
+    erros = {ficheiro: erro for bloco in plano for ficheiro, erro in concluidos[bloco.chave]["erros"].items()}
+    for ficheiro, erro in erros.items():
+        print(f"ERRO {ficheiro}: {erro}", file=sys.stderr)
+    linhas = sum(concluidos[bloco.chave]["linhas"] for bloco in plano)
+    print(f"{len(plano)} blocos, {linhas} linhas, {len(erros)} ficheiros com erro -> {args.saida}", file=sys.stderr)
+    if args.juntar:
+        total = juntar_resultados(args.saida, plano, args.juntar)
+        print(f"{total} linhas -> {args.juntar}", file=sys.stderr)
+    concluir_argumentos(args)
+    return 1 if erros else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# exportar_figuras.py
+
+"""
+Exportação dos gráficos por acorde para ficheiros (PNG, SVG ou PDF), sem interface gráfica.
+
+Os gráficos são os de advanced_density_analysis (plot_note_densities,
+plot_kde_with_note_names, plot_stable_values) e de plot_metr_espectrais
+(extract_and_plot_metrics, plot_spectral_metrics), desenhados pelas mesmas
+funções de desenho (draw_*, desenhar_*) no backend Agg, sem passar pelo
+pyplot. Cada processo cria cada figura uma única vez e, de um acorde para o
+seguinte, a função de desenho recebe os artistas que criou e só atualiza os
+seus dados (barras, linhas, textos, células da tabela). Os acordes são analisados e desenhados em
+blocos repartidos por um conjunto de processos.
+
+Exemplo:
+    python exportar_figuras.py acordes.csv figuras/ --figuras densidades kde --formato svg --workers 8
+"""
+
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from advanced_density_analysis import (draw_kde_with_note_names, draw_note_densities, draw_stable_values, kde_batch,
+                                       pitch_grid)
+from density_pipeline import _formato, analisar_acorde, ler_acordes_csv, ler_acordes_jsonl
+from instrumentacao import (adicionar_argumentos, aplicar_argumentos, concluir_argumentos, contar,
+                            cronometro, obter_logger)
+from plot_metr_espectrais import desenhar_metricas, desenhar_tabela_metricas, spread_em_semitons
+
+
+FORMATOS = ("png", "svg", "pdf")
+
+# Compressão zlib dos PNG: o nível 1 grava várias vezes mais depressa do que o 6 de omissão,
+# com ficheiros pouco maiores
+COMPRESSAO_PNG = 1
+
+# Margem (semitons) à volta das notas do acorde no gráfico da KDE
+MARGEM_KDE = 3.0
+
+logger = obter_logger(__name__)
+
+
+class Quadro:
+    """
+    Figura Agg de um tipo de gráfico, com os seus eixos e os artistas devolvidos
+    pela função de desenho, reutilizados de acorde para acorde.
+    """
+
+    def __init__(self, tamanho, margens, dpi=100):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.figura = Figure(figsize=tamanho, dpi=dpi)
+        FigureCanvasAgg(self.figura)
+        # Margens fixas: mais rápidas do que tight_layout a cada acorde
+        self.figura.subplots_adjust(**margens)
+        self.eixos = self.figura.add_subplot()
+        self.artistas = None
+
+    def gravar(self, caminho):
+        if caminho.endswith(".png"):
+            self.figura.savefig(caminho, pil_kwargs={"compress_level": COMPRESSAO_PNG})
+        else:
+            self.figura.savefig(caminho)
+
+
+def _densidades(eixos, acorde, resultado, kde, artistas):
+    return draw_note_densities(eixos, resultado["pitches"], resultado["densidades_instrumento"],
+                               f"Densidade por Nota ({acorde['id']})", artists=artistas)
+
+
+def _kde(eixos, acorde, resultado, kde, artistas):
+    grelha, valores = kde
+    pitches = resultado["pitches"]
+    return draw_kde_with_note_names(eixos, grelha, valores, f"Distribuição Espectral ({acorde['id']})",
+                                    limits=(min(pitches) - MARGEM_KDE, max(pitches) + MARGEM_KDE), artists=artistas)
+
+
+def _estaveis(eixos, acorde, resultado, kde, artistas):
+    return draw_stable_values(eixos, resultado["pitches"], resultado["densidades_instrumento"],
+                              f"Valores Estáveis de Densidade ({acorde['id']})", artists=artistas)
+
+
+def _metricas(eixos, acorde, resultado, kde, artistas):
+    spread = spread_em_semitons(resultado["spectral_centroid_freq"], resultado["spectral_spread"])
+    return desenhar_metricas(eixos, resultado["spectral_centroid_note"], spread, resultado["spectral_skewness"],
+                             f"Spectral Metrics (Note and Semitones) ({acorde['id']})", artistas)
+
+
+def _tabela(eixos, acorde, resultado, kde, artistas):
+    return desenhar_tabela_metricas(eixos, resultado["spectral_centroid_freq"], resultado["spectral_spread"],
+                                    resultado["spectral_centroid_note"], resultado["spectral_skewness"],
+                                    f"Spectral Metrics Summary ({acorde['id']})", artistas)
+
+
+# Tipo de gráfico -> (tamanho da figura, margens, função de desenho); as funções de desenho são as
+# mesmas dos gráficos interativos
+Desenho = namedtuple("Desenho", ["tamanho", "margens", "desenhar"])
+
+_MARGENS_LARGAS = {"left": 0.07, "right": 0.98, "bottom": 0.16, "top": 0.92}
+QUADROS = {
+    "densidades": Desenho((12, 6), _MARGENS_LARGAS, _densidades),
+    "kde": Desenho((12, 6), _MARGENS_LARGAS, _kde),
+    "estaveis": Desenho((12, 6), _MARGENS_LARGAS, _estaveis),
+    "metricas": Desenho((8, 5), {"left": 0.1, "right": 0.97, "bottom": 0.1, "top": 0.9}, _metricas),
+    "tabela": Desenho((6, 2), {"left": 0.02, "right": 0.98, "bottom": 0.02, "top": 0.8}, _tabela),
+}
+
+# Figuras já criadas neste processo: (tipo, dpi) -> Quadro
+_quadros = {}
+
+
+def obter_quadro(tipo, dpi=100):
+    quadro = _quadros.get((tipo, dpi))
+    if quadro is None:
+        desenho = QUADROS[tipo]
+        quadro = _quadros[(tipo, dpi)] = Quadro(desenho.tamanho, desenho.margens, dpi)
+    return quadro
+
+
+def _nome_ficheiro(identificador, tipo, formato):
+    seguro = "".join(c if c.isalnum() or c in "-_." else "_" for c in str(identificador))
+    return f"{seguro}_{tipo}.{formato}"
+
+
+def exportar_bloco(args):
+    """
+    Analisa e desenha um bloco de acordes no processo atual.
+
+    Returns:
+        tuple: (número de ficheiros gravados, [(id, mensagem de erro), ...]).
+    """
+    acordes, tipos, diretorio, formato, dpi, weight_factor = args
+    analisados, erros = [], []
+    for acorde in acordes:
+        try:
+            resultado = analisar_acorde(acorde['notas'], acorde['dinamicas'], acorde['instrumentos'],
+                                        acorde['numeros_instrumentos'], weight_factor)
+            analisados.append((acorde, resultado))
+        except Exception as e:
+            contar("acordes_com_erro")
+            logger.debug("Acorde %s ignorado: %s", acorde.get('id'), e)
+            erros.append((acorde.get('id'), str(e)))
+
+    # Todas as KDE do bloco numa só chamada, na grelha comum de quartos de tom
+    grelha = pitch_grid()
+    curvas = [None] * len(analisados)
+    if "kde" in tipos and analisados:
+        pitches = [resultado["pitches"] for _, resultado in analisados]
+        densidades = [resultado["densidades_instrumento"] for _, resultado in analisados]
+        offsets = np.concatenate([[0], np.cumsum([len(p) for p in pitches])])
+        curvas = kde_batch(np.concatenate(pitches), np.concatenate(densidades), offsets, grid=grelha)
+
+    gravados = 0
+    for (acorde, resultado), curva in zip(analisados, curvas):
+        for tipo in tipos:
+            quadro = obter_quadro(tipo, dpi)
+            try:
+                with cronometro("exportar_figura"):
+                    quadro.artistas = QUADROS[tipo].desenhar(quadro.eixos, acorde, resultado, (grelha, curva),
+                                                             quadro.artistas)
+                    quadro.gravar(os.path.join(diretorio, _nome_ficheiro(acorde['id'], tipo, formato)))
+                gravados += 1
+            except Exception as e:
+                logger.debug("Figura %s do acorde %s não gravada: %s", tipo, acorde.get('id'), e)
+                erros.append((acorde.get('id'), f"{tipo}: {e}"))
+    contar("figuras_exportadas", gravados)
+    return gravados, erros
+
+
+def _blocos(acordes, tamanho):
+    bloco = []
+    for acorde in acordes:
+        bloco.append(acorde)
+        if len(bloco) == tamanho:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def exportar_figuras(acordes, diretorio, tipos=tuple(QUADROS), formato="png", dpi=100, weight_factor=0.5,
+                     workers=None, tamanho_bloco=32):
+    """
+    Grava as figuras pedidas de cada acorde em diretorio, como <id>_<tipo>.<formato>.
+
+    Cada bloco de tamanho_bloco acordes é analisado e desenhado num processo
+    (workers=1: tudo no processo atual), reutilizando as figuras desse processo.
+
+    Returns:
+        tuple: (número de ficheiros gravados, [(id, mensagem de erro), ...]).
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato desconhecido: {formato}")
+    os.makedirs(diretorio, exist_ok=True)
+    tarefas = ((bloco, tuple(tipos), diretorio, formato, dpi, weight_factor)
+               for bloco in _blocos(acordes, tamanho_bloco))
+    if workers == 1:
+        resultados = map(exportar_bloco, tarefas)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        executor = ProcessPoolExecutor(max_workers=workers)
+        resultados = executor.map(exportar_bloco, tarefas)
+
+    total, erros = 0, []
+    try:
+        for gravados, erros_bloco in resultados:
+            total += gravados
+            erros.extend(erros_bloco)
+    finally:
+        if workers != 1:
+            executor.shutdown()
+    return total, erros
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Exporta os gráficos de cada acorde para ficheiros (sem interface gráfica).")
+    parser.add_argument("entrada", help="Ficheiro de acordes (.csv ou .jsonl, como em density_pipeline.py)")
+    parser.add_argument("diretorio", help="Diretório onde gravar as figuras")
+    parser.add_argument("--formato-entrada", choices=['csv', 'jsonl'])
+    parser.add_argument("--figuras", nargs="+", choices=list(QUADROS), default=list(QUADROS))
+    parser.add_argument("--formato", choices=FORMATOS, default="png")
+    parser.add_argument("--dpi", type=int, default=100)
+    parser.add_argument("--weight-factor", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Número de processos (1 = sem paralelismo; por omissão, todos os núcleos)")
+    parser.add_argument("--tamanho-bloco", type=int, default=32, help="Acordes por tarefa de cada processo")
+    adicionar_argumentos(parser)
+    args = parser.parse_args(argv)
+    aplicar_argumentos(args)
+
+    if _formato(args.entrada, args.formato_entrada) == 'csv':
+        acordes = ler_acordes_csv(args.entrada)
+    else:
+        acordes = ler_acordes_jsonl(args.entrada)
+
+    total, erros = exportar_figuras(acordes, args.diretorio, args.figuras, args.formato, args.dpi,
+                                    args.weight_factor, args.workers, args.tamanho_bloco)
+    for identificador, erro in erros:
+        print(f"ERRO {identificador}: {erro}", file=sys.stderr)
+    print(f"{total} figuras gravadas em {args.diretorio}", file=sys.stderr)
+    concluir_argumentos(args)
+    return 1 if erros else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,16 @@
 #flauta.py#
 
+import hashlib
+import json
+import os
+import tempfile
+
 import numpy as np
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import ConstantKernel as C, Matern
+
+from batch_gpr import fit_predict_batch
+from instrumentacao import contar, obter_logger
+from instrumentos import DINAMICAS, NIVEIS_DINAMICOS
+from parser_notas import NOMES_SUSTENIDO, PASSOS_POR_OITAVA, SEM_OITAVA, nota_em_sustenidos, passo_nota
 
 def converter_notacao(nota):
     """Converte a notação personalizada para a notação padrão.
@@ -11,16 +19,12 @@ def converter_notacao(nota):
         nota (str): A nota na notação personalizada.
 
     Returns:
-        str: A nota na notação padrão.
+        str: A nota na notação padrão (sustenidos, como em spectral_data).
     """
-    if 'b' in nota:  # Verifica se a nota contém um bemol
-        nota_sustenido = nota.replace('b', '#')  # Substitui 'b' por '#'
-        if '-' in nota:
-            nota_sustenido = nota_sustenido.replace('#-', '#+')  # Substitui '#-' por '#+'
-        elif '+' in nota:
-            nota_sustenido = nota_sustenido.replace('#+', '#-')  # Substitui '#+' por '#-'
-        return nota_sustenido
-    return nota  # Retorna a nota original se não precisar converter
+    try:
+        return nota_em_sustenidos(nota)
+    except ValueError:
+        return nota  # Retorna a nota original se não for possível interpretá-la
 
 
 
@@ -105,48 +109,56 @@ spectral_data = {
  
 }
 
+DINAMICAS_MEDIDAS = ["pp", "mf", "ff"]
+
+logger = obter_logger(__name__)
+
+# Parâmetros do GPR usado para as dinâmicas não medidas (fazem parte da chave da cache)
+GPR_CONFIG = {"nu": 1.5, "alpha": 1e-1, "grid_size": 48, "refinements": 3}
+
+# Diretório da cache da tabela de dinâmicas; pode ser alterado com HARMONIC_DENSITY_CACHE
+CACHE_DIR = os.environ.get("HARMONIC_DENSITY_CACHE",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+
 # Function to convert pitch notation to an integer
 def nota_para_int(nota):
-    """Converte a notação de altura para um inteiro."""
+    """Converte a notação de altura para um inteiro (meios-tons, C0 = 0)."""
     try:
-        nota_base, oitava = nota[:-1], int(nota[-1])
-        escala = {'C': 0, 'C#': 1, 'D': 2, 'D#': 3, 'E': 4, 'F': 5, 'F#': 6, 'G': 7, 'G#': 8, 'A': 9, 'A#': 10, 'B': 11}
-        return escala[nota_base] + (oitava * 12)
-    except (KeyError, ValueError):
+        passo = passo_nota(nota)
+    except ValueError:
+        passo = None
+    if passo is None or passo == SEM_OITAVA or passo % 2:
         raise ValueError(f"Nota inválida: {nota}")
+    return passo // 2
 
 
 # Function to calculate density based on real spectral data (added)
 def calcular_densidade(nota, dinamica):
-    """Calcula a densidade com base nos dados espectrais."""
+    """Calcula a densidade com base nos dados espectrais.
+
+    Aceita qualquer um dos nove níveis de DINAMICAS; os níveis que não foram
+    medidos vêm da tabela pré-calculada, pelo que custam o mesmo que 'mf'.
+    """
     try:
-        return spectral_data[nota][dinamica]
+        return tabela_dinamicas[nota][dinamica]
     except KeyError:
         raise ValueError(f"Dados espectrais não encontrados para a nota {nota} e dinâmica {dinamica}")
 
 
 # Existing function to predict intermediate dynamics with updated methods
 def predict_intermediate_dynamics(pitches, pp_values, mf_values, ff_values):
-    """Prevê dinâmicas intermediárias usando Gaussian Process Regression."""
-    dynamic_levels = {"pppp": 1, "ppp": 2, "pp": 3, "p": 4, "mf": 5, "f": 6, "ff": 7, "fff": 8, "ffff": 9}
-    all_dynamics = list(dynamic_levels.keys())
-    predictions = {dynamic: [] for dynamic in all_dynamics}
+    """Prevê dinâmicas intermediárias usando Gaussian Process Regression.
 
-    # Otimização com NumPy:
-    existing_levels = np.array([dynamic_levels[d] for d in ["pp", "mf", "ff"]]).reshape(-1, 1)
-    all_levels = np.array([dynamic_levels[d] for d in all_dynamics]).reshape(-1, 1)
-    y_train = np.array([pp_values, mf_values, ff_values]).T
-
-    matern_kernel = C(1.0) * Matern(length_scale=1.0, nu=1.5)
-    gpr = GaussianProcessRegressor(kernel=matern_kernel, n_restarts_optimizer=10, alpha=1e-1)
-
-    for y in y_train:
-        gpr.fit(existing_levels, y)
-        y_pred = gpr.predict(all_levels)
-        for j, dynamic in enumerate(all_dynamics):
-            predictions[dynamic].append(y_pred[j])
+    Todas as notas são ajustadas de uma só vez (batch_gpr.fit_predict_batch),
+    com hiperparâmetros Matern escolhidos por nota.
+    """
+    existing_levels = [NIVEIS_DINAMICOS[d] for d in DINAMICAS_MEDIDAS]
+    all_levels = [NIVEIS_DINAMICOS[d] for d in DINAMICAS]
+    y_train = np.array([pp_values, mf_values, ff_values], dtype=float).T.reshape(-1, len(DINAMICAS_MEDIDAS))
 
-    return {k: np.array(v) for k, v in predictions.items()}
+    y_pred, _ = fit_predict_batch(existing_levels, y_train, all_levels, **GPR_CONFIG)
+    return {dynamic: y_pred[:, j] for j, dynamic in enumerate(DINAMICAS)}
 
 def get_max_note_density(nota, num): # Removido o parâmetro dinamica, que não era usado
     """Retorna a densidade máxima da nota."""
@@ -176,6 +188,114 @@ def calculate_max_possible_density(notas, dinamicas, numeros_instrumentos):
     return max_density
 
 
+def _chave_tabela_dinamicas():
+    """Hash dos dados espectrais e dos parâmetros do GPR que identifica a tabela em cache."""
+    conteudo = json.dumps({"spectral_data": spectral_data, "gpr": GPR_CONFIG, "dinamicas": DINAMICAS}, sort_keys=True)
+    return hashlib.sha1(conteudo.encode("utf-8")).hexdigest()[:16]
+
+
+def calcular_tabela_dinamicas():
+    """Calcula os nove níveis dinâmicos para todas as notas de spectral_data.
+
+    Returns:
+        tuple: (notas, valores), com valores de forma (len(notas), len(DINAMICAS)).
+        As colunas medidas (pp, mf, ff) mantêm os valores originais.
+    """
+    notas = list(spectral_data.keys())
+    medidos = {d: [spectral_data[nota][d] for nota in notas] for d in DINAMICAS_MEDIDAS}
+    previstos = predict_intermediate_dynamics(notas, medidos["pp"], medidos["mf"], medidos["ff"])
+    valores = np.column_stack([medidos[d] if d in medidos else previstos[d] for d in DINAMICAS]).astype(float)
+    return notas, valores
+
+
+def carregar_tabela_dinamicas(cache_dir=None):
+    """Carrega a tabela de dinâmicas da cache em disco, calculando-a e gravando-a se necessário.
+
+    O ficheiro .npz tem no nome o hash de spectral_data e de GPR_CONFIG, pelo que
+    qualquer alteração aos dados gera uma nova tabela. Se a cache não puder ser
+    escrita, a tabela é apenas mantida em memória.
+
+    Returns:
+        dict: nota -> {dinamica: densidade} para os nove níveis.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    caminho = os.path.join(cache_dir, f"flauta_dinamicas_{_chave_tabela_dinamicas()}.npz")
+    try:
+        with np.load(caminho, allow_pickle=False) as dados:
+            notas, valores = dados["notas"].tolist(), dados["valores"]
+        contar("cache_dinamicas.acertos")
+    except (OSError, KeyError, ValueError):
+        contar("cache_dinamicas.falhas")
+        logger.info("A calcular a tabela de dinâmicas (%s)", caminho)
+        notas, valores = calcular_tabela_dinamicas()
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".npz", delete=False) as f:
+                np.savez(f, notas=np.array(notas), valores=valores)
+            os.replace(f.name, caminho)
+        except OSError as e:
+            logger.warning("Não foi possível gravar a cache de dinâmicas: %s", e)
+    return {nota: dict(zip(DINAMICAS, map(float, linha))) for nota, linha in zip(notas, valores)}
+
+
+def indexar_por_passo(tabela):
+    """Converte a tabela de dinâmicas em arrays indexados pelo passo de quarto de tom.
+
+    Returns:
+        tuple: (densidades, maximos). densidades tem forma (passo máximo + 1,
+        len(DINAMICAS)), com NaN nos passos sem dados; maximos tem a densidade
+        máxima medida (pp, mf, ff) de cada passo, ou 0.
+    """
+    passos = [passo_nota(nota) for nota in tabela]
+    densidades = np.full((max(passos) + 1, len(DINAMICAS)), np.nan)
+    maximos = np.zeros(max(passos) + 1)
+    for passo, (nota, niveis) in zip(passos, tabela.items()):
+        densidades[passo] = [niveis[d] for d in DINAMICAS]
+        maximos[passo] = max(spectral_data[nota].values())
+    return densidades, maximos
+
+
+def _nome_passo(passo):
+    if passo < 0:
+        return "sem oitava"
+    oitava, passo_na_oitava = divmod(int(passo), PASSOS_POR_OITAVA)
+    return f"{NOMES_SUSTENIDO[passo_na_oitava]}{oitava}"
+
+
+def avaliar_lote(passos, niveis, numeros_instrumentos):
+    """Densidades e densidades máximas de N notas de uma só vez (interface de instrumentos.py).
+
+    Args:
+        passos: passos absolutos de quarto de tom (parser_notas.passos_notas).
+        niveis: níveis dinâmicos 1..9 (NIVEIS_DINAMICOS).
+        numeros_instrumentos: número de flautas por nota.
+
+    Returns:
+        tuple: (densidades, maximos), ambos escalados por sqrt(numero_instrumentos).
+    """
+    passos = np.asarray(passos, dtype=np.int64)
+    niveis = np.asarray(niveis, dtype=np.int64)
+    fora = (niveis < 1) | (niveis > len(DINAMICAS))
+    if fora.any():
+        raise ValueError(f"Nível dinâmico inválido: {niveis[np.flatnonzero(fora)[0]]} (esperado 1..{len(DINAMICAS)})")
+    colunas = niveis - 1
+    escala = np.sqrt(np.asarray(numeros_instrumentos, dtype=float))
+
+    na_tabela = (passos >= 0) & (passos < len(densidades_por_passo))
+    indices = np.where(na_tabela, passos, 0)
+    densidades = densidades_por_passo[indices, colunas]
+    em_falta = ~na_tabela | np.isnan(densidades)
+    if em_falta.any():
+        i = np.flatnonzero(em_falta)[0]
+        raise ValueError(f"Dados espectrais não encontrados para a nota {_nome_passo(passos[i])} "
+                         f"e dinâmica {DINAMICAS[colunas[i]]}")
+    maximos = np.where(na_tabela, maximos_por_passo[indices], 0.0)
+    return densidades * escala, maximos * escala
 
 
+# Identifica os dados e a configuração atuais (ver instrumentos.py); muda sempre que a tabela muda
+VERSAO_DADOS = _chave_tabela_dinamicas()
 
+# Tabela com os nove níveis dinâmicos de cada nota, calculada uma única vez
+tabela_dinamicas = carregar_tabela_dinamicas()
+densidades_por_passo, maximos_por_passo = indexar_por_passo(tabela_dinamicas)
@@ -0,0 +1,193 @@
+# grafo_densidades.py
+
+"""
+Recálculo incremental das grandezas de um acorde, como um grafo de dependências.
+
+Cada grandeza intermédia de analisar_acorde (densidade intervalar, densidades
+do instrumento, amplitude, momentos espectrais, densidade máxima, ...) é um nó
+com o valor em cache. Quando uma entrada muda, só os nós que dependem dela são
+recalculados, e só quando são pedidos. Se um nó recalculado der o mesmo valor
+de antes (por exemplo, 'Db4' em vez de 'C#4'), os nós seguintes mantêm o seu.
+
+    notas ──► notas_sustenidas ─┬─► densidade_intervalar ─────────────────┐
+                                ├─► pitches ─┬─► amplitude ───────────────┤
+    dinamicas, instrumentos,    │            └─► momentos ─► spread ──────┤
+    numeros_instrumentos ───────┴─► avaliacao ─┬─► densidades ─► soma ────┤
+                                               └─► max_possible_density ──┤
+    weight_factor ──► ponderada ─► refinada ─► total ◄────────────────────┘
+
+Assim, mover o weight_factor só recalcula as três densidades combinadas.
+
+Exemplo:
+    grafo = GrafoDensidades()
+    grafo.analisar(['C4', 'E4', 'G4'], ['mf'] * 3, ['flauta'], [1, 1, 1], 0.5)
+    grafo.analisar(['C4', 'E4', 'G4'], ['mf'] * 3, ['flauta'], [1, 1, 1], 0.7)
+    grafo.recalculados  # ['densidade_ponderada', 'densidade_refinada', 'densidade_total']
+"""
+
+from advanced_density_analysis import calculate_spectral_moments
+from densidade_intervalar import calcular_densidade_intervalar
+from density_pipeline import densidade_ponderada, densidade_refinada, densidade_total
+from instrumentacao import contar
+from instrumentos import avaliar_instrumentos
+from parser_notas import converter_para_sustenido, midis_notas
+
+
+_SEM_VALOR = object()
+
+
+def _iguais(a, b):
+    try:
+        return bool(a == b)
+    except (TypeError, ValueError):
+        return False
+
+
+class _No:
+    __slots__ = ("funcao", "dependencias", "valor", "versao", "verificado", "versoes_dependencias")
+
+    def __init__(self, funcao, dependencias):
+        self.funcao = funcao
+        self.dependencias = dependencias
+        self.valor = _SEM_VALOR
+        self.versao = 0                    # revisão em que o valor mudou pela última vez
+        self.verificado = -1               # revisão em que o nó foi confirmado atual
+        self.versoes_dependencias = None   # versões das dependências usadas no último cálculo
+
+
+class GrafoDependencias:
+    """
+    Valores em cache ligados por dependências, recalculados a pedido.
+
+    Cada alteração de uma entrada abre uma revisão nova. Um nó pedido numa
+    revisão nova só é recalculado se a versão de alguma dependência mudou
+    desde o seu último cálculo; a sua própria versão só muda se o valor mudar.
+    """
+
+    def __init__(self):
+        self._nos = {}
+        self._revisao = 0
+        self.recalculados = []
+
+    def entrada(self, nome):
+        self._nos[nome] = _No(None, ())
+
+    def no(self, nome, funcao, *dependencias):
+        for dependencia in dependencias:
+            if dependencia not in self._nos:
+                raise ValueError(f"Dependência desconhecida de {nome}: {dependencia}")
+        self._nos[nome] = _No(funcao, dependencias)
+
+    def definir(self, nome, valor):
+        """Altera uma entrada; não faz nada se o valor for igual ao atual."""
+        no = self._nos[nome]
+        if no.funcao is not None:
+            raise ValueError(f"{nome} é calculado, não é uma entrada.")
+        if no.valor is not _SEM_VALOR and _iguais(valor, no.valor):
+            return
+        self._revisao += 1
+        no.valor = valor
+        no.versao = no.verificado = self._revisao
+
+    def obter(self, nome):
+        return self._atualizar(nome).valor
+
+    def _atualizar(self, nome):
+        no = self._nos[nome]
+        if no.funcao is None:
+            if no.valor is _SEM_VALOR:
+                raise ValueError(f"A entrada {nome} não tem valor.")
+            return no
+        if no.verificado == self._revisao:
+            return no
+
+        versoes = tuple(self._atualizar(dependencia).versao for dependencia in no.dependencias)
+        if versoes != no.versoes_dependencias:
+            valor = no.funcao(*(self._nos[dependencia].valor for dependencia in no.dependencias))
+            contar(f"grafo_densidades.{nome}")
+            self.recalculados.append(nome)
+            if no.valor is _SEM_VALOR or not _iguais(valor, no.valor):
+                no.versao = self._revisao
+            no.valor = valor
+            no.versoes_dependencias = versoes
+        no.verificado = self._revisao
+        return no
+
+
+def _preenchida(valores):
+    if not valores:
+        raise ValueError("Please fill in all required fields.")
+    return list(valores)
+
+
+def _instrumentos_por_nota(instrumentos, notas):
+    return list(instrumentos) * len(notas) if len(instrumentos) == 1 else list(instrumentos)
+
+
+def _avaliacao(notas, dinamicas, instrumentos, numeros_instrumentos):
+    densidades, maximos = avaliar_instrumentos(notas, dinamicas, instrumentos, numeros_instrumentos)
+    return densidades.tolist(), float(maximos.sum())
+
+
+# Campos do resultado de analisar_acorde -> nó (e chave dentro do nó, para os momentos)
+CAMPOS_RESULTADO = {
+    "notas": "notas_sustenidas",
+    "pitches": "pitches",
+    "densidades_instrumento": "densidades_instrumento",
+    "densidade_intervalar": "densidade_intervalar",
+    "densidade_instrumento": "densidade_instrumento",
+    "max_possible_density": "max_possible_density",
+    "spectral_centroid_freq": "spectral_centroid_freq",
+    "spectral_centroid_note": "spectral_centroid_note",
+    "spectral_spread": "spectral_spread",
+    "spectral_skewness": "spectral_skewness",
+    "densidade_ponderada": "densidade_ponderada",
+    "densidade_refinada": "densidade_refinada",
+    "densidade_total": "densidade_total",
+}
+
+
+class GrafoDensidades(GrafoDependencias):
+    """O pipeline de analisar_acorde como grafo; analisar devolve o mesmo dicionário."""
+
+    ENTRADAS = ("notas", "dinamicas", "instrumentos", "numeros_instrumentos", "weight_factor")
+
+    def __init__(self):
+        super().__init__()
+        for nome in self.ENTRADAS:
+            self.entrada(nome)
+        self.no("notas_sustenidas", lambda notas: [converter_para_sustenido(nota) for nota in _preenchida(notas)],
+                "notas")
+        self.no("dinamicas_acorde", _preenchida, "dinamicas")
+        self.no("numeros_acorde", lambda numeros: [int(num) for num in _preenchida(numeros)], "numeros_instrumentos")
+        self.no("instrumentos_acorde", lambda instrumentos, notas: _instrumentos_por_nota(_preenchida(instrumentos), notas),
+                "instrumentos", "notas_sustenidas")
+
+        self.no("densidade_intervalar", calcular_densidade_intervalar, "notas_sustenidas")
+        self.no("pitches", lambda notas: midis_notas(notas).tolist(), "notas_sustenidas")
+        self.no("amplitude", lambda pitches: max(pitches) - min(pitches), "pitches")
+
+        self.no("avaliacao", _avaliacao, "notas_sustenidas", "dinamicas_acorde", "instrumentos_acorde", "numeros_acorde")
+        self.no("densidades_instrumento", lambda avaliacao: avaliacao[0], "avaliacao")
+        self.no("max_possible_density", lambda avaliacao: avaliacao[1], "avaliacao")
+        self.no("densidade_instrumento", sum, "densidades_instrumento")
+
+        self.no("momentos", calculate_spectral_moments, "pitches", "densidades_instrumento")
+        self.no("spectral_centroid_freq", lambda m: m["spectral_centroid"]["frequency"], "momentos")
+        self.no("spectral_centroid_note", lambda m: m["spectral_centroid"]["note"], "momentos")
+        self.no("spectral_spread", lambda m: m["spectral_spread"]["deviation"], "momentos")
+        self.no("spectral_skewness", lambda m: m.get("spectral_skewness", float("nan")), "momentos")
+
+        self.no("densidade_ponderada", densidade_ponderada, "densidade_instrumento", "densidade_intervalar", "weight_factor")
+        self.no("densidade_refinada", densidade_refinada, "densidade_ponderada", "amplitude")
+        self.no("densidade_total", densidade_total, "densidade_refinada", "spectral_spread", "max_possible_density")
+
+    def analisar(self, notas, dinamicas, instrumentos, numeros_instrumentos, weight_factor=0.5):
+        """Mesmo resultado que density_pipeline.analisar_acorde, recalculando só o que mudou."""
+        self.recalculados = []
+        self.definir("notas", list(notas))
+        self.definir("dinamicas", list(dinamicas))
+        self.definir("instrumentos", list(instrumentos))
+        self.definir("numeros_instrumentos", list(numeros_instrumentos))
+        self.definir("weight_factor", weight_factor)
+        return {campo: self.obter(no) for campo, no in CAMPOS_RESULTADO.items()}
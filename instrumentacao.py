@@ -0,0 +1,140 @@
+# instrumentacao.py
+
+"""
+Registo (logging) e métricas de execução dos módulos de cálculo.
+
+Registo: cada módulo usa obter_logger(__name__), um filho do logger
+"densidade". Por omissão só os avisos e erros chegam ao stderr (pelo handler
+de último recurso do logging); as mensagens INFO/DEBUG dos caminhos quentes
+ficam desligadas até configurar_registo('DEBUG') (ou logging.basicConfig).
+
+Métricas: contadores e cronómetros por etapa, acumulados no processo atual
+(com ProcessPoolExecutor cada processo tem os seus; use workers=1 para medir um
+lote completo). Os tempos de etapas encaixadas são inclusivos.
+
+    with cronometro("kde"):
+        ...
+    contar("pares_intervalares", n)
+    metricas.resumo()            # dicionário com contadores e tempos
+    metricas.gravar_json("m.json")
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+
+LOGGER_BASE = "densidade"
+
+
+def obter_logger(nome):
+    """Logger do módulo, dentro da hierarquia "densidade"."""
+    return logging.getLogger(f"{LOGGER_BASE}.{nome}")
+
+
+def configurar_registo(nivel="INFO", destino=None):
+    """Escreve as mensagens do nível indicado ou acima para stderr (ou para o stream destino)."""
+    logger = logging.getLogger(LOGGER_BASE)
+    handler = logging.StreamHandler(destino)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(nivel)
+    return logger
+
+
+class Metricas:
+    """Contadores e tempos acumulados (total e número de chamadas) por nome de etapa."""
+
+    def __init__(self):
+        self._trinco = threading.Lock()
+        self.repor()
+
+    def repor(self):
+        with self._trinco:
+            self.contadores = defaultdict(int)
+            self.tempos = defaultdict(lambda: [0.0, 0])
+
+    def contar(self, nome, quantidade=1):
+        with self._trinco:
+            self.contadores[nome] += quantidade
+
+    def registar_tempo(self, nome, segundos):
+        with self._trinco:
+            tempo = self.tempos[nome]
+            tempo[0] += segundos
+            tempo[1] += 1
+
+    def cronometro(self, nome):
+        """Gestor de contexto que acumula o tempo do bloco na etapa nome."""
+        return _Cronometro(self, nome)
+
+    def cronometrado(self, nome):
+        """Decorador: cada chamada da função conta como uma execução da etapa nome."""
+        def decorador(funcao):
+            @wraps(funcao)
+            def envolvida(*args, **kwargs):
+                inicio = time.perf_counter()
+                try:
+                    return funcao(*args, **kwargs)
+                finally:
+                    self.registar_tempo(nome, time.perf_counter() - inicio)
+            return envolvida
+        return decorador
+
+    def resumo(self):
+        """Cópia das métricas: {"contadores": {...}, "tempos": {etapa: {"total_s", "chamadas", "media_s"}}}."""
+        with self._trinco:
+            return {
+                "contadores": dict(sorted(self.contadores.items())),
+                "tempos": {
+                    nome: {"total_s": total, "chamadas": chamadas, "media_s": total / chamadas if chamadas else 0.0}
+                    for nome, (total, chamadas) in sorted(self.tempos.items())
+                },
+            }
+
+    def gravar_json(self, caminho):
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump(self.resumo(), f, indent=2)
+
+
+class _Cronometro:
+    # Classe em vez de contextlib.contextmanager: custa um terço por utilização
+    __slots__ = ("metricas", "nome", "inicio")
+
+    def __init__(self, metricas, nome):
+        self.metricas = metricas
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excecao):
+        self.metricas.registar_tempo(self.nome, time.perf_counter() - self.inicio)
+
+
+# Métricas globais do processo
+metricas = Metricas()
+contar = metricas.contar
+cronometro = metricas.cronometro
+cronometrado = metricas.cronometrado
+
+
+def adicionar_argumentos(parser):
+    """Opções comuns das linhas de comando: -v/--verbose e --metricas FICHEIRO."""
+    parser.add_argument("-v", "--verbose", action="count", default=0,
+                        help="Mostra o registo (-v: INFO, -vv: DEBUG)")
+    parser.add_argument("--metricas", help="Grava os contadores e tempos em JSON no fim")
+
+
+def aplicar_argumentos(args):
+    if args.verbose:
+        configurar_registo("DEBUG" if args.verbose > 1 else "INFO")
+
+
+def concluir_argumentos(args):
+    if args.metricas:
+        metricas.gravar_json(args.metricas)
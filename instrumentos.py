@@ -0,0 +1,144 @@
+# instrumentos.py
+
+"""
+Interface em lote dos módulos de instrumento.
+
+Um módulo de instrumento (flauta.py é o primeiro) expõe, além das funções por
+nota de sempre (calcular_densidade, calculate_max_possible_density):
+
+    avaliar_lote(passos, niveis, numeros_instrumentos) -> (densidades, maximos)
+
+- passos: passos absolutos de quarto de tom das notas (parser_notas.passos_notas);
+- niveis: níveis dinâmicos inteiros 1..9 (pppp..ffff, ver NIVEIS_DINAMICOS);
+- numeros_instrumentos: número de instrumentistas por nota.
+
+Devolve dois arrays float com uma entrada por nota, ambos já escalados por
+sqrt(numero_instrumentos): a densidade da nota na dinâmica pedida e a densidade
+máxima dessa nota no instrumento (0 se a nota não tiver dados). Uma nota sem
+dados na dinâmica pedida levanta ValueError.
+
+Um módulo pode ainda declarar VERSAO_DADOS, uma cadeia que muda sempre que os
+seus dados ou parâmetros mudam; as caches persistentes de resultados usam-na
+para não reaproveitar valores calculados com dados antigos.
+
+Módulos que ainda não implementam avaliar_lote continuam a ser aceites por
+avaliar_notas, que recorre a calcular_densidade e predict_intermediate_dynamics
+(esta última chamada uma só vez para todas as notas).
+
+Os módulos são importados uma única vez por processo (obter_instrumento), com
+as suas tabelas pré-calculadas, e avaliar_instrumentos avalia um acorde com
+vários instrumentos agrupando as notas por instrumento.
+"""
+
+import importlib
+
+import numpy as np
+
+from instrumentacao import contar
+from parser_notas import passos_notas
+
+
+NIVEIS_DINAMICOS = {"pppp": 1, "ppp": 2, "pp": 3, "p": 4, "mf": 5, "f": 6, "ff": 7, "fff": 8, "ffff": 9}
+DINAMICAS = list(NIVEIS_DINAMICOS.keys())
+DINAMICAS_BASE = ['pp', 'mf', 'ff']
+
+
+# Registo dos módulos já importados: nome do módulo -> módulo
+_modulos = {}
+
+
+def nome_modulo(instrumento):
+    """Nome do módulo de um instrumento (ex.: 'clarinete baixo' -> 'clarinete_baixo')."""
+    return instrumento.strip().replace(' ', '_')
+
+
+def obter_instrumento(instrumento):
+    """Módulo do instrumento, importado (e com as tabelas calculadas) só na primeira chamada."""
+    nome = nome_modulo(instrumento)
+    modulo = _modulos.get(nome)
+    if modulo is not None:
+        contar("registo_instrumentos.acertos")
+    else:
+        contar("registo_instrumentos.falhas")
+        try:
+            modulo = importlib.import_module(nome)
+        except ModuleNotFoundError:
+            raise ImportError(f"Module for {instrumento} not found.")
+        _modulos[nome] = modulo
+    return modulo
+
+
+def niveis_dinamicas(dinamicas):
+    """Níveis 1..9 das dinâmicas (array int64)."""
+    try:
+        return np.fromiter((NIVEIS_DINAMICOS[d] for d in dinamicas), dtype=np.int64, count=len(dinamicas))
+    except KeyError as e:
+        raise ValueError(f"Dinâmica desconhecida: {e.args[0]}")
+
+
+def _avaliar_por_nota(modulo, notas, dinamicas, numeros_instrumentos):
+    """Caminho para módulos sem avaliar_lote: uma chamada a calcular_densidade por nota."""
+    dinamicas_diretas = getattr(modulo, 'DINAMICAS', DINAMICAS_BASE)
+    densidades = np.empty(len(notas))
+    interpolar = []
+    for i, (nota, dinamica) in enumerate(zip(notas, dinamicas)):
+        if dinamica in dinamicas_diretas:
+            densidades[i] = modulo.calcular_densidade(nota, dinamica)
+        else:
+            interpolar.append(i)
+    if interpolar:
+        base = {d: [modulo.calcular_densidade(notas[i], d) for i in interpolar] for d in DINAMICAS_BASE}
+        previstos = modulo.predict_intermediate_dynamics([notas[i] for i in interpolar], base['pp'], base['mf'], base['ff'])
+        for j, i in enumerate(interpolar):
+            densidades[i] = previstos[dinamicas[i]][j]
+    maximos = np.array([modulo.calculate_max_possible_density([nota], [dinamica], [1])
+                        for nota, dinamica in zip(notas, dinamicas)], dtype=float)
+    escala = np.sqrt(np.asarray(numeros_instrumentos, dtype=float))
+    return densidades * escala, maximos * escala
+
+
+def avaliar_notas(modulo, notas, dinamicas, numeros_instrumentos):
+    """
+    Densidades e densidades máximas de N notas num instrumento, numa só chamada.
+
+    As notas são texto (ex.: 'C#4') e as dinâmicas os nomes pppp..ffff; são
+    convertidas nos códigos inteiros de avaliar_lote.
+
+    Returns:
+        tuple: (densidades, maximos), arrays float de forma (N,).
+    """
+    contar("notas_instrumento", len(notas))
+    if hasattr(modulo, 'avaliar_lote'):
+        return modulo.avaliar_lote(passos_notas(notas), niveis_dinamicas(dinamicas), numeros_instrumentos)
+    return _avaliar_por_nota(modulo, notas, dinamicas, numeros_instrumentos)
+
+
+def avaliar_instrumentos(notas, dinamicas, instrumentos, numeros_instrumentos):
+    """
+    Densidades e densidades máximas de um acorde em que cada nota tem o seu instrumento.
+
+    As notas são agrupadas por instrumento e cada grupo é avaliado numa só
+    chamada a avaliar_notas; os resultados voltam à ordem das notas. Um único
+    instrumento aplica-se a todas as notas.
+
+    Returns:
+        tuple: (densidades, maximos), arrays float de forma (N,).
+    """
+    if len(instrumentos) == 1:
+        instrumentos = list(instrumentos) * len(notas)
+    if not len(notas) == len(dinamicas) == len(instrumentos) == len(numeros_instrumentos):
+        raise ValueError("As notas, dinâmicas, instrumentos e números de instrumentos têm de ter o mesmo tamanho.")
+
+    grupos = {}
+    for i, instrumento in enumerate(instrumentos):
+        grupos.setdefault(instrumento, []).append(i)
+
+    densidades = np.empty(len(notas))
+    maximos = np.empty(len(notas))
+    for instrumento, indices in grupos.items():
+        densidades[indices], maximos[indices] = avaliar_notas(
+            obter_instrumento(instrumento),
+            [notas[i] for i in indices], [dinamicas[i] for i in indices],
+            [numeros_instrumentos[i] for i in indices],
+        )
+    return densidades, maximos
@@ -0,0 +1,287 @@
+# midi_slices.py
+
+"""
+Leitura em streaming de ficheiros Standard MIDI (.mid) em fatias verticais.
+
+Cada pista é lida por blocos a partir do seu próprio ponteiro no ficheiro e as
+pistas são intercaladas por tempo (heapq.merge), pelo que a memória usada
+depende só do número de pistas e das notas a soar, não do tamanho da partitura.
+Sempre que o conjunto de notas a soar muda é produzida uma fatia com as notas
+(na notação de parser_notas), as dinâmicas (velocidades convertidas nos níveis
+pppp..ffff de Main), os instrumentos, o número de instrumentos por nota e a
+duração em segundos.
+
+Exemplo:
+    python midi_slices.py partitura.mid resultados.csv
+"""
+
+import heapq
+import struct
+import sys
+from bisect import bisect_right
+from collections import namedtuple
+
+from density_pipeline import analisar_registo, escrever_resultados, CAMPOS_RESULTADO
+from instrumentacao import adicionar_argumentos, aplicar_argumentos, concluir_argumentos, contar
+from instrumentos import DINAMICAS
+from parser_notas import NOMES_SUSTENIDO
+
+
+Fatia = namedtuple("Fatia", ["inicio", "duracao", "notas", "dinamicas", "instrumentos", "numeros_instrumentos"])
+
+# Limite inferior de velocidade de cada nível dinâmico (pppp começa em 1)
+LIMITES_VELOCIDADE = [16, 32, 48, 64, 80, 96, 112, 120]
+
+TAMANHO_BLOCO = 64 * 1024
+TEMPO_POR_OMISSAO = 500000  # microssegundos por semínima (120 bpm)
+
+CAMPOS_FATIA = ['inicio', 'duracao'] + CAMPOS_RESULTADO
+
+
+def velocidade_para_dinamica(velocidade):
+    """Nível dinâmico (pppp..ffff) correspondente a uma velocidade MIDI 1..127."""
+    return DINAMICAS[bisect_right(LIMITES_VELOCIDADE, velocidade)]
+
+
+def midi_para_nota(midi):
+    """Nome da nota (ex.: 61 -> 'C#4'), ou None fora das oitavas 0..9."""
+    oitava, meio_tom = divmod(int(midi), 12)
+    oitava -= 1
+    if not 0 <= oitava <= 9:
+        return None
+    return f"{NOMES_SUSTENIDO[2 * meio_tom]}{oitava}"
+
+
+NOTAS_MIDI = [midi_para_nota(midi) for midi in range(128)]
+
+
+def instrumento_por_omissao(pista, canal, programa):
+    """Todas as pistas são tratadas como flauta, o único módulo de instrumento disponível."""
+    return 'flauta'
+
+
+class _LeitorBlocos:
+    """Lê uma pista a partir do ficheiro em blocos de tamanho fixo."""
+
+    def __init__(self, caminho, inicio, comprimento):
+        self.ficheiro = open(caminho, 'rb')
+        self.ficheiro.seek(inicio)
+        self.restante = comprimento
+        self.bloco = b''
+        self.indice = 0
+
+    def byte(self):
+        if self.indice >= len(self.bloco):
+            if self.restante <= 0:
+                raise EOFError
+            self.bloco = self.ficheiro.read(min(TAMANHO_BLOCO, self.restante))
+            if not self.bloco:
+                raise EOFError
+            self.restante -= len(self.bloco)
+            self.indice = 0
+        valor = self.bloco[self.indice]
+        self.indice += 1
+        return valor
+
+    def bytes(self, n):
+        return bytes(self.byte() for _ in range(n))
+
+    def vlq(self):
+        valor = 0
+        while True:
+            b = self.byte()
+            valor = (valor << 7) | (b & 0x7F)
+            if not b & 0x80:
+                return valor
+
+    def fechar(self):
+        self.ficheiro.close()
+
+
+def _eventos_pista(caminho, inicio, comprimento, pista):
+    """Gera (tick, pista, ordem, tipo, dados) para os eventos relevantes de uma pista."""
+    leitor = _LeitorBlocos(caminho, inicio, comprimento)
+    tick = 0
+    ordem = 0
+    estado = None
+    comprimentos = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+    try:
+        while True:
+            tick += leitor.vlq()
+            status = leitor.byte()
+            if status == 0xFF:
+                tipo, tamanho = leitor.byte(), leitor.vlq()
+                dados = leitor.bytes(tamanho)
+                if tipo == 0x51 and tamanho == 3:
+                    yield tick, pista, ordem, 'tempo', (int.from_bytes(dados, 'big'),)
+                elif tipo == 0x2F:
+                    yield tick, pista, ordem, 'fim', ()
+                    return
+            elif status in (0xF0, 0xF7):
+                leitor.bytes(leitor.vlq())
+            else:
+                if status & 0x80:
+                    estado = status
+                    primeiro = leitor.byte()
+                elif estado is None:
+                    raise ValueError(f"Dados sem status na pista {pista}.")
+                else:
+                    primeiro = status  # running status
+                tipo, canal = estado & 0xF0, estado & 0x0F
+                if tipo not in comprimentos:
+                    raise ValueError(f"Status MIDI {estado:#x} inesperado na pista {pista}.")
+                segundo = leitor.byte() if comprimentos[tipo] == 2 else None
+                if tipo == 0x90 and segundo > 0:
+                    yield tick, pista, ordem, 'on', (canal, primeiro, segundo)
+                elif tipo == 0x80 or tipo == 0x90:
+                    yield tick, pista, ordem, 'off', (canal, primeiro)
+                elif tipo == 0xC0:
+                    yield tick, pista, ordem, 'programa', (canal, primeiro)
+            ordem += 1
+    except EOFError:
+        yield tick, pista, ordem, 'fim', ()
+    finally:
+        leitor.fechar()
+
+
+def _ler_cabecalho(caminho):
+    """Devolve (divisão, [(início, comprimento) de cada pista]) sem ler o conteúdo das pistas."""
+    pistas = []
+    with open(caminho, 'rb') as f:
+        identificador, tamanho = struct.unpack('>4sI', f.read(8))
+        if identificador != b'MThd':
+            raise ValueError(f"{caminho} não é um ficheiro Standard MIDI.")
+        _, numero_pistas, divisao = struct.unpack('>HHH', f.read(6))
+        f.seek(8 + tamanho)
+        while len(pistas) < numero_pistas:
+            cabecalho = f.read(8)
+            if len(cabecalho) < 8:
+                break
+            identificador, tamanho = struct.unpack('>4sI', cabecalho)
+            if identificador == b'MTrk':
+                pistas.append((f.tell(), tamanho))
+            f.seek(tamanho, 1)
+    return divisao, pistas
+
+
+def fatias_midi(caminho, instrumento_de=instrumento_por_omissao):
+    """
+    Gera as fatias verticais de um ficheiro MIDI, por ordem temporal.
+
+    Uma fatia é produzida sempre que as notas a soar mudam e dura até à mudança
+    seguinte. Notas iguais em várias pistas/canais do mesmo instrumento contam
+    como numero_instrumentos; a dinâmica é a da maior velocidade entre elas.
+    instrumento_de(pista, canal, programa) escolhe o módulo de instrumento.
+    Notas fora das oitavas 0..9 são ignoradas.
+
+    Yields:
+        Fatia
+    """
+    divisao, pistas = _ler_cabecalho(caminho)
+    if divisao & 0x8000:
+        quadros = 256 - (divisao >> 8)
+        segundos_por_tick, ppq = 1.0 / (quadros * (divisao & 0xFF)), None
+    else:
+        segundos_por_tick, ppq = TEMPO_POR_OMISSAO / 1e6 / divisao, divisao
+
+    eventos = heapq.merge(*(_eventos_pista(caminho, inicio, comprimento, pista)
+                            for pista, (inicio, comprimento) in enumerate(pistas)))
+
+    a_soar = {}      # (pista, canal, midi) -> [(velocidade, grupo)] das notas ligadas, pela ordem de ataque
+    grupos = {}      # (midi, instrumento) -> velocidades das notas a soar
+    programas = {}   # (pista, canal) -> programa
+    tick_tempo, segundos_tempo = 0, 0.0
+    tick_atual, inicio_fatia, fatia_atual = 0, 0.0, ()
+    mudou = False
+
+    def segundos(tick):
+        return segundos_tempo + (tick - tick_tempo) * segundos_por_tick
+
+    for tick, pista, _, tipo, dados in eventos:
+        if tick != tick_atual:
+            # Todos os eventos do tick anterior já foram aplicados: a fatia só muda aqui
+            if mudou:
+                novo = tuple(sorted((grupo, len(velocidades), max(velocidades))
+                                    for grupo, velocidades in grupos.items()))
+                if novo != fatia_atual:
+                    agora = segundos(tick_atual)
+                    if fatia_atual:
+                        yield _fatia(inicio_fatia, agora, fatia_atual)
+                    fatia_atual, inicio_fatia = novo, agora
+                mudou = False
+            tick_atual = tick
+        if tipo == 'on':
+            canal, midi, velocidade = dados
+            if NOTAS_MIDI[midi] is not None:
+                grupo = (midi, instrumento_de(pista, canal, programas.get((pista, canal), 0)))
+                a_soar.setdefault((pista, canal, midi), []).append((velocidade, grupo))
+                grupos.setdefault(grupo, []).append(velocidade)
+                mudou = True
+        elif tipo == 'off':
+            ligadas = a_soar.get((pista,) + dados)
+            if ligadas:
+                velocidade, grupo = ligadas.pop(0)
+                if not ligadas:
+                    del a_soar[(pista,) + dados]
+                grupos[grupo].remove(velocidade)
+                if not grupos[grupo]:
+                    del grupos[grupo]
+                mudou = True
+        elif tipo == 'programa':
+            programas[(pista, dados[0])] = dados[1]
+        elif tipo == 'tempo' and ppq:
+            segundos_tempo, tick_tempo = segundos(tick), tick
+            segundos_por_tick = dados[0] / 1e6 / ppq
+
+    # Notas ainda ligadas no fim do ficheiro terminam no último evento
+    agora = segundos(tick_atual)
+    if fatia_atual and agora > inicio_fatia:
+        yield _fatia(inicio_fatia, agora, fatia_atual)
+
+
+def _fatia(inicio, fim, conteudo):
+    return Fatia(
+        inicio, fim - inicio,
+        [NOTAS_MIDI[midi] for (midi, _), _, _ in conteudo],
+        [velocidade_para_dinamica(velocidade) for _, _, velocidade in conteudo],
+        [instrumento for (_, instrumento), _, _ in conteudo],
+        [quantidade for _, quantidade, _ in conteudo],
+    )
+
+
+def analisar_midi(caminho, weight_factor=0.5, instrumento_de=instrumento_por_omissao):
+    """
+    Analisa cada fatia do ficheiro à medida que é lida (densidades e momentos
+    espectrais de density_pipeline), sem guardar a partitura em memória.
+
+    Yields:
+        dict: linha de resultado com as chaves de CAMPOS_FATIA; os erros de uma
+        fatia (ex.: nota fora da tabela do instrumento) ficam em 'erro'.
+    """
+    for numero, fatia in enumerate(fatias_midi(caminho, instrumento_de)):
+        contar("fatias_midi")
+        acorde = {'id': numero, **fatia._asdict()}
+        linha = analisar_registo((acorde, weight_factor))
+        linha['inicio'], linha['duracao'] = fatia.inicio, fatia.duracao
+        yield linha
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Análise de densidade de um ficheiro MIDI, fatia a fatia.")
+    parser.add_argument("entrada", help="Ficheiro Standard MIDI (.mid)")
+    parser.add_argument("saida", help="Ficheiro de resultados (.csv ou .jsonl)")
+    parser.add_argument("--weight-factor", type=float, default=0.5)
+    adicionar_argumentos(parser)
+    args = parser.parse_args(argv)
+    aplicar_argumentos(args)
+
+    total = escrever_resultados(analisar_midi(args.entrada, args.weight_factor), args.saida, campos=CAMPOS_FATIA)
+    print(f"{total} fatias analisadas -> {args.saida}", file=sys.stderr)
+    concluir_argumentos(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# orcamento_importacao.py
+
+"""
+Orçamento de tempo de importação dos módulos de cálculo.
+
+Cada módulo é importado num interpretador novo com `python -X importtime`. O
+tempo próprio é o total da importação menos o do numpy, que todos partilham e
+que não depende deste repositório. A verificação falha se algum módulo passar
+o seu orçamento ou se importá-lo carregar uma dependência pesada (matplotlib,
+tkinter, pandas, ...), que só devem ser carregadas quando são usadas.
+
+Exemplo:
+    python orcamento_importacao.py --repeticoes 5
+"""
+
+import os
+import subprocess
+import sys
+
+
+# Tempo próprio máximo (ms) de cada módulo, já com as dependências do repositório que importa
+ORCAMENTO_MS = {
+    'parser_notas': 15,
+    'batch_gpr': 20,
+    'densidade_intervalar': 30,
+    'advanced_density_analysis': 20,
+    'instrumentos': 20,
+    'flauta': 60,
+    'Den_alg_Lin_10': 30,
+    'density_pipeline': 50,
+    'density_timeline': 50,
+    'midi_slices': 50,
+    'tabelas_instrumentos': 30,
+    'exportar_figuras': 50,
+    'varrimento_parametros': 50,
+    'grafo_densidades': 50,
+    'busca_voicings': 50,
+    'execucao_corpus': 50,
+    'servico_densidade': 120,  # asyncio, que o serviço usa desde o arranque
+}
+
+DEPENDENCIAS_PESADAS = ['matplotlib', 'tkinter', 'pandas', 'scipy', 'sklearn', 'xgboost']
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _tempos_cumulativos(saida_importtime):
+    """Tempo cumulativo (µs) de cada módulo nas linhas 'import time: próprio | cumulativo | nome'."""
+    tempos = {}
+    for linha in saida_importtime.splitlines():
+        if not linha.startswith('import time:'):
+            continue
+        _, cumulativo, nome = linha.split('|')
+        if cumulativo.strip().isdigit():
+            tempos[nome.strip()] = int(cumulativo)
+    return tempos
+
+
+def medir_importacao(modulo):
+    """
+    Importa o módulo num interpretador novo.
+
+    Returns:
+        tuple: (total em ms, próprio em ms, dependências pesadas carregadas).
+    """
+    codigo = f"import sys, {modulo}; print(','.join(m for m in {DEPENDENCIAS_PESADAS!r} if m in sys.modules))"
+    processo = subprocess.run([sys.executable, '-X', 'importtime', '-c', codigo], cwd=DIRETORIO,
+                              capture_output=True, text=True, check=True)
+    tempos = _tempos_cumulativos(processo.stderr)
+    total = tempos[modulo] / 1000
+    proprio = total - tempos.get('numpy', 0) / 1000
+    pesadas = [nome for nome in processo.stdout.strip().split(',') if nome]
+    return total, proprio, pesadas
+
+
+def verificar_orcamento(orcamento=ORCAMENTO_MS, repeticoes=3):
+    """
+    Mede cada módulo (o melhor de várias repetições, para descontar a cache do
+    sistema de ficheiros e a primeira escrita das tabelas dos instrumentos).
+
+    Returns:
+        list: (módulo, total, próprio, orçamento, pesadas, dentro_do_orcamento) por módulo.
+    """
+    resultados = []
+    for modulo, limite in orcamento.items():
+        medicoes = [medir_importacao(modulo) for _ in range(repeticoes)]
+        total, proprio, pesadas = min(medicoes, key=lambda medicao: medicao[1])
+        resultados.append((modulo, total, proprio, limite, pesadas, proprio <= limite and not pesadas))
+    return resultados
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Verifica o tempo de importação dos módulos de cálculo.")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    resultados = verificar_orcamento(repeticoes=args.repeticoes)
+    print(f"{'módulo':<28}{'total ms':>10}{'próprio ms':>12}{'orçamento':>11}  estado")
+    for modulo, total, proprio, limite, pesadas, ok in resultados:
+        estado = "ok" if ok else "EXCEDIDO"
+        if pesadas:
+            estado += f" (carrega {', '.join(pesadas)})"
+        print(f"{modulo:<28}{total:>10.1f}{proprio:>12.1f}{limite:>11}  {estado}")
+    return 0 if all(resultado[-1] for resultado in resultados) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# parser_notas.py
+
+"""
+Leitura única e em cache das notas escritas como texto (ex.: 'C#4', 'Eb-5', 'B#-3').
+
+Todas as grafias de escala_microtonal e as suas enarmonias são compiladas numa
+tabela de passos de quarto de tom dentro da oitava. Cada nota lida fica
+guardada, pelo que ler um corpus grande de nomes de notas passa a ser uma
+consulta de dicionário em vez de uma expressão regular por nota.
+
+Grandezas derivadas do passo absoluto p = passo_na_oitava + 24 * oitava:
+    posição microtonal (densidade_intervalar): p + 1
+    número MIDI (meios-tons, C4 = 60):        12 + p / 2
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+
+
+PASSOS_POR_OITAVA = 24
+
+# Unified microtonal scale definition
+escala_microtonal = {
+    'C': 1, 'C#-': 2, 'C#': 3, 'C#+': 4,
+    'D': 5, 'D#-': 6, 'D#': 7, 'D#+': 8,
+    'E': 9, 'E#-': 10,
+    'F': 11, 'F#-': 12, 'F#': 13, 'F#+': 14,
+    'G': 15, 'G#-': 16, 'G#': 17, 'G#+': 18,
+    'A': 19, 'A#-': 20, 'A#': 21, 'A#+': 22,
+    'B': 23, 'B#-': 24,
+    'Cb+': 24,
+    'Db+': 2, 'Db': 3, 'Db-': 4,
+    'Eb+': 6, 'Eb': 7, 'Eb-': 8,
+    'Fb+': 10,
+    'Gb+': 12, 'Gb': 13, 'Gb-': 14,
+    'Ab+': 16, 'Ab': 17, 'Ab-': 18,
+    'Bb+': 20, 'Bb': 21, 'Bb-': 22,
+}
+
+# Passo de quarto de tom dentro da oitava para cada grafia aceite. Às grafias de
+# escala_microtonal juntam-se as que só existiam na antiga tabela MIDI de Main
+# ('B#' e 'C-', contadas a partir do C da mesma oitava).
+PASSOS_GRAFIA = {grafia: posicao - 1 for grafia, posicao in escala_microtonal.items()}
+PASSOS_GRAFIA.update({'B#': 24, 'C-': 23})
+
+# Grafia em sustenidos de cada passo da oitava (a usada nas tabelas dos instrumentos)
+NOMES_SUSTENIDO = [
+    'C', 'C#-', 'C#', 'C#+', 'D', 'D#-', 'D#', 'D#+', 'E', 'E#-', 'F', 'F#-',
+    'F#', 'F#+', 'G', 'G#-', 'G#', 'G#+', 'A', 'A#-', 'A#', 'A#+', 'B', 'B#-',
+]
+
+SEM_OITAVA = -1
+
+_PADRAO_NOTA = re.compile(r'([A-G][#b]?[-+]?)([0-9x])')
+_PADRAO_GRAFIA = re.compile(r'([A-Ga-g][#b]?[-+]?)([0-9x]?)')
+
+# Cache das notas já lidas: texto -> passo absoluto (SEM_OITAVA para a oitava 'x')
+_passos_em_cache = {}
+
+
+def passo_nota(nota):
+    """Passo absoluto de quarto de tom de uma nota, ou SEM_OITAVA se a oitava for 'x'."""
+    try:
+        return _passos_em_cache[nota]
+    except KeyError:
+        pass
+    correspondencia = _PADRAO_NOTA.match(nota)
+    if not correspondencia:
+        raise ValueError(f"Nota {nota} não corresponde ao padrão esperado.")
+    grafia, oitava = correspondencia.groups()
+    if grafia not in PASSOS_GRAFIA:
+        raise ValueError(f"Nota {grafia} não está definida na escala_microtonal.")
+    passo = SEM_OITAVA if oitava == 'x' else PASSOS_GRAFIA[grafia] + PASSOS_POR_OITAVA * int(oitava)
+    _passos_em_cache[nota] = passo
+    return passo
+
+
+def passos_notas(notas):
+    """Versão vetorizada de passo_nota: array int64 com um passo por nota."""
+    return np.fromiter(map(passo_nota, notas), dtype=np.int64, count=len(notas))
+
+
+def nota_para_posicao(nota):
+    """Posição na escala microtonal (C0 = 1), ou None se a oitava for 'x'."""
+    passo = passo_nota(nota)
+    return None if passo == SEM_OITAVA else passo + 1
+
+
+def posicoes_notas(notas):
+    """Posições microtonais das notas, ignorando as de oitava 'x'."""
+    passos = passos_notas(notas)
+    return passos[passos != SEM_OITAVA] + 1
+
+
+def nota_para_midi(nota):
+    """Número MIDI da nota (C4 = 60), com quartos de tom como .5."""
+    passo = passo_nota(nota)
+    if passo == SEM_OITAVA:
+        raise ValueError(f"Nota {nota} não tem oitava definida.")
+    midi = 12 + passo / 2
+    return int(midi) if passo % 2 == 0 else midi
+
+
+def midis_notas(notas):
+    """Versão vetorizada de nota_para_midi: array float com um número MIDI por nota."""
+    passos = passos_notas(notas)
+    if np.any(passos == SEM_OITAVA):
+        raise ValueError("Há notas sem oitava definida.")
+    return 12 + passos / 2
+
+
+def nota_em_sustenidos(nota):
+    """Grafia canónica em sustenidos da mesma altura (ex.: 'Db4' -> 'C#4', 'Cb+4' -> 'B#-4')."""
+    passo = passo_nota(nota)
+    if passo == SEM_OITAVA:
+        return nota
+    oitava, passo_na_oitava = divmod(passo, PASSOS_POR_OITAVA)
+    return f"{NOMES_SUSTENIDO[passo_na_oitava]}{oitava}"
+
+
+@lru_cache(maxsize=4096)
+def converter_para_sustenido(nota):
+    """
+    Converte uma nota com bemol para sua equivalente em sustenido.
+    Exemplo: 'Db' -> 'C#'
+    """
+    equivalencias = {
+        'Cb': 'B', 'Db': 'C#', 'Eb': 'D#', 'Fb': 'E', 'Gb': 'F#',
+        'Ab': 'G#', 'Bb': 'A#',
+        'C-': 'B#', 'D-': 'C#+', 'E-': 'D#+', 'F-': 'E#+', 'G-': 'F#+',
+        'A-': 'G#+', 'B-': 'A#+',
+        'C+': 'B-', 'D+': 'C#-', 'E+': 'D#-', 'F+': 'E-', 'G+': 'F#-',
+        'A+': 'G#-', 'B+': 'A#-',
+    }
+
+    correspondencia = _PADRAO_GRAFIA.match(nota)
+    if correspondencia:
+        base_nota, oitava = correspondencia.groups()
+        if base_nota in equivalencias:
+            base_nota = equivalencias[base_nota]
+        return f"{base_nota}{oitava}"
+    else:
+        raise ValueError(f"Nota inválida: {nota}")
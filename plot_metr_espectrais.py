@@ -1,10 +1,13 @@
 # plot_metr_espectrais.py
 
-import matplotlib.pyplot as plt
 import numpy as np
 from advanced_density_analysis import calculate_spectral_moments
+from instrumentacao import obter_logger
+from parser_notas import midis_notas
 from math import log2
 
+logger = obter_logger(__name__)
+
 NOTAS_CROMATICAS = ["C", "C#", "D", "D#", "E", "F", 
                     "F#", "G", "G#", "A", "A#", "B"]
 
@@ -33,28 +36,89 @@ def semitons_to_note_name(semitons_from_c4):
 #     plt.yticks(ticks, tick_labels)
 #     plt.show()
 
+def spread_em_semitons(spectral_centroid_freq, spectral_spread_hz):
+    """Converte o spread de Hz para semitons acima do centroide (NaN se não estiver definido)."""
+    if spectral_centroid_freq > 0:
+        upper_freq = spectral_centroid_freq + spectral_spread_hz
+        if upper_freq > 0:
+            return 12 * log2(upper_freq / spectral_centroid_freq)
+    return np.nan
+
+ROTULOS_METRICAS = ["Spectral Centroid (Note)", "Spectral Spread (Semitons)", "Spectral Skewness"]
+CORES_METRICAS = ["#1f77b4", "#ff7f0e", "#2ca02c"]
+ROTULOS_TABELA = ["Spectral Centroid (Freq)", "Spectral Centroid (Note)", "Spectral Spread", "Spectral Skewness"]
+
+def desenhar_tabela_metricas(ax, spectral_centroid_freq, spectral_spread, centroid_note, spectral_skewness,
+                             titulo="Spectral Metrics Summary", artistas=None):
+    """
+    Desenha em ax a tabela das métricas espectrais. Devolve os artistas; com
+    os de uma chamada anterior no mesmo ax, só troca os valores das células.
+    """
+    if artistas is None:
+        ax.axis('off')
+        table = ax.table(cellText=[[rotulo, ""] for rotulo in ROTULOS_TABELA],
+                         colLabels=["Metric", "Value"], cellLoc='center', loc='center')
+        table.auto_set_font_size(False)
+        table.set_fontsize(12)
+        table.scale(1, 2)
+        artistas = {"tabela": table}
+
+    valores = [f"{spectral_centroid_freq:.2f} Hz", centroid_note,
+               f"±{spectral_spread:.2f} Hz", f"{spectral_skewness:.4f}"]
+    for linha, valor in enumerate(valores, 1):
+        artistas["tabela"][linha, 1].get_text().set_text(valor)
+    ax.set_title(titulo, fontsize=14, fontweight='bold', pad=10)
+    return artistas
+
+def desenhar_metricas(ax, spectral_centroid_note, spread_semitons, spectral_skewness,
+                      titulo="Spectral Metrics (Note and Semitones)", artistas=None):
+    """
+    Desenha em ax o centroide (como nota), o spread em semitons e a skewness.
+    Devolve os artistas, como desenhar_tabela_metricas.
+    """
+    x_positions = [1, 2, 3]
+    if artistas is None:
+        ax.axhline(y=0, color='black', linewidth=1)
+        artistas = {"hastes": [], "pontos": [], "textos": []}
+        for x, c in zip(x_positions, CORES_METRICAS):
+            artistas["hastes"].append(ax.plot([x, x], [0, 0], color=c, linewidth=3)[0])
+            artistas["pontos"].append(ax.plot([x], [0], 'o', color=c, markersize=8)[0])
+            artistas["textos"].append(ax.text(x, 0, "", ha='center', va='bottom', fontsize=10,
+                                              fontweight='bold', color=c))
+        ax.text(1, -0.2, "Note shown as label", ha='center', va='top', fontsize=8, color=CORES_METRICAS[0])
+        ax.set_xticks(x_positions, ROTULOS_METRICAS, fontsize=10)
+        ax.set_xlim(0.5, 3.5)
+        ax.set_ylabel("Value", fontsize=12)
+        ax.grid(True, axis='y', linestyle='--', alpha=0.7)
+
+    centroid_value = 0.0
+    spread_value = spread_semitons if not np.isnan(spread_semitons) else 0.0
+    skewness_value = spectral_skewness if not np.isnan(spectral_skewness) else 0.0
+    metric_values = [centroid_value, spread_value, skewness_value]
+
+    for k, (x, val) in enumerate(zip(x_positions, metric_values)):
+        artistas["hastes"][k].set_ydata([0, val])
+        artistas["pontos"][k].set_ydata([val])
+        if k == 0:
+            artistas["textos"][k].set_position((x, val + 0.05))
+            artistas["textos"][k].set_text(spectral_centroid_note)
+        else:
+            artistas["textos"][k].set_position((x, val * 1.05 if val != 0 else 0.05))
+            artistas["textos"][k].set_text(f"{val:.2f}")
+    ax.set_ylim(min(min(metric_values), 0) - 0.5, max(max(metric_values), 0) + 0.5)
+    ax.set_title(titulo, fontsize=14, fontweight="bold")
+    return artistas
+
 def plot_spectral_metrics(spectral_centroid_freq, spectral_spread, centroid_note, spectral_skewness):
     """
     Plota uma tabela com métricas espectrais de forma clara e profissional.
     """
+    import matplotlib.pyplot as plt
+
     plt.style.use('seaborn-whitegrid')
     fig, ax = plt.subplots(figsize=(6, 2))
-    ax.axis('off')
-
-    data = [
-        ["Spectral Centroid (Freq)", f"{spectral_centroid_freq:.2f} Hz"],
-        ["Spectral Centroid (Note)", centroid_note],
-        ["Spectral Spread", f"±{spectral_spread:.2f} Hz"],
-        ["Spectral Skewness", f"{spectral_skewness:.4f}"]
-    ]
-
-    table = ax.table(cellText=data, colLabels=["Metric", "Value"], cellLoc='center', loc='center')
-    table.auto_set_font_size(False)
-    table.set_fontsize(12)
-    table.scale(1, 2)
-
-    plt.title("Spectral Metrics Summary", fontsize=14, fontweight='bold', pad=10)
-    plt.tight_layout()
+    desenhar_tabela_metricas(ax, spectral_centroid_freq, spectral_spread, centroid_note, spectral_skewness)
+    fig.tight_layout()
     #plt.show()
     plt.show(block=False)
 
@@ -63,10 +127,10 @@ def extract_and_plot_metrics(notas, duracoes, instrumentos, numeros_instrumentos
     Extrai métricas espectrais a partir de pitches e densidades fornecidos,
     e plota um gráfico mostrando o centroid como nota, o spread em semitons e a skewness como número.
     """
+    import matplotlib.pyplot as plt
+
     try:
-        # Ajuste este import conforme o nome do seu arquivo principal.
-        from Main import note_to_midi  
-        pitches = [note_to_midi(nota) for nota in notas]
+        pitches = midis_notas(notas).tolist()
 
         amplitudes = densidades_instrumento
 
@@ -76,54 +140,19 @@ def extract_and_plot_metrics(notas, duracoes, instrumentos, numeros_instrumentos
         spectral_spread_hz = spectral_results["spectral_spread"]["deviation"]
         spectral_skewness = spectral_results.get("spectral_skewness", np.nan)
 
-        # Converter spread de Hz para semitons
-        if spectral_centroid_freq > 0:
-            upper_freq = spectral_centroid_freq + spectral_spread_hz
-            if upper_freq <= 0:
-                spread_semitons = np.nan
-            else:
-                spread_semitons = 12 * log2(upper_freq / spectral_centroid_freq)
-        else:
-            spread_semitons = np.nan
-
-        print(f"Spectral Centroid (Note): {spectral_centroid_note}")
-        print(f"Spectral Spread (Semitons): ±{spread_semitons:.2f}")
-        print(f"Spectral Skewness: {spectral_skewness:.4f}")
-
-        metric_labels = ["Spectral Centroid (Note)", "Spectral Spread (Semitons)", "Spectral Skewness"]
-
-        centroid_value = 0.0
-        spread_value = spread_semitons if not np.isnan(spread_semitons) else 0.0
-        skewness_value = spectral_skewness if not np.isnan(spectral_skewness) else 0.0
-
-        metric_values = [centroid_value, spread_value, skewness_value]
-        colors = ["#1f77b4", "#ff7f0e", "#2ca02c"]
-
-        plt.figure(figsize=(8, 5))
-        plt.title("Spectral Metrics (Note and Semitones)", fontsize=14, fontweight="bold")
-        plt.axhline(y=0, color='black', linewidth=1)
-
-        x_positions = [1, 2, 3]
-
-        for x, val, label, c in zip(x_positions, metric_values, metric_labels, colors):
-            plt.plot([x, x], [0, val], color=c, linewidth=3)
-            plt.plot(x, val, 'o', color=c, markersize=8)
-            if label == "Spectral Centroid (Note)":
-                plt.text(x, val + 0.05, spectral_centroid_note, ha='center', va='bottom', fontsize=10, fontweight='bold', color=c)
-            else:
-                plt.text(x, val*1.05 if val != 0 else 0.05, f"{val:.2f}", ha='center', va='bottom', fontsize=10, fontweight='bold', color=c)
-
-        plt.xticks(x_positions, metric_labels, fontsize=10)
-        plt.ylabel("Value", fontsize=12)
-        plt.grid(True, axis='y', linestyle='--', alpha=0.7)
+        spread_semitons = spread_em_semitons(spectral_centroid_freq, spectral_spread_hz)
 
-        plt.text(1, centroid_value - 0.2, "Note shown as label", ha='center', va='top', fontsize=8, color='#1f77b4')
+        logger.info("Spectral Centroid (Note): %s", spectral_centroid_note)
+        logger.info("Spectral Spread (Semitons): ±%.2f", spread_semitons)
+        logger.info("Spectral Skewness: %.4f", spectral_skewness)
 
-        plt.tight_layout()
+        fig, ax = plt.subplots(figsize=(8, 5))
+        desenhar_metricas(ax, spectral_centroid_note, spread_semitons, spectral_skewness)
+        fig.tight_layout()
         plt.show()
        
 
     except KeyError as e:
-        print(f"Chave ausente no retorno de calculate_spectral_moments: {e}")
+        logger.error("Chave ausente no retorno de calculate_spectral_moments: %s", e)
     except Exception as e:
-        print(f"Erro ao calcular e plotar métricas espectrais: {e}")
+        logger.error("Erro ao calcular e plotar métricas espectrais: %s", e)
@@ -0,0 +1,413 @@
+# servico_densidade.py
+
+"""
+Serviço local de densidades (HTTP sobre TCP ou socket Unix), com asyncio.
+
+O processo arranca uma vez: importa os módulos de instrumento pedidos (com as
+suas tabelas e dinâmicas pré-calculadas) e analisa um acorde de aquecimento.
+Daí em diante, cada pedido custa só a análise dos seus acordes.
+
+Os pedidos que chegam ao mesmo tempo são agrupados (AgrupadorPedidos): o
+primeiro abre uma janela de alguns milissegundos, e todos os acordes que
+chegarem nela, até tamanho_maximo, são analisados de uma só vez por
+density_pipeline.analisar_bloco, numa thread à parte para o ciclo de eventos
+continuar a aceitar ligações. Enquanto um lote é calculado, o seguinte vai
+enchendo.
+
+Rotas:
+    POST /analisar       um acorde (objeto JSON com as chaves de CAMPOS_ENTRADA
+                         e, opcionalmente, id e weight_factor) ou uma lista de
+                         acordes; devolve as linhas de CAMPOS_RESULTADO
+    GET  /estatisticas   pedidos, acordes, lotes, latências (p50/p90/p99) e débito
+    GET  /saude          {"estado": "ok"}
+
+Exemplo:
+    python servico_densidade.py --porta 8765 --instrumentos flauta
+    curl -d '{"notas": ["C4", "E4", "G4"]}' http://127.0.0.1:8765/analisar
+"""
+
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+
+from density_pipeline import CAMPOS_RESULTADO, _valor_serializavel, analisar_acorde, analisar_bloco
+from instrumentacao import (adicionar_argumentos, aplicar_argumentos, concluir_argumentos, contar,
+                            metricas, obter_logger)
+from instrumentos import obter_instrumento
+
+
+# Tempo (s) que o primeiro pedido de um lote espera por outros, e acordes por lote
+JANELA = 0.002
+TAMANHO_MAXIMO_LOTE = 256
+
+# Tamanho máximo do corpo de um pedido, em bytes
+TAMANHO_MAXIMO_CORPO = 8 * 1024 * 1024
+
+# Latências guardadas para os percentis, e janela (s) do débito recente
+AMOSTRAS_LATENCIA = 10000
+JANELA_DEBITO = 60.0
+
+ESTADOS_HTTP = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 500: "Internal Server Error"}
+
+logger = obter_logger(__name__)
+
+
+class Estatisticas:
+    """Contagens, latências (do pedido completo) e débito do serviço."""
+
+    def __init__(self, amostras=AMOSTRAS_LATENCIA, janela_debito=JANELA_DEBITO):
+        self.inicio = time.monotonic()
+        self.pedidos = 0
+        self.acordes = 0
+        self.lotes = 0
+        self.acordes_em_lotes = 0
+        self.latencias = deque(maxlen=amostras)
+        self.janela_debito = janela_debito
+        self._recentes = deque()   # (instante, acordes) dos pedidos da última janela_debito
+
+    def registar_pedido(self, acordes, latencia):
+        agora = time.monotonic()
+        self.pedidos += 1
+        self.acordes += acordes
+        self.latencias.append(latencia)
+        self._recentes.append((agora, acordes))
+        while self._recentes and self._recentes[0][0] < agora - self.janela_debito:
+            self._recentes.popleft()
+
+    def registar_lote(self, acordes):
+        self.lotes += 1
+        self.acordes_em_lotes += acordes
+
+    def resumo(self):
+        agora = time.monotonic()
+        tempo_ativo = agora - self.inicio
+        latencias = sorted(self.latencias)
+
+        def percentil(p):
+            if not latencias:
+                return None
+            return latencias[min(len(latencias) - 1, int(p / 100 * len(latencias)))] * 1000
+
+        recentes = sum(acordes for instante, acordes in self._recentes if instante >= agora - self.janela_debito)
+        return {
+            "tempo_ativo_s": tempo_ativo,
+            "pedidos": self.pedidos,
+            "acordes": self.acordes,
+            "lotes": self.lotes,
+            "acordes_por_lote": self.acordes_em_lotes / self.lotes if self.lotes else None,
+            "latencia_ms": {"p50": percentil(50), "p90": percentil(90), "p99": percentil(99),
+                            "max": latencias[-1] * 1000 if latencias else None},
+            "acordes_por_s": self.acordes / tempo_ativo if tempo_ativo else None,
+            "acordes_por_s_recentes": recentes / min(tempo_ativo, self.janela_debito) if tempo_ativo else None,
+            "metricas": metricas.resumo(),
+        }
+
+
+class AgrupadorPedidos:
+    """
+    Junta os acordes dos pedidos concorrentes em lotes para analisar_bloco.
+
+    analisar(tarefas) põe as tarefas (acorde, weight_factor) de um pedido na
+    fila e espera pelas suas linhas de resultado. O ciclo do agrupador tira o
+    primeiro pedido da fila, espera até janela segundos (ou até ter
+    tamanho_maximo acordes) por outros, analisa-os todos numa só chamada e
+    devolve a cada pedido a sua fatia. Um pedido maior do que tamanho_maximo
+    forma um lote sozinho.
+    """
+
+    def __init__(self, janela=JANELA, tamanho_maximo=TAMANHO_MAXIMO_LOTE, estatisticas=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.janela = janela
+        self.tamanho_maximo = tamanho_maximo
+        self.estatisticas = estatisticas
+        self._fila = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analise")
+        self._tarefa = None
+
+    def iniciar(self):
+        self._tarefa = asyncio.get_running_loop().create_task(self._ciclo())
+
+    async def parar(self):
+        if self._tarefa is not None:
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except asyncio.CancelledError:
+                pass
+            self._tarefa = None
+        self._executor.shutdown(wait=True)
+
+    async def analisar(self, tarefas):
+        if not tarefas:
+            return []
+        futuro = asyncio.get_running_loop().create_future()
+        await self._fila.put((tarefas, futuro))
+        return await futuro
+
+    async def _recolher(self):
+        """Pedidos do próximo lote: o primeiro da fila e os que chegarem dentro da janela."""
+        pedidos = [await self._fila.get()]
+        total = len(pedidos[0][0])
+        limite = asyncio.get_running_loop().time() + self.janela
+        while total < self.tamanho_maximo:
+            if self._fila.empty():
+                restante = limite - asyncio.get_running_loop().time()
+                if restante <= 0:
+                    break
+                try:
+                    pedido = await asyncio.wait_for(self._fila.get(), restante)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                pedido = self._fila.get_nowait()
+            pedidos.append(pedido)
+            total += len(pedido[0])
+        return pedidos
+
+    async def _ciclo(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pedidos = await self._recolher()
+            tarefas = [tarefa for pedido, _ in pedidos for tarefa in pedido]
+            try:
+                linhas = await loop.run_in_executor(self._executor, analisar_bloco, tarefas)
+            except Exception as e:
+                logger.exception("Lote de %d acordes falhou", len(tarefas))
+                for _, futuro in pedidos:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                continue
+            contar("servico_densidade.lotes")
+            if self.estatisticas is not None:
+                self.estatisticas.registar_lote(len(tarefas))
+            inicio = 0
+            for pedido, futuro in pedidos:
+                if not futuro.done():   # o cliente pode ter desligado entretanto
+                    futuro.set_result(linhas[inicio:inicio + len(pedido)])
+                inicio += len(pedido)
+
+
+def _acorde_pedido(objeto, indice, weight_factor):
+    """(acorde, weight_factor) de um objeto JSON, com as omissões de ler_acordes_jsonl."""
+    if not isinstance(objeto, dict) or not isinstance(objeto.get('notas'), list):
+        raise ValueError(f"Acorde {indice}: é preciso um objeto com a lista 'notas'.")
+    n = len(objeto['notas'])
+    acorde = {
+        'id': objeto.get('id', str(indice)),
+        'notas': objeto['notas'],
+        'dinamicas': objeto.get('dinamicas', ['mf'] * n),
+        'instrumentos': objeto.get('instrumentos', ['flauta'] * n),
+        'numeros_instrumentos': objeto.get('numeros_instrumentos', [1] * n),
+    }
+    return acorde, float(objeto.get('weight_factor', weight_factor))
+
+
+class ErroHTTP(Exception):
+    def __init__(self, estado, mensagem):
+        super().__init__(mensagem)
+        self.estado = estado
+
+
+async def _ler_pedido(reader):
+    """(método, caminho, cabeçalhos, corpo) do próximo pedido HTTP/1.1, ou None se a ligação fechou."""
+    try:
+        cabecalho = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError:
+        return None
+    except asyncio.LimitOverrunError:
+        raise ErroHTTP(413, "Cabeçalhos demasiado grandes.")
+    linhas = cabecalho.decode("latin-1").split("\r\n")
+    try:
+        metodo, caminho, _ = linhas[0].split(" ", 2)
+    except ValueError:
+        raise ErroHTTP(400, "Linha de pedido inválida.")
+    cabecalhos = {}
+    for linha in linhas[1:]:
+        if ":" in linha:
+            nome, valor = linha.split(":", 1)
+            cabecalhos[nome.strip().lower()] = valor.strip()
+    try:
+        tamanho = int(cabecalhos.get("content-length", 0))
+    except ValueError:
+        raise ErroHTTP(400, "Content-Length inválido.")
+    if tamanho > TAMANHO_MAXIMO_CORPO:
+        raise ErroHTTP(413, "Pedido demasiado grande.")
+    corpo = await reader.readexactly(tamanho) if tamanho else b""
+    return metodo.upper(), caminho.split("?", 1)[0], cabecalhos, corpo
+
+
+def _escrever_resposta(writer, estado, dados, manter):
+    corpo = json.dumps(dados, ensure_ascii=False).encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {estado} {ESTADOS_HTTP[estado]}\r\n"
+        f"Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(corpo)}\r\n"
+        f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n".encode("latin-1") + corpo
+    )
+
+
+class ServicoDensidade:
+    """Rotas do serviço sobre um AgrupadorPedidos; servir() liga-o a TCP e/ou a um socket Unix."""
+
+    def __init__(self, janela=JANELA, tamanho_maximo=TAMANHO_MAXIMO_LOTE, weight_factor=0.5):
+        self.weight_factor = weight_factor
+        self.estatisticas = Estatisticas()
+        self.agrupador = AgrupadorPedidos(janela, tamanho_maximo, self.estatisticas)
+        self._servidores = []
+
+    async def tratar(self, metodo, caminho, corpo):
+        """(estado, dados JSON) da resposta a um pedido."""
+        if caminho == "/saude":
+            if metodo != "GET":
+                raise ErroHTTP(405, "Use GET.")
+            return 200, {"estado": "ok"}
+        if caminho == "/estatisticas":
+            if metodo != "GET":
+                raise ErroHTTP(405, "Use GET.")
+            return 200, self.estatisticas.resumo()
+        if caminho != "/analisar":
+            raise ErroHTTP(404, f"Rota desconhecida: {caminho}")
+        if metodo != "POST":
+            raise ErroHTTP(405, "Use POST.")
+
+        try:
+            objeto = json.loads(corpo)
+            lista = isinstance(objeto, list)
+            tarefas = [_acorde_pedido(acorde, i, self.weight_factor)
+                       for i, acorde in enumerate(objeto if lista else [objeto])]
+        except (ValueError, TypeError) as e:
+            raise ErroHTTP(400, str(e))
+        inicio = time.perf_counter()
+        linhas = await self.agrupador.analisar(tarefas)
+        self.estatisticas.registar_pedido(len(tarefas), time.perf_counter() - inicio)
+        contar("servico_densidade.pedidos")
+        linhas = [{campo: _valor_serializavel(linha.get(campo)) for campo in CAMPOS_RESULTADO} for linha in linhas]
+        return 200, linhas if lista else linhas[0]
+
+    async def _ligacao(self, reader, writer):
+        try:
+            while True:
+                try:
+                    pedido = await _ler_pedido(reader)
+                    if pedido is None:
+                        break
+                    metodo, caminho, cabecalhos, corpo = pedido
+                    manter = cabecalhos.get("connection", "").lower() != "close"
+                    estado, dados = await self.tratar(metodo, caminho, corpo)
+                except ErroHTTP as e:
+                    estado, dados, manter = e.estado, {"erro": str(e)}, False
+                except Exception as e:
+                    logger.exception("Erro ao tratar o pedido")
+                    estado, dados, manter = 500, {"erro": f"{type(e).__name__}: {e}"}, False
+                _escrever_resposta(writer, estado, dados, manter)
+                await writer.drain()
+                if not manter:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def iniciar(self, host="127.0.0.1", porta=None, caminho_socket=None):
+        """Abre os servidores pedidos (porta 0: uma porta livre) e devolve os seus endereços."""
+        self.agrupador.iniciar()
+        if porta is not None:
+            self._servidores.append(await asyncio.start_server(self._ligacao, host, porta))
+        if caminho_socket is not None:
+            self._servidores.append(await asyncio.start_unix_server(self._ligacao, caminho_socket))
+        return [socket.getsockname() for servidor in self._servidores for socket in servidor.sockets]
+
+    async def parar(self):
+        for servidor in self._servidores:
+            servidor.close()
+            await servidor.wait_closed()
+        self._servidores = []
+        await self.agrupador.parar()
+
+
+def aquecer(instrumentos=("flauta",)):
+    """Importa os módulos de instrumento e analisa um acorde, para o primeiro pedido não pagar esse custo."""
+    for instrumento in instrumentos:
+        obter_instrumento(instrumento)
+        analisar_acorde(['C4', 'E4', 'G4'], ['mf'] * 3, [instrumento], [1] * 3)
+
+
+async def servir(host, porta, caminho_socket, janela, tamanho_maximo, weight_factor, instrumentos):
+    inicio = time.perf_counter()
+    aquecer(instrumentos)
+    logger.info("Instrumentos carregados em %.2f s", time.perf_counter() - inicio)
+    servico = ServicoDensidade(janela, tamanho_maximo, weight_factor)
+    for endereco in await servico.iniciar(host, porta, caminho_socket):
+        print(f"A servir em {endereco}", file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await servico.parar()
+
+
+def pedir(acordes, host="127.0.0.1", porta=8765, caminho_socket=None, rota="/analisar", timeout=30):
+    """Cliente mínimo: envia acordes (objeto ou lista) a um serviço e devolve a resposta (GET se acordes for None)."""
+    import http.client
+    import socket
+
+    if caminho_socket is not None:
+        class _LigacaoUnix(http.client.HTTPConnection):
+            def connect(self):
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.settimeout(timeout)
+                self.sock.connect(caminho_socket)
+
+        ligacao = _LigacaoUnix("localhost", timeout=timeout)
+    else:
+        ligacao = http.client.HTTPConnection(host, porta, timeout=timeout)
+    try:
+        if acordes is None:
+            ligacao.request("GET", rota)
+        else:
+            ligacao.request("POST", rota, json.dumps(acordes), {"Content-Type": "application/json"})
+        resposta = ligacao.getresponse()
+        dados = json.loads(resposta.read())
+        if resposta.status != 200:
+            raise RuntimeError(f"{resposta.status}: {dados.get('erro')}")
+        return dados
+    finally:
+        ligacao.close()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serviço local de densidades, com agrupamento de pedidos.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8765, help="Porta TCP (0: uma porta livre)")
+    parser.add_argument("--socket", default=None, help="Serve também neste socket Unix")
+    parser.add_argument("--sem-tcp", action="store_true", help="Serve só no socket Unix")
+    parser.add_argument("--janela-ms", type=float, default=JANELA * 1000,
+                        help="Tempo que um pedido espera por outros para formar um lote")
+    parser.add_argument("--lote-maximo", type=int, default=TAMANHO_MAXIMO_LOTE, help="Acordes por lote")
+    parser.add_argument("--weight-factor", type=float, default=0.5,
+                        help="weight_factor dos acordes que não o indicam")
+    parser.add_argument("--instrumentos", default="flauta",
+                        help="Instrumentos carregados no arranque, separados por vírgulas")
+    adicionar_argumentos(parser)
+    args = parser.parse_args(argv)
+    aplicar_argumentos(args)
+    if args.sem_tcp and not args.socket:
+        parser.error("--sem-tcp precisa de --socket")
+
+    instrumentos = [instrumento.strip() for instrumento in args.instrumentos.split(",") if instrumento.strip()]
+    try:
+        asyncio.run(servir(args.host, None if args.sem_tcp else args.porta, args.socket,
+                           args.janela_ms / 1000, args.lote_maximo, args.weight_factor, instrumentos))
+    except KeyboardInterrupt:
+        pass
+    concluir_argumentos(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
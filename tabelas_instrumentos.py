@@ -0,0 +1,253 @@
+# tabelas_instrumentos.py
+
+"""
+Leitura em lote, sem interface gráfica, das tabelas de densidade dos instrumentos.
+
+Cada tabela (uma por instrumento/articulação) é um ficheiro .xlsx, .xls, .csv
+ou .parquet com as colunas 'pp', 'mf' e 'ff' e, opcionalmente, 'Notes'. As
+notas são validadas contra uma grelha de alturas configurável: a de meios-tons
+de Den_alg_Lin_10 (C4..Db7) ou a de quartos de tom da flauta (C4..C#7). A
+comparação é feita pelo passo de quarto de tom, pelo que a grafia enarmónica
+não conta.
+
+A primeira leitura de cada ficheiro é convertida num .npz na cache (nome com o
+hash do conteúdo); as leituras seguintes de um ficheiro igual não voltam a
+abrir o Excel. Os ficheiros que faltam ler são lidos num conjunto de processos.
+
+Exemplo:
+    python tabelas_instrumentos.py tabelas/ --grelha quartos_de_tom --workers 4
+"""
+
+import hashlib
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from instrumentacao import (adicionar_argumentos, aplicar_argumentos, concluir_argumentos, contar,
+                            cronometro, obter_logger)
+from parser_notas import NOMES_SUSTENIDO, PASSOS_POR_OITAVA, passo_nota, passos_notas
+
+
+Tabela = namedtuple("Tabela", ["nome", "notas", "valores"])
+
+COLUNAS_DINAMICAS = ["pp", "mf", "ff"]
+COLUNA_NOTAS = "Notes"
+EXTENSOES = (".xlsx", ".xls", ".csv", ".parquet")
+
+# Diferenças de notas mostradas numa mensagem de erro
+MAX_DIFERENCAS = 10
+
+# Muda sempre que o formato dos .npz em cache muda
+VERSAO_CACHE = 1
+
+# Diretório da cache (o mesmo da tabela de dinâmicas da flauta); pode ser alterado com HARMONIC_DENSITY_CACHE
+CACHE_DIR = os.environ.get("HARMONIC_DENSITY_CACHE",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+logger = obter_logger(__name__)
+
+
+def grelha_notas(inicio, fim, passo=1):
+    """Notas (em sustenidos) de inicio a fim, inclusive, de passo em passo quartos de tom."""
+    notas = []
+    for absoluto in range(passo_nota(inicio), passo_nota(fim) + 1, passo):
+        oitava, passo_na_oitava = divmod(absoluto, PASSOS_POR_OITAVA)
+        notas.append(f"{NOMES_SUSTENIDO[passo_na_oitava]}{oitava}")
+    return notas
+
+
+GRELHAS = {
+    "semitons": grelha_notas("C4", "Db7", 2),        # Den_alg_Lin_10.pitches
+    "quartos_de_tom": grelha_notas("C4", "C#7", 1),  # flauta.spectral_data
+}
+
+
+def _hash_ficheiro(caminho):
+    sha1 = hashlib.sha1()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(bloco)
+    return sha1.hexdigest()[:16]
+
+
+def _caminho_cache(caminho, cache_dir):
+    return os.path.join(cache_dir, f"tabela_v{VERSAO_CACHE}_{_hash_ficheiro(caminho)}.npz")
+
+
+def _ler_ficheiro(caminho):
+    """Lê um ficheiro de tabela com pandas. Returns: (notas, valores (N, 3))."""
+    import pandas as pd  # só é necessário quando a tabela não está em cache
+
+    extensao = os.path.splitext(caminho)[1].lower()
+    if extensao in (".xlsx", ".xls"):
+        df = pd.read_excel(caminho, header=0)
+    elif extensao == ".csv":
+        df = pd.read_csv(caminho)
+    elif extensao == ".parquet":
+        df = pd.read_parquet(caminho)
+    else:
+        raise ValueError(f"Formato de tabela desconhecido: {caminho}")
+
+    em_falta = [coluna for coluna in COLUNAS_DINAMICAS if coluna not in df.columns]
+    if em_falta:
+        raise ValueError(f"Colunas em falta em {caminho}: {', '.join(em_falta)}")
+    notas = [str(nota).strip() for nota in df[COLUNA_NOTAS]] if COLUNA_NOTAS in df.columns else []
+    valores = df[COLUNAS_DINAMICAS].fillna(0).to_numpy(dtype=float)
+    return notas, valores
+
+
+def ler_tabela_bruta(caminho, cache_dir=None, caminho_cache=None):
+    """
+    Notas e valores de um ficheiro, tal como estão, vindos da cache .npz sempre que possível.
+
+    caminho_cache pode vir já calculado (_caminho_cache), para não ler o ficheiro duas vezes só para o hash.
+
+    Returns:
+        tuple: (notas, valores), com notas vazia se o ficheiro não tiver a coluna 'Notes'.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    caminho_cache = caminho_cache or _caminho_cache(caminho, cache_dir)
+    try:
+        with np.load(caminho_cache, allow_pickle=False) as dados:
+            notas, valores = dados["notas"].tolist(), dados["valores"]
+        contar("cache_tabelas.acertos")
+        return notas, valores
+    except (OSError, KeyError, ValueError):
+        contar("cache_tabelas.falhas")
+
+    import tempfile  # só é necessário para gravar a cache
+
+    logger.info("A ler %s", caminho)
+    notas, valores = _ler_ficheiro(caminho)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".npz", delete=False) as f:
+            np.savez(f, notas=np.array(notas, dtype=str), valores=valores)
+        os.replace(f.name, caminho_cache)
+    except OSError as e:
+        logger.warning("Não foi possível gravar a cache de %s: %s", caminho, e)
+    return notas, valores
+
+
+def validar_tabela(notas, valores, grelha):
+    """
+    Confere as notas com a grelha e devolve os valores de uma linha por nota da grelha.
+
+    Sem coluna de notas, as primeiras len(grelha) linhas são associadas à grelha
+    (como fazia Den_alg_Lin_10). Levanta ValueError com as diferenças.
+    """
+    if notas:
+        try:
+            passos = passos_notas(notas)
+        except ValueError as e:
+            raise ValueError(f"Nota inválida na tabela: {e}")
+        if len(notas) != len(grelha) or not np.array_equal(passos, passos_notas(grelha)):
+            diferencas = [f"Arquivo: '{n}', Esperado: '{p}'" for n, p in zip(notas, grelha)
+                          if passo_nota(n) != passo_nota(p)]
+            if len(diferencas) > MAX_DIFERENCAS:
+                diferencas = diferencas[:MAX_DIFERENCAS] + [f"... mais {len(diferencas) - MAX_DIFERENCAS}"]
+            if len(notas) != len(grelha):
+                diferencas.append(f"{len(notas)} notas no arquivo, {len(grelha)} esperadas")
+            raise ValueError(f"As notas no arquivo não correspondem às esperadas. Diferenças: {diferencas}")
+    elif len(valores) < len(grelha):
+        raise ValueError(f"A tabela tem {len(valores)} linhas, {len(grelha)} esperadas")
+    return valores[:len(grelha)]
+
+
+def carregar_tabela(caminho, grelha=GRELHAS["semitons"], cache_dir=None, caminho_cache=None):
+    """Tabela validada de um ficheiro: Tabela(nome, notas da grelha, valores (N, 3) pp/mf/ff)."""
+    notas, valores = ler_tabela_bruta(caminho, cache_dir, caminho_cache)
+    nome = os.path.splitext(os.path.basename(caminho))[0]
+    return Tabela(nome, list(grelha), validar_tabela(notas, valores, grelha))
+
+
+def _carregar_registo(args):
+    """
+    Carrega uma tabela de um lote; os erros (ficheiro ilegível ou corrompido,
+    colunas em falta, ...) ficam registados em vez de interromper o lote.
+    """
+    caminho, grelha, cache_dir, caminho_cache = args
+    try:
+        return carregar_tabela(caminho, grelha, cache_dir, caminho_cache), None
+    except Exception as e:
+        logger.debug("Tabela %s ignorada: %s", caminho, e)
+        return None, f"{type(e).__name__}: {e}"
+
+
+def ficheiros_tabelas(diretorio):
+    """Ficheiros de tabela do diretório, por ordem alfabética."""
+    return sorted(os.path.join(diretorio, nome) for nome in os.listdir(diretorio)
+                  if nome.lower().endswith(EXTENSOES) and not nome.startswith(("~$", ".")))
+
+
+def carregar_diretorio(diretorio, grelha=GRELHAS["semitons"], workers=None, cache_dir=None):
+    """
+    Carrega todas as tabelas de um diretório.
+
+    As tabelas já em cache são lidas no processo atual; só as restantes vão
+    para o conjunto de processos (workers=1: tudo no processo atual).
+
+    Returns:
+        tuple: (tabelas, erros), dicionários nome -> Tabela e nome -> mensagem.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    resultados, por_ler = [], []
+    with cronometro("carregar_tabelas"):
+        for caminho in ficheiros_tabelas(diretorio):
+            try:
+                caminho_cache = _caminho_cache(caminho, cache_dir)
+            except OSError as e:
+                resultados.append((caminho, (None, f"{type(e).__name__}: {e}")))
+                continue
+            if os.path.exists(caminho_cache):
+                resultados.append((caminho, _carregar_registo((caminho, grelha, cache_dir, caminho_cache))))
+            else:
+                por_ler.append((caminho, caminho_cache))
+
+        tarefas = [(caminho, grelha, cache_dir, caminho_cache) for caminho, caminho_cache in por_ler]
+        por_ler = [caminho for caminho, _ in por_ler]
+        if workers == 1 or len(tarefas) <= 1:
+            resultados.extend(zip(por_ler, map(_carregar_registo, tarefas)))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                resultados.extend(zip(por_ler, executor.map(_carregar_registo, tarefas)))
+
+    tabelas, erros = {}, {}
+    for caminho, (tabela, erro) in sorted(resultados):
+        nome = os.path.splitext(os.path.basename(caminho))[0]
+        if erro is None:
+            tabelas[nome] = tabela
+        else:
+            erros[nome] = erro
+    contar("tabelas_carregadas", len(tabelas))
+    return tabelas, erros
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lê e valida um diretório de tabelas de instrumentos.")
+    parser.add_argument("diretorio", help="Diretório com as tabelas (.xlsx, .xls, .csv, .parquet)")
+    parser.add_argument("--grelha", choices=list(GRELHAS), default="semitons", help="Grelha de alturas esperada")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Número de processos (1 = sem paralelismo; por omissão, todos os núcleos)")
+    parser.add_argument("--cache-dir", default=None, help="Diretório dos .npz (por omissão, .cache)")
+    adicionar_argumentos(parser)
+    args = parser.parse_args(argv)
+    aplicar_argumentos(args)
+
+    tabelas, erros = carregar_diretorio(args.diretorio, GRELHAS[args.grelha], args.workers, args.cache_dir)
+    for nome, tabela in tabelas.items():
+        print(f"{nome}: {len(tabela.notas)} notas")
+    for nome, erro in erros.items():
+        print(f"ERRO {nome}: {erro}", file=sys.stderr)
+    concluir_argumentos(args)
+    return 1 if erros else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from busca_voicings import ProblemaVoicing, procurar_voicings
+from density_pipeline import analisar_acorde
+
+
+def forca_bruta(classes, vozes, k, grandeza="densidade_total", ordenadas=True):
+    """As k menores pontuações do pipeline, percorrendo todas as disposições das notas com dados."""
+    problema = ProblemaVoicing(classes, vozes, grandeza=grandeza, ordenadas=ordenadas)
+    dinamicas = [voz.dinamica for voz in problema.vozes]
+    instrumentos = [voz.instrumento for voz in problema.vozes]
+    numeros_instrumentos = [voz.numero_instrumentos for voz in problema.vozes]
+    pontuacoes = []
+    for indices in itertools.product(*(range(passos.size) for passos in problema.passos)):
+        passos = [problema.passos[v][c] for v, c in enumerate(indices)]
+        if ordenadas and any(b <= a for a, b in zip(passos, passos[1:])):
+            continue
+        cobertas = np.bitwise_or.reduce([problema.classes[v][c] for v, c in enumerate(indices)])
+        if cobertas != problema.todas_classes:
+            continue
+        resultado = analisar_acorde(problema.notas(indices), dinamicas, instrumentos, numeros_instrumentos)
+        pontuacoes.append(resultado[grandeza])
+    return sorted(pontuacoes)[:k]
+
+
+@pytest.mark.parametrize("vozes, ordenadas", [
+    ([("flauta", "mf"), ("flauta", "p"), ("flauta", "f")], True),
+    ([("flauta", "pppp")] * 3, True),
+    ([("flauta", "pppp")] * 3, False),
+])
+@pytest.mark.parametrize("grandeza", ["densidade_ponderada", "densidade_total"])
+def test_procura_igual_a_forca_bruta(vozes, ordenadas, grandeza):
+    voicings = procurar_voicings(["C", "E", "G"], vozes, k=5, grandeza=grandeza, ordenadas=ordenadas, workers=1)
+    pontuacoes = [voicing.pontuacao for voicing in voicings]
+    assert np.all(np.isfinite(pontuacoes))
+    assert pontuacoes == sorted(pontuacoes)
+    np.testing.assert_allclose(pontuacoes, forca_bruta(["C", "E", "G"], vozes, 5, grandeza, ordenadas), rtol=1e-9)
+
+
+def test_procura_paralela_igual_a_serie():
+    vozes = [("flauta", "mf")] * 3
+    serie = procurar_voicings(["C", "E", "G"], vozes, k=5, workers=1)
+    paralela = procurar_voicings(["C", "E", "G"], vozes, k=5, workers=2)
+    np.testing.assert_allclose([v.pontuacao for v in paralela], [v.pontuacao for v in serie], rtol=1e-12)
+
+
+def test_notas_com_densidade_negativa_excluidas():
+    problema = ProblemaVoicing(["B", "C"], [("flauta", "pppp")] * 2)
+    assert all((densidades > 0).all() for densidades in problema.densidades)
@@ -0,0 +1,51 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import densidade_intervalar
+from densidade_intervalar import (AcumuladorDensidadeIntervalar, calcular_densidade_intervalar, contar_intervalos,
+                                  decrescimo_gaussiano, limite_erro_truncagem)
+from parser_notas import nota_para_posicao, posicoes_notas
+
+
+def pares(posicoes):
+    """Contagens por distância, percorrendo todos os pares."""
+    distancias = [abs(int(a) - int(b)) for a, b in itertools.combinations(posicoes, 2)]
+    return np.bincount(distancias, minlength=int(np.ptp(posicoes)) + 1)
+
+
+def densidade_pares(notas):
+    return sum(decrescimo_gaussiano(abs(int(a) - int(b))) for a, b in itertools.combinations(posicoes_notas(notas), 2))
+
+
+NOTAS = ["C4", "E4", "G4", "C#5", "D5", "D5", "F#+5", "A3", "Bb6"]
+
+
+@pytest.mark.parametrize("extensao", [30, 600, 5000])
+def test_contar_intervalos_igual_a_pares(extensao):
+    # Acima de LIMITE_CORRELACAO_DIRETA passos as contagens vêm da FFT
+    posicoes = np.random.default_rng(extensao).integers(0, extensao, 200)
+    np.testing.assert_array_equal(contar_intervalos(posicoes), pares(posicoes))
+
+
+@pytest.mark.parametrize("limite", [0, densidade_intervalar.LIMITE_CORRELACAO_DIRETA])
+def test_fft_e_correlacao_direta_iguais_a_pares(monkeypatch, limite):
+    monkeypatch.setattr(densidade_intervalar, "LIMITE_CORRELACAO_DIRETA", limite)
+    assert calcular_densidade_intervalar(NOTAS) == pytest.approx(densidade_pares(NOTAS), rel=1e-12)
+
+
+def test_truncagem_dentro_do_limite():
+    exata = calcular_densidade_intervalar(NOTAS)
+    truncada = calcular_densidade_intervalar(NOTAS, max_passos=20)
+    assert 0 <= exata - truncada <= limite_erro_truncagem(len(NOTAS), 20)
+
+
+def test_acumulador_igual_ao_calculo_completo():
+    acumulador = AcumuladorDensidadeIntervalar()
+    for nota in NOTAS:
+        acumulador.adicionar_posicao(nota_para_posicao(nota))
+    for nota in NOTAS[:3]:
+        acumulador.remover_posicao(nota_para_posicao(nota))
+    assert acumulador.total == pytest.approx(densidade_pares(NOTAS[3:]), rel=1e-12)
+    assert acumulador.recalcular() == pytest.approx(densidade_pares(NOTAS[3:]), rel=1e-12)
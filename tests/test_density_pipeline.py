@@ -0,0 +1,90 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import flauta
+from advanced_density_analysis import midi_to_frequency
+from densidade_intervalar import decrescimo_gaussiano
+from density_pipeline import analisar_acorde, analisar_bloco, componentes_bloco, preparar_acorde
+from parser_notas import nota_para_midi, posicoes_notas
+
+
+def referencia(notas, dinamicas, numeros_instrumentos, weight_factor=0.5):
+    """O cálculo original de Main.ao_clicar_no_botao_calcular, nota a nota e par a par."""
+    posicoes = posicoes_notas(notas)
+    densidade_intervalar = sum(decrescimo_gaussiano(abs(int(a) - int(b)))
+                               for a, b in itertools.combinations(posicoes, 2))
+    densidades = []
+    for nota, dinamica, num in zip(notas, dinamicas, numeros_instrumentos):
+        if dinamica in ['pp', 'mf', 'ff']:
+            densidade = flauta.calcular_densidade(nota, dinamica)
+        else:
+            valores = [flauta.calcular_densidade(nota, medida) for medida in ('pp', 'mf', 'ff')]
+            densidade = flauta.predict_intermediate_dynamics([nota], *([valor] for valor in valores))[dinamica][0]
+        densidades.append(densidade * np.sqrt(num))
+    densidades = np.array(densidades)
+
+    densidade_ponderada = sum(densidades) * weight_factor + densidade_intervalar * (1 - weight_factor)
+    pitches = np.array([nota_para_midi(nota) for nota in notas], dtype=float)
+    amplitude = pitches.max() - pitches.min()
+    densidade_refinada = densidade_ponderada / amplitude if amplitude != 0 else densidade_ponderada
+
+    centroide = densidades @ pitches / densidades.sum()
+    spread_midi = np.sqrt(densidades @ (pitches - centroide) ** 2 / densidades.sum())
+    spread = midi_to_frequency(centroide + spread_midi) - midi_to_frequency(centroide)
+    maxima = flauta.calculate_max_possible_density(notas, dinamicas, numeros_instrumentos)
+    return {
+        "densidade_intervalar": densidade_intervalar,
+        "densidade_instrumento": sum(densidades),
+        "densidade_ponderada": densidade_ponderada,
+        "densidade_refinada": densidade_refinada,
+        "densidade_total": densidade_refinada * spread / maxima,
+        "spectral_centroid_freq": midi_to_frequency(centroide),
+        "spectral_spread": spread,
+    }
+
+
+ACORDES = [
+    (["C4", "E4", "G4"], ["mf", "mf", "mf"], [1, 1, 1]),
+    (["C4", "Eb4", "G4", "Bb4"], ["pp", "ff", "mf", "pp"], [1, 2, 1, 3]),
+    (["D5", "D5", "A5"], ["ff", "pp", "mf"], [1, 1, 2]),
+    (["C4", "F#4", "C5", "F#5", "C6"], ["p", "f", "ppp", "fff", "mf"], [1, 1, 2, 1, 1]),
+]
+
+
+@pytest.mark.parametrize("notas, dinamicas, numeros_instrumentos", ACORDES)
+@pytest.mark.parametrize("weight_factor", [0.0, 0.3, 1.0])
+def test_analisar_acorde_igual_ao_calculo_original(notas, dinamicas, numeros_instrumentos, weight_factor):
+    resultado = analisar_acorde(notas, dinamicas, ["flauta"], numeros_instrumentos, weight_factor)
+    esperado = referencia(preparar_acorde(notas, dinamicas, ["flauta"], numeros_instrumentos)[0],
+                          dinamicas, numeros_instrumentos, weight_factor)
+    for campo, valor in esperado.items():
+        assert resultado[campo] == pytest.approx(valor, rel=1e-6), campo
+
+
+def test_analisar_bloco_igual_a_analisar_acorde():
+    tarefas = [({"id": i, "notas": notas, "dinamicas": dinamicas, "instrumentos": ["flauta"],
+                 "numeros_instrumentos": numeros}, 0.5)
+               for i, (notas, dinamicas, numeros) in enumerate(ACORDES)]
+    for linha, (notas, dinamicas, numeros) in zip(analisar_bloco(tarefas), ACORDES):
+        esperado = analisar_acorde(notas, dinamicas, ["flauta"], numeros)
+        assert not linha["erro"]
+        for campo in ("densidade_intervalar", "densidade_total", "spectral_spread", "spectral_skewness"):
+            assert linha[campo] == pytest.approx(esperado[campo], rel=1e-12), campo
+
+
+def test_componentes_bloco_rejeita_listas_de_tamanhos_diferentes():
+    with pytest.raises(ValueError):
+        componentes_bloco([(["C4", "E4", "G4"], ["mf", "mf"], ["flauta"] * 3, [1, 1, 1])])
+
+
+def test_analisar_bloco_regista_erro_sem_desalinhar():
+    tarefas = [({"id": 0, "notas": ["C4", "E4"], "dinamicas": ["mf"], "instrumentos": ["flauta"],
+                 "numeros_instrumentos": [1, 1]}, 0.5),
+               ({"id": 1, "notas": ACORDES[0][0], "dinamicas": ACORDES[0][1], "instrumentos": ["flauta"],
+                 "numeros_instrumentos": ACORDES[0][2]}, 0.5)]
+    erro, linha = analisar_bloco(tarefas)
+    assert erro["erro"] and erro["densidade_total"] is None
+    esperado = analisar_acorde(ACORDES[0][0], ACORDES[0][1], ["flauta"], ACORDES[0][2])
+    assert linha["densidade_total"] == pytest.approx(esperado["densidade_total"])
@@ -0,0 +1,70 @@
+import struct
+
+import pytest
+
+import midi_slices
+from midi_slices import fatias_midi, velocidade_para_dinamica
+
+
+def vlq(valor):
+    bytes_ = [valor & 0x7F]
+    while valor > 0x7F:
+        valor >>= 7
+        bytes_.insert(0, 0x80 | (valor & 0x7F))
+    return bytes(bytes_)
+
+
+def escrever_midi(caminho, pistas, ppq=480):
+    """Ficheiro de formato 1 com as pistas dadas como listas de (delta, bytes do evento)."""
+    dados = struct.pack('>4sIHHH', b'MThd', 6, 1, len(pistas), ppq)
+    for eventos in pistas:
+        corpo = b''.join(vlq(delta) + evento for delta, evento in eventos) + vlq(0) + b'\xff\x2f\x00'
+        dados += struct.pack('>4sI', b'MTrk', len(corpo)) + corpo
+    caminho.write_bytes(dados)
+    return caminho
+
+
+def tempo(microssegundos):
+    return b'\xff\x51\x03' + microssegundos.to_bytes(3, 'big')
+
+
+def test_running_status_e_mapa_de_tempo(tmp_path):
+    # Pista 0: 120 bpm e, no tick 480, 240 bpm. Pista 1: C4 e E4 (running status),
+    # C4 desligado no tick 480 por nota com velocidade 0 e E4 no tick 960 por note off.
+    caminho = escrever_midi(tmp_path / "teste.mid", [
+        [(0, tempo(500000)), (480, tempo(250000))],
+        [(0, b'\x90\x3c\x40'), (0, b'\x40\x70'), (480, b'\x3c\x00'), (480, b'\x80\x40\x00')],
+    ])
+    fatias = list(fatias_midi(caminho))
+    assert [fatia.notas for fatia in fatias] == [["C4", "E4"], ["E4"]]
+    assert [fatia.dinamicas for fatia in fatias] == [["mf", "fff"], ["fff"]]
+    assert [fatia.inicio for fatia in fatias] == pytest.approx([0.0, 0.5])
+    assert [fatia.duracao for fatia in fatias] == pytest.approx([0.5, 0.25])
+
+
+def test_notas_iguais_em_pistas_diferentes(tmp_path):
+    caminho = escrever_midi(tmp_path / "uníssono.mid", [
+        [(0, b'\x90\x45\x20'), (960, b'\x80\x45\x00')],
+        [(0, b'\x91\x45\x60'), (480, b'\x81\x45\x00')],
+    ])
+    fatias = list(fatias_midi(caminho))
+    assert [(fatia.notas, fatia.numeros_instrumentos, fatia.dinamicas) for fatia in fatias] == [
+        (["A4"], [2], ["ff"]), (["A4"], [1], ["pp"])]
+    assert [fatia.duracao for fatia in fatias] == pytest.approx([0.5, 0.5])
+
+
+def test_blocos_pequenos(tmp_path, monkeypatch):
+    monkeypatch.setattr(midi_slices, "TAMANHO_BLOCO", 3)
+    caminho = escrever_midi(tmp_path / "blocos.mid", [[(0, b'\x90\x3c\x40'), (1000, b'\x3c\x00')]])
+    assert [(fatia.notas, fatia.duracao) for fatia in fatias_midi(caminho)] == [(["C4"], pytest.approx(1000 / 960))]
+
+
+def test_dados_sem_status(tmp_path):
+    caminho = escrever_midi(tmp_path / "invalido.mid", [[(0, b'\x3c\x40')]])
+    with pytest.raises(ValueError):
+        list(fatias_midi(caminho))
+
+
+@pytest.mark.parametrize("velocidade, dinamica", [(1, "pppp"), (15, "pppp"), (16, "ppp"), (64, "mf"), (127, "ffff")])
+def test_velocidade_para_dinamica(velocidade, dinamica):
+    assert velocidade_para_dinamica(velocidade) == dinamica
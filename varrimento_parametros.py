@@ -0,0 +1,246 @@
+# varrimento_parametros.py
+
+"""
+Varrimento de SIGMA (densidade_intervalar) e de weight_factor para calibrar o modelo.
+
+A densidade intervalar de um acorde é sum_d contagens[d] * exp(-d² / (2 SIGMA²)),
+em que contagens[d] é o número de pares de notas à distância d
+(contar_intervalos). Cada acorde é analisado uma única vez: guardam-se o
+seu perfil de contagens e as grandezas que não dependem de SIGMA nem do peso
+(densidade do instrumento, amplitude, spread, densidade máxima). Depois, a
+densidade de todos os acordes para uma grelha de SIGMA é um produto de
+matrizes (contagens x tabela gaussiana), e a combinação com os pesos de
+combinar_componentes é feita por broadcasting num cubo
+(acordes x sigmas x pesos).
+
+Exemplo:
+    python varrimento_parametros.py acordes.csv cubo.npz --sigmas 10:100:5 --pesos 0:1:0.05
+"""
+
+import os
+import sys
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+
+from densidade_intervalar import contar_intervalos
+from density_pipeline import (_formato, componentes_acorde, componentes_acordes, ler_acordes_csv,
+                              ler_acordes_jsonl, mapa_limitado, preparar_acorde)
+from instrumentacao import (adicionar_argumentos, aplicar_argumentos, concluir_argumentos, contar,
+                            cronometrado, obter_logger)
+from parser_notas import posicoes_notas
+
+
+# Perfis de n acordes. Os perfis de contagens estão num formato esparso por linhas:
+# as distâncias e contagens não nulas do acorde i estão em [offsets[i], offsets[i + 1]).
+PerfisAcordes = namedtuple("PerfisAcordes", [
+    "ids", "distancias", "contagens", "offsets",
+    "densidade_instrumento", "amplitude", "spectral_spread", "max_possible_density",
+])
+
+GRANDEZAS = ("densidade_intervalar", "densidade_ponderada", "densidade_refinada", "densidade_total")
+
+# Acordes por bloco no produto contagens x tabela gaussiana
+TAMANHO_BLOCO = 4096
+# Acordes analisados de uma vez (e por tarefa de cada processo) em perfis_acordes
+TAMANHO_BLOCO_PERFIS = 1024
+
+logger = obter_logger(__name__)
+
+
+def perfil_acorde(acorde):
+    """Perfil de um acorde lido de ficheiro, ou (id, None, mensagem) se não puder ser analisado."""
+    try:
+        notas, dinamicas, instrumentos, numeros_instrumentos = preparar_acorde(
+            acorde['notas'], acorde['dinamicas'], acorde['instrumentos'], acorde['numeros_instrumentos'])
+        # A densidade intervalar é calculada para cada SIGMA a partir das contagens
+        componentes = componentes_acorde(notas, dinamicas, instrumentos, numeros_instrumentos, densidade_intervalar=0.0)
+        contagens = contar_intervalos(posicoes_notas(notas))
+    except Exception as e:
+        contar("acordes_com_erro")
+        logger.debug("Acorde %s ignorado: %s", acorde.get('id'), e)
+        return acorde.get('id'), None, str(e)
+    distancias = np.flatnonzero(contagens)
+    grandezas = (componentes["densidade_instrumento"], componentes["amplitude"],
+                 componentes["spectral_spread"], componentes["max_possible_density"])
+    return acorde.get('id'), (distancias, contagens[distancias], grandezas), None
+
+
+def perfis_bloco(acordes):
+    """
+    Perfis de um bloco de acordes, com uma só avaliação dos instrumentos e dos
+    momentos espectrais para todas as notas do bloco (componentes_acordes).
+    Os acordes que não podem ser avaliados em bloco são analisados à parte por
+    perfil_acorde, que regista o erro.
+    """
+    perfis = []
+    for acorde, componentes in zip(acordes, componentes_acordes(acordes, densidade_intervalar=0.0)):
+        if componentes is None:
+            perfis.append(perfil_acorde(acorde))
+            continue
+        contagens = contar_intervalos(posicoes_notas(componentes["notas"]))
+        distancias = np.flatnonzero(contagens)
+        grandezas = (componentes["densidade_instrumento"], componentes["amplitude"],
+                     componentes["spectral_spread"], componentes["max_possible_density"])
+        perfis.append((acorde.get('id'), (distancias, contagens[distancias], grandezas), None))
+    return perfis
+
+
+def _blocos(acordes, tamanho):
+    acordes = iter(acordes)
+    while True:
+        bloco = list(islice(acordes, tamanho))
+        if not bloco:
+            return
+        yield bloco
+
+
+@cronometrado("perfis_acordes")
+def perfis_acordes(acordes, workers=None, tamanho_bloco=TAMANHO_BLOCO_PERFIS):
+    """
+    Analisa os acordes uma única vez, em blocos (workers=1: no processo atual).
+    Com vários processos, só 2 blocos por processo estão em curso de cada vez,
+    e os acordes seguintes só são lidos quando há lugar.
+
+    Returns:
+        tuple: (PerfisAcordes, erros), com erros uma lista de (id, mensagem).
+    """
+    blocos = _blocos(acordes, tamanho_bloco)
+    if workers == 1:
+        resultados = [perfil for bloco in map(perfis_bloco, blocos) for perfil in bloco]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            resultados = [perfil for bloco in mapa_limitado(executor, perfis_bloco, blocos, 2 * workers)
+                          for perfil in bloco]
+
+    ids, distancias, contagens, grandezas, erros = [], [], [], [], []
+    for identificador, perfil, erro in resultados:
+        if perfil is None:
+            erros.append((identificador, erro))
+            continue
+        ids.append(identificador)
+        distancias.append(perfil[0])
+        contagens.append(perfil[1])
+        grandezas.append(perfil[2])
+
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum([d.size for d in distancias], out=offsets[1:])
+    grandezas = np.array(grandezas, dtype=float).reshape(len(ids), 4).T
+    perfis = PerfisAcordes(
+        ids,
+        np.concatenate(distancias) if distancias else np.zeros(0, dtype=np.int64),
+        np.concatenate(contagens).astype(float) if contagens else np.zeros(0),
+        offsets, *grandezas,
+    )
+    return perfis, erros
+
+
+def densidades_intervalares(perfis, sigmas, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Densidade intervalar de cada acorde para cada SIGMA.
+
+    Returns:
+        np.ndarray: (acordes, sigmas).
+    """
+    sigmas = np.asarray(sigmas, dtype=float)
+    n = len(perfis.ids)
+    resultado = np.zeros((n, sigmas.size))
+    if not perfis.distancias.size:
+        return resultado
+    passos = np.arange(int(perfis.distancias.max()) + 1, dtype=float)
+    tabela = np.exp(-(passos[:, None] ** 2) / (2 * sigmas[None, :] ** 2))
+    linhas = np.repeat(np.arange(n), np.diff(perfis.offsets))
+    for inicio in range(0, n, tamanho_bloco):
+        fim = min(inicio + tamanho_bloco, n)
+        a, b = perfis.offsets[inicio], perfis.offsets[fim]
+        contagens = np.zeros((fim - inicio, passos.size))
+        contagens[linhas[a:b] - inicio, perfis.distancias[a:b]] = perfis.contagens[a:b]
+        resultado[inicio:fim] = contagens @ tabela
+    return resultado
+
+
+@cronometrado("cubo_densidades")
+def cubo_densidades(perfis, sigmas, weight_factors, grandeza="densidade_total"):
+    """
+    Grandeza pedida de cada acorde para cada par (SIGMA, weight_factor), como em combinar_componentes.
+
+    Returns:
+        np.ndarray: (acordes, sigmas, pesos); densidade_intervalar é (acordes, sigmas).
+    """
+    if grandeza not in GRANDEZAS:
+        raise ValueError(f"Grandeza desconhecida: {grandeza}")
+    intervalar = densidades_intervalares(perfis, sigmas)
+    if grandeza == "densidade_intervalar":
+        return intervalar
+
+    pesos = np.asarray(weight_factors, dtype=float)[None, None, :]
+    cubo = perfis.densidade_instrumento[:, None, None] * pesos + intervalar[:, :, None] * (1 - pesos)
+    if grandeza == "densidade_ponderada":
+        return cubo
+
+    amplitude = perfis.amplitude[:, None, None]
+    cubo = np.divide(cubo, amplitude, out=cubo, where=amplitude != 0)
+    if grandeza == "densidade_refinada":
+        return cubo
+
+    maximo = perfis.max_possible_density[:, None, None]
+    return np.divide(cubo * perfis.spectral_spread[:, None, None], maximo, out=cubo, where=maximo != 0)
+
+
+def varrer(acordes, sigmas, weight_factors, grandeza="densidade_total", workers=None):
+    """
+    Perfis e cubo de uma só vez.
+
+    Returns:
+        tuple: (ids, cubo (acordes x sigmas x pesos), erros).
+    """
+    perfis, erros = perfis_acordes(acordes, workers)
+    return perfis.ids, cubo_densidades(perfis, sigmas, weight_factors, grandeza), erros
+
+
+def _valores(texto):
+    """'10,20,50' ou 'inicio:fim:passo' (fim incluído)."""
+    if ':' in texto:
+        inicio, fim, passo = map(float, texto.split(':'))
+        return np.arange(inicio, fim + passo / 2, passo)
+    return np.array([float(valor) for valor in texto.split(',')])
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Varrimento de SIGMA e weight_factor sobre um corpus de acordes.")
+    parser.add_argument("entrada", help="Ficheiro de acordes (.csv ou .jsonl, como em density_pipeline.py)")
+    parser.add_argument("saida", help="Ficheiro .npz com ids, sigmas, weight_factors e cubo")
+    parser.add_argument("--formato-entrada", choices=['csv', 'jsonl'])
+    parser.add_argument("--sigmas", type=_valores, default=_valores("10:100:10"),
+                        help="Valores de SIGMA: lista '10,50' ou intervalo 'inicio:fim:passo'")
+    parser.add_argument("--pesos", type=_valores, default=_valores("0:1:0.1"),
+                        help="Valores de weight_factor: lista ou intervalo 'inicio:fim:passo'")
+    parser.add_argument("--grandeza", choices=GRANDEZAS, default="densidade_total")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Número de processos (1 = sem paralelismo; por omissão, todos os núcleos)")
+    adicionar_argumentos(parser)
+    args = parser.parse_args(argv)
+    aplicar_argumentos(args)
+
+    if _formato(args.entrada, args.formato_entrada) == 'csv':
+        acordes = ler_acordes_csv(args.entrada)
+    else:
+        acordes = ler_acordes_jsonl(args.entrada)
+
+    ids, cubo, erros = varrer(acordes, args.sigmas, args.pesos, args.grandeza, args.workers)
+    np.savez(args.saida, ids=np.array(ids, dtype=str), sigmas=args.sigmas, weight_factors=args.pesos, cubo=cubo)
+    for identificador, erro in erros:
+        print(f"ERRO {identificador}: {erro}", file=sys.stderr)
+    print(f"{len(ids)} acordes x {len(args.sigmas)} sigmas x {len(args.pesos)} pesos -> {args.saida}", file=sys.stderr)
+    concluir_argumentos(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())